@@ -5,8 +5,9 @@ API路由 - 统一API接口
 
 import logging
 import time
-from flask import Blueprint, request, jsonify
-from ..core.auth import auth_required, optional_auth
+from flask import Blueprint, Response, request, jsonify
+from werkzeug.exceptions import HTTPException
+from ..core.auth import auth_required, optional_auth, signed_or_auth_required
 
 logger = logging.getLogger(__name__)
 
@@ -189,6 +190,185 @@ def api_download_list():
         return jsonify({"error": "获取列表失败"}), 500
 
 
+@api_bp.route('/download/events')
+@auth_required
+def api_download_events():
+    """下载状态实时推送（Server-Sent Events，支持 Last-Event-ID 续传）
+
+    每个连接最长占用一个工作线程 max_duration 秒。同步多进程 worker
+    （如默认的 gunicorn sync）下会很快耗尽所有 worker，此时拒绝连接，
+    前端收到非 200 响应后回退为轮询。
+    """
+    try:
+        from ..core.config import get_config
+        from ..modules.downloader.live import get_download_event_stream
+
+        if not _sse_supported(get_config('live_updates.sse', 'auto')):
+            return jsonify({"error": "当前服务器不支持实时推送，请使用轮询", "fallback": "polling"}), 503
+
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        stream = get_download_event_stream().stream(
+            last_event_id,
+            heartbeat=get_config('live_updates.heartbeat', 15),
+            max_duration=get_config('live_updates.max_duration', 300),
+        )
+        return Response(stream, mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+        })
+
+    except Exception as e:
+        logger.error(f"❌ 建立实时推送失败: {e}")
+        return jsonify({"error": "建立实时推送失败"}), 500
+
+
+def _sse_supported(mode) -> bool:
+    """判断是否接受SSE长连接（mode: auto / true / false）
+
+    auto 时只拒绝每个进程单线程的预派生 worker（wsgi.multiprocess 且非
+    wsgi.multithread）；gevent 等协程 worker 不报告多线程，需显式设为 true。
+    """
+    if mode is True or mode is False:
+        return mode
+    environ = request.environ
+    return bool(environ.get('wsgi.multithread')) or not environ.get('wsgi.multiprocess')
+
+
+@api_bp.route('/download/history')
+@auth_required
+def api_download_history():
+    """分页获取下载历史（游标分页，数据来自数据库）
+
+    参数: limit, cursor, status(逗号分隔), source, host, date_from, date_to (YYYY-MM-DD),
+          order (desc/asc), counts=1 时附带各状态统计
+    """
+    try:
+        import re
+        from ..core.database import get_database
+        from ..modules.downloader.manager import get_download_manager
+
+        try:
+            limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+        except ValueError:
+            return jsonify({"error": "limit参数无效"}), 400
+
+        date_from = request.args.get('date_from') or None
+        date_to = request.args.get('date_to') or None
+        for value in (date_from, date_to):
+            if value and not re.match(r'^\d{4}-\d{2}-\d{2}$', value):
+                return jsonify({"error": "日期格式应为YYYY-MM-DD"}), 400
+
+        statuses = [s for s in (request.args.get('status') or '').split(',') if s and s != 'all']
+        source = request.args.get('source')
+        order = 'asc' if request.args.get('order') == 'asc' else 'desc'
+
+        db = get_database()
+        try:
+            page = db.get_download_history(
+                limit=limit,
+                cursor=request.args.get('cursor') or None,
+                statuses=statuses,
+                source=source if source and source != 'all' else None,
+                host=request.args.get('host') or None,
+                date_from=date_from,
+                date_to=date_to,
+                order=order
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        live = get_download_manager().get_live_downloads([r['id'] for r in page['items']])
+        response_data = {
+            "success": True,
+            "downloads": [_format_history_record(r, live) for r in page['items']],
+            "next_cursor": page['next_cursor'],
+            "has_more": page['has_more'],
+        }
+        if request.args.get('counts') == '1':
+            response_data["counts"] = db.get_download_status_counts()
+
+        return jsonify(response_data)
+
+    except Exception as e:
+        logger.error(f"❌ API获取下载历史失败: {e}")
+        return jsonify({"error": "获取历史失败"}), 500
+
+
+@api_bp.route('/download/search')
+@auth_required
+def api_download_search():
+    """全文搜索下载历史（标题/上传者/URL/提取器/标签），按相关度排序
+
+    参数: q, limit, offset, status(逗号分隔), source
+    """
+    try:
+        from ..core.database import get_database
+        from ..modules.downloader.manager import get_download_manager
+
+        query = (request.args.get('q') or '').strip()
+        if not query:
+            return jsonify({"error": "需要提供搜索关键词"}), 400
+
+        try:
+            limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+            offset = min(max(int(request.args.get('offset', 0)), 0), 1000)
+        except ValueError:
+            return jsonify({"error": "分页参数无效"}), 400
+
+        statuses = [s for s in (request.args.get('status') or '').split(',') if s and s != 'all']
+        source = request.args.get('source')
+        result = get_database().search_downloads(
+            query, limit=limit, offset=offset, statuses=statuses,
+            source=source if source and source != 'all' else None
+        )
+
+        live = get_download_manager().get_live_downloads([r['id'] for r in result['items']])
+        items = []
+        for record in result['items']:
+            item = _format_history_record(record, live)
+            item["snippet"] = record["snippet"]
+            item["uploader"] = record.get("uploader")
+            item["score"] = round(-record["rank"], 4)
+            items.append(item)
+
+        return jsonify({
+            "success": True,
+            "query": query,
+            "downloads": items,
+            "offset": offset,
+            "has_more": result['has_more'],
+        })
+
+    except Exception as e:
+        logger.error(f"❌ API搜索下载历史失败: {e}")
+        return jsonify({"error": "搜索失败"}), 500
+
+
+def _format_history_record(record, live_downloads):
+    """格式化数据库中的下载记录，进行中的任务使用内存中的实时状态"""
+    live = live_downloads.get(record['id']) or {}
+    status = live.get('status') or record['status']
+    item = {
+        "id": record["id"],
+        "url": record["url"],
+        "title": live.get("title") or record["title"],
+        "status": status,
+        "progress": live['progress'] if live else record["progress"],
+        "source": record.get("source"),
+        "host": record.get("host"),
+        "created_at": _db_timestamp_to_iso(record["created_at"]),
+        "completed_at": _db_timestamp_to_iso(record["completed_at"]),
+    }
+    file_path = live.get("file_path") or record["file_path"]
+    if status == "completed" and file_path:
+        item["filename"] = file_path.split("/")[-1]
+        item["file_size"] = live.get("file_size") or record["file_size"]
+    error_message = live.get("error_message") or record["error_message"]
+    if status == "failed" and error_message:
+        item["error_message"] = error_message
+    return item
+
+
 @api_bp.route('/video/info', methods=['POST'])
 @auth_required
 def api_video_info():
@@ -420,16 +600,20 @@ def api_system_status():
             logger.warning(f"检查yt-dlp状态失败: {e}")
             pass
 
-        # 获取下载统计
+        # 获取下载统计（增量计数器，不遍历任务列表）
+        from ..core.events import event_bus
+        from ..core.outbox import get_outbox_dispatcher
+        from ..core.coordinator import get_coordinator
         from ..modules.downloader.manager import get_download_manager
-        download_manager = get_download_manager()
-        downloads = download_manager.get_all_downloads()
+        from ..modules.files.dedup import get_dedup_service
+        from ..modules.files.catalog import get_media_catalog
+        counts = get_download_manager().get_status_counts()
 
         download_stats = {
-            "total": len(downloads),
-            "completed": len([d for d in downloads if d["status"] == "completed"]),
-            "failed": len([d for d in downloads if d["status"] == "failed"]),
-            "pending": len([d for d in downloads if d["status"] in ["pending", "downloading"]]),
+            "total": counts["total"],
+            "completed": counts.get("completed", 0),
+            "failed": counts.get("failed", 0),
+            "pending": counts.get("pending", 0) + counts.get("downloading", 0),
         }
 
         return jsonify({
@@ -438,6 +622,11 @@ def api_system_status():
             "ytdlp_available": ytdlp_available,
             "ytdlp_version": ytdlp_version,
             "download_stats": download_stats,
+            "event_bus": event_bus.get_stats(),
+            "outbox": get_outbox_dispatcher().get_stats(),
+            "coordination": get_coordinator().get_status(),
+            "dedup": get_dedup_service().get_stats(),
+            "media_catalog": get_media_catalog().get_stats(),
         })
 
     except Exception as e:
@@ -445,6 +634,40 @@ def api_system_status():
         return jsonify({"error": "获取状态失败"}), 500
 
 
+@api_bp.route('/system/stats')
+@auth_required
+def api_system_stats():
+    """下载统计（读取小时/日汇总表）
+
+    参数: granularity (hourly/daily)，days 统计最近天数（默认 hourly 1天，daily 30天）
+    """
+    try:
+        from datetime import datetime, timedelta
+        from ..core.database import get_database
+        from ..modules.downloader.manager import get_download_manager
+
+        granularity = 'hourly' if request.args.get('granularity') == 'hourly' else 'daily'
+        try:
+            days = int(request.args.get('days', 1 if granularity == 'hourly' else 30))
+            days = min(max(days, 1), 7 if granularity == 'hourly' else 366)
+        except ValueError:
+            return jsonify({"error": "days参数无效"}), 400
+
+        since = (datetime.utcnow() - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+        stats = get_database().get_download_stats(granularity, since=since)
+
+        return jsonify({
+            "success": True,
+            "since": since,
+            "live": get_download_manager().get_status_counts(),
+            **stats,
+        })
+
+    except Exception as e:
+        logger.error(f"❌ 获取下载统计失败: {e}")
+        return jsonify({"error": "获取统计失败"}), 500
+
+
 @api_bp.route('/debug/users')
 def api_debug_users():
     """调试用户信息（无需认证，仅用于调试）"""
@@ -760,17 +983,21 @@ def api_save_download_settings():
 @api_bp.route('/settings/api-key', methods=['GET'])
 @auth_required
 def api_get_api_key():
-    """获取API密钥设置"""
+    """获取API密钥设置（密钥只保存哈希，这里仅返回前缀）"""
     try:
         from ..core.database import get_database
-        db = get_database()
-
-        api_key = db.get_setting("api_key", "")
+        keys = get_database().get_api_keys()
 
         return jsonify({
             "success": True,
-            "api_key": api_key,
-            "has_key": bool(api_key)
+            "api_key": _mask_api_key(keys[-1]) if keys else "",
+            "has_key": bool(keys),
+            "keys": [{
+                "id": k["id"],
+                "name": k.get("name", ""),
+                "masked": _mask_api_key(k),
+                "created_at": k.get("created_at"),
+            } for k in keys]
         })
 
     except Exception as e:
@@ -781,7 +1008,10 @@ def api_get_api_key():
 @api_bp.route('/settings/api-key', methods=['POST'])
 @auth_required
 def api_save_api_key():
-    """保存API密钥设置"""
+    """保存API密钥设置
+
+    api_key 为空时删除全部密钥；为已有密钥的掩码时保持不变；否则添加为新密钥。
+    """
     try:
         data = request.get_json()
         if not data:
@@ -791,13 +1021,19 @@ def api_save_api_key():
 
         from ..core.database import get_database
         db = get_database()
+        keys = db.get_api_keys()
 
-        if api_key:
-            db.set_setting("api_key", api_key)
-            message = "API密钥保存成功"
-        else:
-            db.delete_setting("api_key")
+        if not api_key:
+            db.delete_api_key()
             message = "API密钥已删除"
+        elif any(api_key == _mask_api_key(k) for k in keys):
+            message = "API密钥未变更"
+        else:
+            if len(api_key) < 16:
+                return jsonify({"error": "API密钥长度至少16位"}), 400
+            if not db.add_api_key(api_key, name=data.get("name"), replace=bool(data.get("replace", True))):
+                return jsonify({"error": "保存API密钥失败"}), 500
+            message = "API密钥保存成功"
 
         return jsonify({
             "success": True,
@@ -812,23 +1048,31 @@ def api_save_api_key():
 @api_bp.route('/settings/api-key/generate', methods=['POST'])
 @auth_required
 def api_generate_api_key():
-    """生成新的API密钥"""
+    """生成新的API密钥（明文只在此时返回一次）
+
+    可选参数: name 密钥名称，replace=false 时保留已有密钥（多设备各用一个密钥）
+    """
     try:
         import secrets
         import string
 
+        data = request.get_json(silent=True) or {}
+
         # 生成32位随机API密钥
         alphabet = string.ascii_letters + string.digits
         api_key = ''.join(secrets.choice(alphabet) for _ in range(32))
 
         from ..core.database import get_database
-        db = get_database()
-        db.set_setting("api_key", api_key)
+        record = get_database().add_api_key(api_key, name=data.get("name"),
+                                            replace=bool(data.get("replace", True)))
+        if not record:
+            return jsonify({"error": "生成API密钥失败"}), 500
 
         return jsonify({
             "success": True,
             "api_key": api_key,
-            "message": "新API密钥生成成功"
+            "id": record["id"],
+            "message": "新API密钥生成成功，请立即保存，之后将无法再次查看"
         })
 
     except Exception as e:
@@ -836,6 +1080,21 @@ def api_generate_api_key():
         return jsonify({"error": "生成API密钥失败"}), 500
 
 
+@api_bp.route('/settings/api-key/<key_id>', methods=['DELETE'])
+@auth_required
+def api_delete_api_key(key_id):
+    """吊销单个API密钥"""
+    try:
+        from ..core.database import get_database
+        if not get_database().delete_api_key(key_id):
+            return jsonify({"error": "API密钥不存在"}), 404
+        return jsonify({"success": True, "message": "API密钥已吊销"})
+
+    except Exception as e:
+        logger.error(f"❌ 吊销API密钥失败: {e}")
+        return jsonify({"error": "吊销API密钥失败"}), 500
+
+
 @api_bp.route("/system/cleanup", methods=["POST"])
 @auth_required
 def api_manual_cleanup():
@@ -876,19 +1135,19 @@ def api_system_paths():
         download_path = Path(download_dir)
         temp_path = Path(temp_dir)
 
-        # 获取文件列表
+        # 获取文件列表（来自下载目录索引）
         download_files = []
         if download_path.exists():
             try:
+                from ..modules.files.index import get_library_index
                 download_files = [
                     {
-                        'name': f.name,
-                        'size': f.stat().st_size,
-                        'modified': f.stat().st_mtime,
-                        'is_video': f.suffix.lower() in ['.mp4', '.avi', '.mkv', '.mov', '.webm']
+                        'name': entry['name'],
+                        'size': entry['size'],
+                        'modified': entry['modified'],
+                        'is_video': entry['kind'] == 'video'
                     }
-                    for f in download_path.iterdir()
-                    if f.is_file()
+                    for entry in get_library_index().list_files()
                 ]
             except Exception as e:
                 logger.warning(f"读取下载目录失败: {e}")
@@ -999,12 +1258,13 @@ def api_shortcuts_download():
 
         download_id = result['data']['download_id']
 
-        # 返回简化的响应
+        # 返回简化的响应（状态地址带签名，轮询时无需再次认证）
+        from ..core.auth import sign_url
         response = {
             "success": True,
             "message": "下载已开始",
             "download_id": download_id,
-            "status_url": f"/api/shortcuts/status/{download_id}"
+            "status_url": sign_url(f"/api/shortcuts/status/{download_id}", 'status', download_id)
         }
 
         # 如果需要，添加认证令牌
@@ -1019,8 +1279,12 @@ def api_shortcuts_download():
 
 
 @api_bp.route('/shortcuts/status/<download_id>')
+@signed_or_auth_required('status', 'download_id')
 def api_shortcuts_status(download_id):
-    """iOS快捷指令状态查询 - 无需认证"""
+    """iOS快捷指令状态查询 - 签名地址或登录认证
+
+    下载完成后返回带签名的文件地址（有效期 auth.signed_url_ttl），下载时只校验签名。
+    """
     try:
         from ..modules.downloader.manager import get_download_manager
         download_manager = get_download_manager()
@@ -1039,11 +1303,13 @@ def api_shortcuts_status(download_id):
 
         # 如果下载完成，添加文件信息
         if download_info["status"] == "completed" and download_info.get("file_path"):
+            from urllib.parse import quote
+            from ..core.auth import sign_url
             filename = download_info["file_path"].split("/")[-1]
             response.update({
                 "filename": filename,
                 "file_size": download_info.get("file_size", 0),
-                "download_url": f"/api/shortcuts/file/{filename}",
+                "download_url": sign_url(f"/api/shortcuts/file/{quote(filename)}", 'file', filename),
                 "completed": True
             })
         elif download_info["status"] == "failed":
@@ -1057,11 +1323,13 @@ def api_shortcuts_status(download_id):
 
 
 @api_bp.route('/shortcuts/file/<filename>')
+@signed_or_auth_required('file')
 def api_shortcuts_file(filename):
-    """iOS快捷指令文件下载 - 无需认证"""
+    """iOS快捷指令文件下载 - 签名地址或登录认证（支持断点续传）"""
     try:
+        import mimetypes
         from ..core.config import get_config
-        from flask import send_file
+        from ..modules.files.streaming import send_media
         from pathlib import Path
 
         # 获取下载目录
@@ -1073,12 +1341,14 @@ def api_shortcuts_file(filename):
             logger.warning(f"尝试访问下载目录外的文件: {filename}")
             return jsonify({"error": "文件访问被拒绝"}), 403
 
-        if not file_path.exists():
+        if not file_path.is_file():
             return jsonify({"error": "文件不存在"}), 404
 
-        # 返回文件
-        return send_file(file_path, as_attachment=True)
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        return send_media(file_path, mimetype, as_attachment=True)
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"❌ 文件下载失败: {e}")
         return jsonify({"error": "文件下载失败"}), 500
@@ -1109,24 +1379,31 @@ def api_shortcuts_info():
         return jsonify({"error": "获取信息失败"}), 500
 
 
+def _db_timestamp_to_iso(value):
+    """数据库UTC时间戳（YYYY-MM-DD HH:MM:SS）转换为ISO格式"""
+    if not value or not isinstance(value, str):
+        return value
+    if len(value) == 19 and value[10] == ' ':
+        return value.replace(' ', 'T') + 'Z'
+    return value
+
+
 def _verify_api_key(api_key: str) -> bool:
-    """验证API密钥"""
+    """验证API密钥（缓存的哈希列表，常量时间比较）"""
     try:
         from ..core.database import get_database
-        db = get_database()
-
-        # 从设置中获取API密钥
-        stored_key = db.get_setting("api_key")
-        if not stored_key:
-            return False
-
-        return api_key == stored_key
+        return get_database().verify_api_key(api_key)
 
     except Exception as e:
         logger.error(f"❌ API密钥验证失败: {e}")
         return False
 
 
+def _mask_api_key(key: dict) -> str:
+    """API密钥掩码显示"""
+    return f"{key.get('prefix', '')}••••••••"
+
+
 # ==================== 辅助函数 ====================
 
 def _extract_video_info(url: str):
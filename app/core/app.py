@@ -43,6 +43,9 @@ def create_app(config_override=None):
         # 注册错误处理器
         _register_error_handlers(app)
 
+        # 启动后台服务
+        _start_background_services(app)
+
         # 发送应用启动事件
         with app.app_context():
             from .events import emit, Events
@@ -137,6 +140,15 @@ def _initialize_core_components(app: Flask):
                 raise Exception("管理员用户创建失败")
 
             logger.info("✅ 数据库初始化完成")
+
+            # 已有数据库切换为增量回收（完整VACUUM，需显式开启；在协调者选举前执行）
+            from .config import get_config
+            if get_config('database.maintenance.convert_auto_vacuum', False):
+                try:
+                    if db.enable_incremental_vacuum():
+                        logger.info("🔧 数据库已切换为增量回收模式（完整VACUUM）")
+                except Exception as e:
+                    logger.warning(f"⚠️ 切换增量回收模式失败: {e}")
             
             # 初始化认证管理器
             from .auth import get_auth_manager
@@ -152,6 +164,56 @@ def _initialize_core_components(app: Flask):
             raise
 
 
+def _start_background_services(app: Flask):
+    """启动后台服务"""
+    try:
+        # 多进程部署时只有协调进程运行下载与定时任务
+        from .coordinator import get_coordinator
+        coordinator = get_coordinator()
+
+        # 订阅调度器
+        from ..modules.subscriptions.manager import get_subscription_manager
+        coordinator.add_leader_service(get_subscription_manager())
+
+        # 下载历史归档与数据库空闲维护
+        from ..modules.downloader.maintenance import get_history_maintenance
+        coordinator.add_leader_service(get_history_maintenance())
+
+        # 下载目录重复文件合并
+        from ..modules.files.dedup import get_dedup_service
+        coordinator.add_leader_service(get_dedup_service())
+
+        # 发件箱分发器（导入通知模块以注册投递处理器）
+        from ..modules.telegram import notifier
+        from .outbox import get_outbox_dispatcher
+        coordinator.add_leader_service(get_outbox_dispatcher())
+
+        # 下载目录索引（文件列表、自动清理与下载管理器共用）
+        from ..modules.files.index import get_library_index
+        get_library_index().start()
+
+        # 媒体信息目录（通知、文件列表与播放方式共用）
+        from ..modules.files.catalog import get_media_catalog
+        get_media_catalog().start()
+
+        # 视频缩略图与拖动预览图后台生成
+        from ..modules.files.thumbnails import get_thumbnail_service
+        get_thumbnail_service().start()
+
+        # 下载状态实时推送
+        from ..modules.downloader.live import get_download_event_stream
+        get_download_event_stream().start()
+
+        # 成为协调者时创建下载管理器，接管排队中的任务
+        from ..modules.downloader.manager import get_download_manager
+        coordinator.add_listener(get_download_manager)
+
+        coordinator.start()
+
+    except Exception as e:
+        logger.warning(f"⚠️ 启动后台服务失败: {e}")
+
+
 def _register_blueprints(app: Flask):
     """注册蓝图"""
     try:
@@ -188,6 +250,11 @@ def _register_blueprints(app: Flask):
         from ..modules.files.routes import files_bp
 
         app.register_blueprint(files_bp, url_prefix="/files")
+
+        # 订阅管理蓝图
+        from ..modules.subscriptions.routes import subscriptions_bp
+
+        app.register_blueprint(subscriptions_bp, url_prefix="/subscriptions")
         
         logger.info("✅ 蓝图注册完成")
         
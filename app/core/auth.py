@@ -245,6 +245,81 @@ def admin_required(f):
     return decorated
 
 
+def _signing_key() -> bytes:
+    """签名地址使用的密钥（由应用密钥派生，与JWT密钥分离）"""
+    import hashlib
+    import hmac
+    secret = auth_manager._get_secret_key().encode('utf-8')
+    return hmac.new(secret, b'signed-url', hashlib.sha256).digest()
+
+
+def _url_signature(scope: str, subject: str, expires: int) -> str:
+    import base64
+    import hashlib
+    import hmac
+    message = f'{scope}\n{subject}\n{expires}'.encode('utf-8')
+    digest = hmac.new(_signing_key(), message, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:18]).decode('ascii')
+
+
+def sign_params(scope: str, subject: str, ttl: int = None) -> Dict[str, Any]:
+    """生成签名地址参数 {'exp': 过期时间戳, 'sig': 签名}
+
+    签名覆盖 作用域、对象（文件名或任务ID）与过期时间，校验时无需查询数据库或解码JWT。
+    """
+    import time
+    from .config import get_config
+    if ttl is None:
+        ttl = get_config('auth.signed_url_ttl', 86400)
+    expires = int(time.time()) + int(ttl)
+    return {'exp': expires, 'sig': _url_signature(scope, subject, expires)}
+
+
+def sign_url(path: str, scope: str, subject: str, ttl: int = None) -> str:
+    """为地址附加签名参数"""
+    from urllib.parse import urlencode
+    return f"{path}{'&' if '?' in path else '?'}{urlencode(sign_params(scope, subject, ttl))}"
+
+
+def verify_signature(scope: str, subject: str, expires, signature: str) -> bool:
+    """校验签名地址（常量时间比较）"""
+    import hmac
+    import time
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return False
+    if not signature or expires < time.time():
+        return False
+    return hmac.compare_digest(_url_signature(scope, subject, expires), signature)
+
+
+def signed_or_auth_required(scope: str, subject_arg: str = 'filename'):
+    """签名地址或登录认证装饰器
+
+    请求带有 sig 参数时只校验签名（作用域与路由参数 subject_arg 必须匹配），
+    否则按 auth_required 要求登录。
+    """
+    def decorator(f):
+        authenticated = auth_required(f)
+
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            signature = request.args.get('sig')
+            if signature is None:
+                return authenticated(*args, **kwargs)
+
+            if not verify_signature(scope, str(kwargs.get(subject_arg)), request.args.get('exp'), signature):
+                return jsonify({'error': '签名无效或已过期'}), 403
+
+            request.current_user = None
+            request.signed_access = True
+            return f(*args, **kwargs)
+
+        return decorated
+    return decorator
+
+
 def optional_auth(f):
     """可选认证装饰器 - 如果有令牌则验证，没有则继续"""
     @wraps(f)
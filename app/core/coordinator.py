@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+协调进程选举 - 多进程部署（如 gunicorn -w 4）时只有一个进程执行下载与定时任务
+
+各进程通过数据库中的租约竞争协调者身份，持有者定期续期；持有者退出或
+失联超过租约时长后，其他进程会接管。Web 请求可以由任意进程处理，
+任务状态通过数据库共享。
+"""
+
+import os
+import time
+import uuid
+import socket
+import atexit
+import logging
+import threading
+from typing import Any, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+LEASE_NAME = 'download_coordinator'
+
+
+class Coordinator:
+    """基于数据库租约的协调者选举"""
+
+    def __init__(self):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self.enabled = True
+        self._renewed_at = None  # 最近一次成功续期的时间（monotonic），用于判断租约是否仍有效
+        self._listeners: List[tuple] = []
+        self._lock = threading.RLock()
+        self.election_thread = None
+        self.stop_event = threading.Event()
+        self.running = False
+
+    def add_listener(self, on_elected: Callable = None, on_demoted: Callable = None):
+        """注册身份变化回调；已是协调者时立即调用 on_elected"""
+        with self._lock:
+            self._listeners.append((on_elected, on_demoted))
+            leader = self.is_leader
+        if leader and on_elected:
+            self._call(on_elected)
+
+    def add_leader_service(self, service):
+        """注册只在协调进程运行的后台服务（需提供 start/stop）"""
+        self.add_listener(service.start, service.stop)
+
+    def start(self):
+        """启动选举；首次竞选同步进行，单进程部署启动后立即成为协调者"""
+        if self.running:
+            return
+
+        try:
+            from .config import get_config
+
+            self.enabled = get_config('coordination.enabled', True)
+            self.running = True
+            self.stop_event.clear()
+
+            if not self.enabled:
+                # 单进程模式：本进程即协调者
+                self._set_leader(True)
+                return
+
+            self._campaign()
+            self.election_thread = threading.Thread(
+                target=self._election_loop,
+                daemon=True,
+                name="Coordinator"
+            )
+            self.election_thread.start()
+            atexit.register(self.stop)
+
+            logger.info(f"✅ 协调者选举已启动: {self.owner}")
+
+        except Exception as e:
+            logger.error(f"❌ 启动协调者选举失败: {e}")
+
+    def stop(self):
+        """停止选举并释放租约，让其他进程尽快接管"""
+        if not self.running:
+            return
+
+        self.running = False
+        self.stop_event.set()
+
+        if self.election_thread and self.election_thread.is_alive():
+            self.election_thread.join(timeout=5)
+
+        if self.is_leader and self.enabled:
+            try:
+                from .database import get_database
+                get_database().release_lease(LEASE_NAME, self.owner)
+            except Exception as e:
+                logger.warning(f"⚠️ 释放协调租约失败: {e}")
+        self._set_leader(False)
+
+    def _election_loop(self):
+        """按租约时长的三分之一续期或竞选；续期出错时1秒后重试"""
+        from .config import get_config
+
+        interval = max(1, get_config('coordination.lease_seconds', 15) / 3)
+        while not self.stop_event.wait(interval):
+            interval = max(1, get_config('coordination.lease_seconds', 15) / 3) if self._campaign() else 1
+
+    def _campaign(self) -> bool:
+        """竞选或续期一次，返回是否成功访问了租约"""
+        from .config import get_config
+        from .database import get_database
+
+        lease_seconds = get_config('coordination.lease_seconds', 15)
+        started = time.monotonic()
+        try:
+            leader = get_database().acquire_lease(LEASE_NAME, self.owner, lease_seconds)
+        except Exception as e:
+            # 偶发错误（如数据库繁忙超时）时租约仍在有效期内，继续担任协调者；
+            # 距上次成功续期接近租约时长时主动放弃，避免出现两个协调者
+            margin = get_config('coordination.safety_margin', 3)
+            valid = (self.is_leader and self._renewed_at is not None
+                     and time.monotonic() - self._renewed_at < lease_seconds - margin)
+            if valid:
+                logger.warning(f"⚠️ 协调租约续期失败，租约仍有效，稍后重试: {e}")
+            else:
+                logger.error(f"❌ 协调租约续期失败: {e}")
+                self._set_leader(False)
+            return False
+
+        self._renewed_at = started if leader else None
+        self._set_leader(leader)
+        return True
+
+    def _set_leader(self, leader: bool):
+        with self._lock:
+            if leader == self.is_leader:
+                return
+            self.is_leader = leader
+            listeners = list(self._listeners)
+
+        if leader:
+            logger.info(f"👑 本进程成为下载协调者: {self.owner}")
+        else:
+            logger.info(f"🔧 本进程不再是下载协调者: {self.owner}")
+
+        for on_elected, on_demoted in listeners:
+            callback = on_elected if leader else on_demoted
+            if callback:
+                self._call(callback)
+
+    @staticmethod
+    def _call(callback: Callable):
+        try:
+            callback()
+        except Exception as e:
+            logger.error(f"❌ 协调者回调失败 {getattr(callback, '__name__', callback)}: {e}")
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取协调状态"""
+        status = {'enabled': self.enabled, 'owner': self.owner, 'is_leader': self.is_leader, 'leader': None}
+        try:
+            from .database import get_database
+            lease = get_database().get_lease(LEASE_NAME) if self.enabled else None
+            status['leader'] = lease['owner'] if lease else (self.owner if self.is_leader else None)
+        except Exception as e:
+            logger.warning(f"⚠️ 获取协调租约失败: {e}")
+        return status
+
+
+# 全局协调者实例
+_coordinator = None
+
+def get_coordinator() -> Coordinator:
+    """获取协调者实例"""
+    global _coordinator
+    if _coordinator is None:
+        _coordinator = Coordinator()
+    return _coordinator
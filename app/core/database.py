@@ -3,8 +3,11 @@
 数据库管理 - 轻量化数据库操作
 """
 
+import queue
 import logging
 import sqlite3
+import threading
+import time
 from pathlib import Path
 from typing import Dict, Any, List, Optional
 from contextlib import contextmanager
@@ -15,82 +18,98 @@ logger = logging.getLogger(__name__)
 class Database:
     """轻量化数据库管理器"""
     
-    def __init__(self, db_path: str = 'app.db'):
+    def __init__(self, db_path: str = 'app.db', pool_size: int = 8, busy_timeout: int = 5000,
+                 cache_size_kb: int = 16384, mmap_size: int = 256 * 1024 * 1024,
+                 write_behind: bool = True, write_batch_size: int = 200,
+                 write_flush_interval: float = 0.05, settings_check_interval: float = 1.0):
         self.db_path = Path(db_path)
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.pool_size = pool_size
+        self.busy_timeout = busy_timeout
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self._pool = queue.LifoQueue()
+        self._local = threading.local()
+        self._write_queue = None
+        # 设置与Telegram配置缓存：首次读取时加载，写入时同步更新
+        self._cache_lock = threading.RLock()
+        self._settings_cache = None
+        self._api_keys_cache = None
+        self._telegram_config_cache = None
+        self._telegram_config_loaded = False
+        self._settings_version = None
+        self._settings_check_interval = settings_check_interval
+        self._settings_checked_at = None
+        self._fts_available = None
+        if write_behind:
+            from .write_queue import WriteBehindQueue
+            self._write_queue = WriteBehindQueue(self, write_batch_size, write_flush_interval)
+        self._enable_wal()
         self._init_database()
+
+    def _enable_wal(self):
+        """启用WAL日志模式（持久化在数据库文件中，只需设置一次）"""
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout / 1000)
+            try:
+                # 新建数据库时启用增量回收（已有数据库由维护任务在空闲时转换）
+                conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+                mode = conn.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+                logger.info(f"✅ 数据库日志模式: {mode}")
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.warning(f"⚠️ 启用WAL模式失败: {e}")
+
+    def _create_connection(self) -> sqlite3.Connection:
+        """创建并调优一个新连接"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout / 1000,
+            check_same_thread=False  # 连接在线程间归还复用，同一时刻只由一个线程持有
+        )
+        conn.row_factory = sqlite3.Row  # 使结果可以按列名访问
+        # 全文索引分词函数：应用写入时用它重写索引行（触发器不依赖它，见迁移16）
+        from .search import segment_text
+        conn.create_function('fts_segment', 1, segment_text, deterministic=True)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout)}')
+        conn.execute(f'PRAGMA cache_size=-{int(self.cache_size_kb)}')
+        conn.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        return conn
+
+    def _acquire_connection(self) -> sqlite3.Connection:
+        """从连接池取出连接，池为空时新建"""
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return self._create_connection()
+
+    def _release_connection(self, conn: sqlite3.Connection):
+        """归还连接，超出空闲上限时关闭"""
+        if self._pool.qsize() < self.pool_size:
+            self._pool.put(conn)
+        else:
+            conn.close()
+
+    def close(self):
+        """提交待写入的数据并关闭所有空闲连接"""
+        if self._write_queue:
+            self._write_queue.stop()
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
     
     def _init_database(self):
         """初始化数据库表"""
         try:
             with self.get_connection() as conn:
-                # 用户表
-                conn.execute('''
-                    CREATE TABLE IF NOT EXISTS users (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        username TEXT UNIQUE NOT NULL,
-                        password_hash TEXT NOT NULL,
-                        is_admin BOOLEAN DEFAULT 0,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        last_login TIMESTAMP
-                    )
-                ''')
-                
-                # Telegram配置表
-                conn.execute('''
-                    CREATE TABLE IF NOT EXISTS telegram_config (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        bot_token TEXT,
-                        chat_id TEXT,
-                        api_id INTEGER,
-                        api_hash TEXT,
-                        enabled BOOLEAN DEFAULT 0,
-                        push_mode TEXT DEFAULT 'file',
-                        auto_download BOOLEAN DEFAULT 1,
-                        file_size_limit INTEGER DEFAULT 50,
-                        webhook_url TEXT DEFAULT '',
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-
-                # 检查并添加webhook_url字段（向后兼容）
-                try:
-                    conn.execute('SELECT webhook_url FROM telegram_config LIMIT 1')
-                except sqlite3.OperationalError:
-                    # 字段不存在，添加它
-                    logger.info("🔧 添加webhook_url字段到telegram_config表")
-                    conn.execute('ALTER TABLE telegram_config ADD COLUMN webhook_url TEXT DEFAULT ""')
-                    logger.info("✅ webhook_url字段添加成功")
-                except Exception as e:
-                    logger.warning(f"⚠️ 检查webhook_url字段时出错: {e}")
-                
-                # 下载记录表
-                conn.execute('''
-                    CREATE TABLE IF NOT EXISTS downloads (
-                        id TEXT PRIMARY KEY,
-                        url TEXT NOT NULL,
-                        title TEXT,
-                        status TEXT DEFAULT 'pending',
-                        progress INTEGER DEFAULT 0,
-                        file_path TEXT,
-                        file_size INTEGER,
-                        error_message TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        completed_at TIMESTAMP
-                    )
-                ''')
-                
-                # 系统设置表
-                conn.execute('''
-                    CREATE TABLE IF NOT EXISTS settings (
-                        key TEXT PRIMARY KEY,
-                        value TEXT,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-                
-                conn.commit()
+                from .migrations import apply_migrations
+                version = apply_migrations(conn)
+                logger.info(f"✅ 数据库结构版本: v{version}")
 
                 # 创建默认用户
                 self._create_default_user(conn)
@@ -167,13 +186,28 @@ class Database:
     
     @contextmanager
     def get_connection(self):
-        """获取数据库连接（上下文管理器）"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row  # 使结果可以按列名访问
+        """获取数据库连接（上下文管理器）
+
+        连接来自连接池并长期复用；同一线程内嵌套调用共享同一个连接。
+        退出最外层时未提交的修改会被回滚，与原先关闭连接的语义一致。
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+
+        conn = self._acquire_connection()
+        self._local.conn = conn
         try:
             yield conn
         finally:
-            conn.close()
+            self._local.conn = None
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+                self._release_connection(conn)
+            except sqlite3.Error:
+                conn.close()
     
     def execute_query(self, query: str, params: tuple = ()) -> List[Dict[str, Any]]:
         """执行查询并返回结果"""
@@ -196,6 +230,47 @@ class Database:
             logger.error(f"❌ 更新执行失败: {e}")
             return False
     
+    def execute_transaction(self, statements: List[tuple]) -> bool:
+        """在单个事务中执行多条更新语句 [(query, params), ...]"""
+        try:
+            with self.get_connection() as conn:
+                for query, params in statements:
+                    conn.execute(query, params)
+                conn.commit()
+                return True
+        except Exception as e:
+            logger.error(f"❌ 事务执行失败: {e}")
+            return False
+
+    def submit_write(self, query, params: tuple = (), wait: bool = False,
+                     timeout: float = 10) -> bool:
+        """通过写后队列执行更新
+
+        wait=False 时仅入队并立即返回；wait=True 时等待所在批次提交，返回是否写入成功。
+        query 也可以是 [(query, params), ...] 列表，作为一个原子单元提交。
+        """
+        if not self._write_queue:
+            if isinstance(query, list):
+                return self.execute_transaction(query)
+            return self.execute_update(query, params)
+
+        waiter = self._write_queue.submit(query, params, wait=wait)
+        if waiter is None:
+            return True
+        return waiter.wait(timeout)
+
+    def flush_writes(self, timeout: float = 10) -> bool:
+        """等待写后队列中已提交的写操作全部落盘"""
+        if not self._write_queue:
+            return True
+        return self._write_queue.flush(timeout)
+
+    def get_write_stats(self) -> Dict[str, Any]:
+        """获取写后队列统计"""
+        if not self._write_queue:
+            return {'enabled': False}
+        return {'enabled': True, **self._write_queue.get_stats()}
+
     def get_user_by_username(self, username: str) -> Optional[Dict[str, Any]]:
         """根据用户名获取用户"""
         results = self.execute_query(
@@ -222,12 +297,26 @@ class Database:
         )
     
     def get_telegram_config(self) -> Optional[Dict[str, Any]]:
-        """获取Telegram配置"""
-        results = self.execute_query('SELECT * FROM telegram_config LIMIT 1')
-        return results[0] if results else None
+        """获取Telegram配置（缓存，任一进程修改后失效）"""
+        self._check_settings_version()
+        with self._cache_lock:
+            if not self._telegram_config_loaded:
+                results = self.execute_query('SELECT * FROM telegram_config LIMIT 1')
+                self._telegram_config_cache = results[0] if results else None
+                self._telegram_config_loaded = True
+            config = self._telegram_config_cache
+        return dict(config) if config else None
     
     def save_telegram_config(self, config: Dict[str, Any]) -> bool:
         """保存Telegram配置"""
+        try:
+            return self._save_telegram_config(config)
+        finally:
+            with self._cache_lock:
+                self._telegram_config_loaded = False
+                self._telegram_config_cache = None
+
+    def _save_telegram_config(self, config: Dict[str, Any]) -> bool:
         existing = self.get_telegram_config()
         
         if existing:
@@ -268,31 +357,213 @@ class Database:
                 config.get('webhook_url', '')
             ))
     
-    def save_download_record(self, download_id: str, url: str, title: str = None) -> bool:
-        """保存下载记录"""
-        return self.execute_update('''
-            INSERT OR REPLACE INTO downloads (id, url, title, status)
-            VALUES (?, ?, ?, 'pending')
-        ''', (download_id, url, title))
+    def save_download_record(self, download_id: str, url: str, title: str = None,
+                             source: str = None, wait: bool = False,
+                             options: Dict[str, Any] = None) -> bool:
+        """保存下载记录（经写后队列批量提交，wait=True 时等待落盘）"""
+        import json
+        from .migrations import url_host
+        # 使用UPSERT而不是REPLACE，保持rowid不变（全文索引按rowid关联）
+        return self.submit_write([('''
+            INSERT INTO downloads (id, url, title, status, source, host, options)
+            VALUES (?, ?, ?, 'pending', ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                url = excluded.url, title = excluded.title, status = excluded.status,
+                source = excluded.source, host = excluded.host, options = excluded.options
+        ''', (download_id, url, title, source, url_host(url),
+              json.dumps(options, ensure_ascii=False, default=str) if options is not None else None)
+        )] + self._fts_reindex_statements(download_id), wait=wait)
+
+    def _fts_reindex_statements(self, download_id: str) -> List[tuple]:
+        """用分词后的内容重写记录的全文索引行（与记录写入在同一事务中提交）
+
+        触发器只写入原始内容，保证未注册 fts_segment() 的其他写入方也能修改记录；
+        应用自己的写入再按中日韩单字分词重写，使中文片段可以被搜索到。
+        """
+        if not self._has_fts():
+            return []
+        return [
+            ('DELETE FROM downloads_fts WHERE rowid = (SELECT rowid FROM downloads WHERE id = ?)',
+             (download_id,)),
+            ('''
+                INSERT INTO downloads_fts (rowid, title, uploader, url, extractor, tags)
+                SELECT rowid, fts_segment(title), fts_segment(uploader), url, extractor, fts_segment(tags)
+                FROM downloads WHERE id = ?
+            ''', (download_id,)),
+        ]
+
+    def get_download_record(self, download_id: str) -> Optional[Dict[str, Any]]:
+        """获取单条下载记录"""
+        results = self.execute_query('SELECT * FROM downloads WHERE id = ?', (download_id,))
+        return results[0] if results else None
+
+    def get_recent_downloads(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """获取进行中的任务及最近创建的记录"""
+        return self.execute_query('''
+            SELECT * FROM downloads
+            WHERE status IN ('pending', 'downloading', 'retrying')
+               OR id IN (SELECT id FROM downloads ORDER BY created_at DESC LIMIT ?)
+            ORDER BY created_at DESC
+        ''', (limit,))
+
+    def get_queued_downloads(self) -> List[Dict[str, Any]]:
+        """获取等待协调进程领取的任务（保存了任务选项的 pending 记录）"""
+        return self.execute_query('''
+            SELECT * FROM downloads
+            WHERE status = 'pending' AND options IS NOT NULL
+            ORDER BY created_at, id
+        ''')
     
-    def update_download_status(self, download_id: str, status: str, 
+    def claim_download(self, download_id: str) -> bool:
+        """条件更新领取任务（排队中或等待重试 -> 下载中），返回是否领取成功
+
+        先等待写后队列落盘，确保刚提交的排队记录与重试状态已经写入。
+        """
+        self.flush_writes()
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.execute('''
+                    UPDATE downloads SET status = 'downloading', progress = 0
+                    WHERE id = ? AND status IN ('pending', 'retrying')
+                ''', (download_id,))
+                conn.commit()
+                return cursor.rowcount == 1
+        except Exception as e:
+            logger.error(f"❌ 领取下载任务失败: {e}")
+            return False
+
+    def update_download_status(self, download_id: str, status: str,
                              progress: int = None, file_path: str = None,
-                             file_size: int = None, error_message: str = None) -> bool:
-        """更新下载状态"""
+                             file_size: int = None, error_message: str = None,
+                             wait: bool = False, outbox: Dict[str, Any] = None) -> bool:
+        """更新下载状态（经写后队列批量提交，wait=True 时等待落盘）
+
+        outbox 为 {'event', 'key', 'payload'} 时，发件箱消息与状态变更在同一事务中写入；
+        相同幂等键的消息只保留第一条。
+        """
         if status == 'completed':
-            return self.execute_update('''
+            statement = ('''
                 UPDATE downloads SET 
                     status = ?, progress = ?, file_path = ?, file_size = ?,
                     completed_at = CURRENT_TIMESTAMP
                 WHERE id = ?
             ''', (status, progress or 100, file_path, file_size, download_id))
         else:
-            return self.execute_update('''
+            statement = ('''
                 UPDATE downloads SET 
                     status = ?, progress = ?, error_message = ?
                 WHERE id = ?
             ''', (status, progress or 0, error_message, download_id))
+
+        if not outbox:
+            return self.submit_write(*statement, wait=wait)
+
+        import json
+        return self.submit_write([statement, (
+            'INSERT OR IGNORE INTO outbox (event, idempotency_key, payload) VALUES (?, ?, ?)',
+            (outbox['event'], outbox['key'], json.dumps(outbox['payload'], ensure_ascii=False, default=str))
+        )], wait=wait)
     
+    def update_download_metadata(self, download_id: str, title: str = None,
+                                 extractor: str = None, video_id: str = None,
+                                 uploader: str = None, tags: List[str] = None) -> bool:
+        """更新下载记录的标题、规范视频ID及搜索用元数据"""
+        return self.submit_write([('''
+            UPDATE downloads SET
+                title = COALESCE(?, title),
+                extractor = COALESCE(?, extractor),
+                video_id = COALESCE(?, video_id),
+                uploader = COALESCE(?, uploader),
+                tags = COALESCE(?, tags)
+            WHERE id = ?
+        ''', (title, extractor.lower() if extractor else None, video_id, uploader,
+              ' '.join(tags) if tags else None, download_id)
+        )] + self._fts_reindex_statements(download_id))
+
+    def search_downloads(self, query: str, limit: int = 20, offset: int = 0,
+                         statuses: List[str] = None, source: str = None) -> Dict[str, Any]:
+        """全文搜索下载记录，按BM25相关度排序（标题权重最高）
+
+        返回 {'items': [...], 'has_more': bool}，每项附带 snippet（已转义的HTML片段）
+        """
+        from .search import build_match_query, format_snippet, HIGHLIGHT_START, HIGHLIGHT_END
+
+        match = build_match_query(query)
+        if not match:
+            return {'items': [], 'has_more': False}
+        if not self._has_fts():
+            return self._search_downloads_like(query, limit, offset, statuses, source)
+
+        conditions = ['downloads_fts MATCH ?']
+        params = [HIGHLIGHT_START, HIGHLIGHT_END, match]
+        if statuses:
+            conditions.append(f"d.status IN ({','.join('?' * len(statuses))})")
+            params.extend(statuses)
+        if source:
+            conditions.append('d.source = ?')
+            params.append(source)
+        params.extend([limit + 1, offset])
+
+        rows = self.execute_query(f'''
+            SELECT d.*, snippet(downloads_fts, -1, ?, ?, '…', 24) AS snippet,
+                   bm25(downloads_fts, 10.0, 4.0, 1.0, 2.0, 3.0) AS rank
+            FROM downloads_fts
+            JOIN downloads d ON d.rowid = downloads_fts.rowid
+            WHERE {' AND '.join(conditions)}
+            ORDER BY rank
+            LIMIT ? OFFSET ?
+        ''', tuple(params))
+
+        items = rows[:limit]
+        for item in items:
+            item['snippet'] = format_snippet(item['snippet'])
+        return {'items': items, 'has_more': len(rows) > limit}
+
+    def _has_fts(self) -> bool:
+        """检查全文索引表是否存在（SQLite不支持FTS5时迁移会跳过建表）"""
+        if self._fts_available is None:
+            rows = self.execute_query(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'downloads_fts'")
+            self._fts_available = bool(rows)
+            if not self._fts_available:
+                logger.warning("⚠️ 全文索引不可用，搜索回退为LIKE匹配")
+        return self._fts_available
+
+    def _search_downloads_like(self, query: str, limit: int, offset: int,
+                               statuses: List[str] = None, source: str = None) -> Dict[str, Any]:
+        """无全文索引时的搜索：每个词都需命中任一字段，按创建时间倒序"""
+        from .search import highlight_text
+
+        words = query.split()
+        conditions = []
+        params = []
+        for word in words:
+            pattern = '%' + word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            conditions.append('(' + ' OR '.join(
+                f"d.{column} LIKE ? ESCAPE '\\'"
+                for column in ('title', 'uploader', 'url', 'extractor', 'tags')) + ')')
+            params.extend([pattern] * 5)
+        if statuses:
+            conditions.append(f"d.status IN ({','.join('?' * len(statuses))})")
+            params.extend(statuses)
+        if source:
+            conditions.append('d.source = ?')
+            params.append(source)
+        params.extend([limit + 1, offset])
+
+        rows = self.execute_query(f'''
+            SELECT d.* FROM downloads d
+            WHERE {' AND '.join(conditions)}
+            ORDER BY d.created_at DESC, d.id DESC
+            LIMIT ? OFFSET ?
+        ''', tuple(params))
+
+        items = rows[:limit]
+        for item in items:
+            item['snippet'] = highlight_text(item.get('title') or item.get('url'), words)
+            item['rank'] = 0.0  # 无相关度评分
+        return {'items': items, 'has_more': len(rows) > limit}
+
     def get_download_records(self, limit: int = 50) -> List[Dict[str, Any]]:
         """获取下载记录"""
         return self.execute_query('''
@@ -301,19 +572,681 @@ class Database:
             LIMIT ?
         ''', (limit,))
     
+    @staticmethod
+    def encode_history_cursor(created_at: str, download_id: str) -> str:
+        """编码历史分页游标"""
+        import json
+        import base64
+        raw = json.dumps([created_at, download_id], separators=(',', ':')).encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def decode_history_cursor(cursor: str) -> Optional[tuple]:
+        """解码历史分页游标，无效时返回None"""
+        import json
+        import base64
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            created_at, download_id = json.loads(raw)
+            if isinstance(created_at, str) and isinstance(download_id, str):
+                return created_at, download_id
+        except (ValueError, TypeError):
+            pass
+        return None
+
+    def get_download_history(self, limit: int = 20, cursor: str = None,
+                             statuses: List[str] = None, source: str = None,
+                             host: str = None, date_from: str = None,
+                             date_to: str = None, order: str = 'desc') -> Dict[str, Any]:
+        """按 (created_at, id) 游标分页查询下载历史
+
+        每页只读取 limit+1 行，耗时与历史总量无关。
+        返回 {'items': [...], 'next_cursor': str|None, 'has_more': bool}
+        """
+        descending = order != 'asc'
+        conditions = []
+        params = []
+
+        if statuses:
+            conditions.append(f"status IN ({','.join('?' * len(statuses))})")
+            params.extend(statuses)
+        if source:
+            conditions.append('source = ?')
+            params.append(source)
+        if host:
+            conditions.append('host = ?')
+            params.append(host.lower())
+        if date_from:
+            conditions.append('created_at >= ?')
+            params.append(date_from)
+        if date_to:
+            # 包含结束日期当天
+            conditions.append("created_at < date(?, '+1 day')")
+            params.append(date_to)
+
+        if cursor:
+            position = self.decode_history_cursor(cursor)
+            if position is None:
+                raise ValueError('无效的分页游标')
+            conditions.append(f"(created_at, id) {'<' if descending else '>'} (?, ?)")
+            params.extend(position)
+
+        direction = 'DESC' if descending else 'ASC'
+        query = 'SELECT * FROM downloads'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += f' ORDER BY created_at {direction}, id {direction} LIMIT ?'
+        params.append(limit + 1)
+
+        rows = self.execute_query(query, tuple(params))
+        has_more = len(rows) > limit
+        items = rows[:limit]
+        next_cursor = None
+        if has_more and items:
+            next_cursor = self.encode_history_cursor(items[-1]['created_at'], items[-1]['id'])
+
+        return {'items': items, 'next_cursor': next_cursor, 'has_more': has_more}
+
+    def get_download_status_counts(self) -> Dict[str, int]:
+        """按状态统计下载记录数
+
+        终态数量来自日汇总表，进行中的数量只通过状态索引统计未结束的记录，
+        不会扫描全部历史。
+        """
+        counts = {}
+        for row in self.execute_query('''
+            SELECT status, SUM(count) AS total FROM download_stats_daily GROUP BY status
+        '''):
+            counts[row['status']] = row['total']
+        for row in self.execute_query('''
+            SELECT status, COUNT(*) AS total FROM downloads
+            WHERE status NOT IN ('completed', 'failed', 'cancelled')
+            GROUP BY status
+        '''):
+            counts[row['status']] = row['total']
+        return counts
+
+    def record_download_outcome(self, status: str, host: str = None, source: str = None,
+                                file_size: int = 0, duration: float = 0,
+                                finished_at=None, delta: int = 1) -> bool:
+        """累加下载终态到小时/日汇总表（delta=-1 用于撤销，如失败后重试）"""
+        from datetime import datetime
+        finished_at = finished_at or datetime.utcnow()
+        values = (host or '', source or '', status, delta,
+                  delta * int(file_size or 0), delta * float(duration or 0))
+
+        ok = True
+        for table, bucket in (('download_stats_hourly', finished_at.strftime('%Y-%m-%d %H:00')),
+                              ('download_stats_daily', finished_at.strftime('%Y-%m-%d'))):
+            ok = self.submit_write(f'''
+                INSERT INTO {table} (bucket, host, source, status, count, bytes, duration)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(bucket, host, source, status) DO UPDATE SET
+                    count = count + excluded.count,
+                    bytes = bytes + excluded.bytes,
+                    duration = duration + excluded.duration
+            ''', (bucket,) + values) and ok
+        return ok
+
+    def get_download_stats(self, granularity: str = 'daily', since: str = None,
+                           until: str = None) -> Dict[str, Any]:
+        """读取汇总统计：时间序列、按站点、按来源
+
+        granularity: 'hourly' 或 'daily'；since/until 为桶起止（含），格式与桶一致的前缀即可
+        """
+        table = 'download_stats_hourly' if granularity == 'hourly' else 'download_stats_daily'
+        conditions = []
+        params = []
+        if since:
+            conditions.append('bucket >= ?')
+            params.append(since)
+        if until:
+            conditions.append('bucket <= ?')
+            params.append(until)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        aggregates = '''
+            SUM(count) AS total,
+            SUM(CASE WHEN status = 'completed' THEN count ELSE 0 END) AS completed,
+            SUM(CASE WHEN status = 'failed' THEN count ELSE 0 END) AS failed,
+            SUM(CASE WHEN status = 'cancelled' THEN count ELSE 0 END) AS cancelled,
+            SUM(bytes) AS bytes,
+            SUM(CASE WHEN status = 'completed' THEN duration ELSE 0 END) AS duration
+        '''
+
+        def grouped(column):
+            rows = self.execute_query(
+                f'SELECT {column} AS key, {aggregates} FROM {table} {where} GROUP BY {column} ORDER BY {column}',
+                tuple(params)
+            )
+            for row in rows:
+                finished = (row['completed'] or 0) + (row['failed'] or 0)
+                row['success_rate'] = round(row['completed'] / finished, 4) if finished else None
+                row['avg_duration'] = round(row['duration'] / row['completed'], 2) if row['completed'] else None
+            return rows
+
+        return {
+            'granularity': 'hourly' if granularity == 'hourly' else 'daily',
+            'series': grouped('bucket'),
+            'by_host': grouped('host'),
+            'by_source': grouped('source'),
+        }
+
+    def archive_old_downloads(self, before: str, batch_size: int = 500,
+                              exporter=None, error_limit: int = 200) -> int:
+        """将早于 before 的已结束记录移出热表
+
+        exporter 为空时写入 downloads_archive（错误信息截断为 error_limit 字符）；
+        否则调用 exporter(rows) 导出（如压缩NDJSON），导出成功后再删除。
+        统计数据已在汇总表中，归档不影响统计。返回归档条数。
+        """
+        archived = 0
+        while True:
+            with self.get_connection() as conn:
+                rows = [dict(row) for row in conn.execute('''
+                    SELECT * FROM downloads
+                    WHERE created_at < ? AND status IN ('completed', 'failed', 'cancelled')
+                    ORDER BY created_at, id
+                    LIMIT ?
+                ''', (before, batch_size))]
+                if not rows:
+                    break
+
+                if exporter:
+                    exporter(rows)
+                else:
+                    conn.executemany('''
+                        INSERT OR REPLACE INTO downloads_archive
+                        (id, url, title, status, host, source, extractor, video_id,
+                         file_size, error_message, created_at, completed_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', [(
+                        r['id'], r['url'], r['title'], r['status'], r.get('host'), r.get('source'),
+                        r.get('extractor'), r.get('video_id'), r['file_size'],
+                        (r['error_message'] or '')[:error_limit] or None,
+                        r['created_at'], r['completed_at']
+                    ) for r in rows])
+
+                conn.executemany('DELETE FROM downloads WHERE id = ?', [(r['id'],) for r in rows])
+                conn.commit()
+
+            archived += len(rows)
+            if len(rows) < batch_size:
+                break
+
+        return archived
+
+    def prune_hourly_stats(self, before_bucket: str) -> bool:
+        """删除过期的小时汇总（日汇总永久保留）"""
+        return self.execute_update('DELETE FROM download_stats_hourly WHERE bucket < ?', (before_bucket,))
+
+    def enable_incremental_vacuum(self) -> bool:
+        """将已有数据库切换为增量回收模式，返回是否执行了转换
+
+        转换需要一次完整VACUUM，大库上会长时间持有写锁，只应在启动时
+        （协调者选举开始前）显式执行，不放在周期维护中。
+        """
+        with self.get_connection() as conn:
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+                return False
+            conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            conn.execute('VACUUM')
+        return True
+
+    def run_idle_maintenance(self, vacuum_pages: int = 1000) -> Dict[str, Any]:
+        """空闲维护：增量回收空闲页、更新查询规划统计、截断WAL
+
+        未启用增量回收的已有数据库跳过回收（见 enable_incremental_vacuum）。
+        """
+        result = {'incremental': False, 'freed_pages': 0}
+        with self.get_connection() as conn:
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+                result['incremental'] = True
+                before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+                conn.execute(f'PRAGMA incremental_vacuum({int(vacuum_pages)})').fetchall()
+                after = conn.execute('PRAGMA freelist_count').fetchone()[0]
+                result['freed_pages'] = before - after
+
+            conn.execute('PRAGMA optimize')
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+        return result
+
+    def claim_outbox_messages(self, events: List[str], limit: int = 20,
+                              lease_seconds: int = 600) -> List[Dict[str, Any]]:
+        """领取待投递的发件箱消息
+
+        到期的待投递消息，以及租约已过期（投递进程崩溃）的投递中消息都会被领取，
+        领取时尝试次数加一并设置新的租约。
+        """
+        if not events:
+            return []
+
+        placeholders = ','.join('?' for _ in events)
+        with self.get_connection() as conn:
+            rows = conn.execute(f'''
+                UPDATE outbox SET
+                    status = 'processing',
+                    attempts = attempts + 1,
+                    locked_until = datetime('now', ?)
+                WHERE id IN (
+                    SELECT id FROM outbox
+                    WHERE event IN ({placeholders}) AND (
+                        (status = 'pending' AND next_attempt_at <= datetime('now'))
+                        OR (status = 'processing' AND locked_until < datetime('now'))
+                    )
+                    ORDER BY id
+                    LIMIT ?
+                )
+                RETURNING *
+            ''', (f'+{int(lease_seconds)} seconds', *events, limit)).fetchall()
+            conn.commit()
+
+        return sorted((dict(row) for row in rows), key=lambda row: row['id'])
+
+    def renew_outbox_lease(self, message_id: int, lease_seconds: int = 600) -> bool:
+        """延长投递中消息的租约"""
+        return self.execute_update('''
+            UPDATE outbox SET locked_until = datetime('now', ?)
+            WHERE id = ? AND status = 'processing'
+        ''', (f'+{int(lease_seconds)} seconds', message_id))
+
+    def complete_outbox_message(self, message_id: int) -> bool:
+        """标记发件箱消息已投递"""
+        return self.execute_update('''
+            UPDATE outbox SET status = 'delivered', delivered_at = CURRENT_TIMESTAMP,
+                locked_until = NULL, last_error = NULL
+            WHERE id = ?
+        ''', (message_id,))
+
+    def fail_outbox_message(self, message_id: int, error: str, retry_delay: int = None) -> bool:
+        """记录投递失败；retry_delay 为空时不再重试（dead）"""
+        if retry_delay is None:
+            return self.execute_update('''
+                UPDATE outbox SET status = 'dead', locked_until = NULL, last_error = ?
+                WHERE id = ?
+            ''', (error, message_id))
+        return self.execute_update('''
+            UPDATE outbox SET status = 'pending', locked_until = NULL, last_error = ?,
+                next_attempt_at = datetime('now', ?)
+            WHERE id = ?
+        ''', (error, f'+{int(retry_delay)} seconds', message_id))
+
+    def get_outbox_stats(self) -> Dict[str, int]:
+        """按状态统计发件箱消息数"""
+        rows = self.execute_query('SELECT status, COUNT(*) AS count FROM outbox GROUP BY status')
+        return {row['status']: row['count'] for row in rows}
+
+    def prune_outbox(self, before: str) -> bool:
+        """删除早于 before 的已投递消息（保留失败消息供排查）"""
+        return self.execute_update(
+            "DELETE FROM outbox WHERE status = 'delivered' AND delivered_at < ?", (before,))
+
+    def state_get(self, namespace: str, key: str, default: Any = None) -> Any:
+        """读取共享状态（过期视为不存在）"""
+        import json
+        results = self.execute_query('''
+            SELECT value FROM shared_state
+            WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > datetime('now'))
+        ''', (namespace, str(key)))
+        return json.loads(results[0]['value']) if results else default
+
+    def state_set(self, namespace: str, key: str, value: Any, ttl: int = None) -> bool:
+        """写入共享状态，ttl 为过期秒数"""
+        import json
+        return self.execute_update('''
+            INSERT INTO shared_state (namespace, key, value, expires_at)
+            VALUES (?, ?, ?, CASE WHEN ? IS NULL THEN NULL ELSE datetime('now', ?) END)
+            ON CONFLICT(namespace, key) DO UPDATE SET
+                value = excluded.value, expires_at = excluded.expires_at
+        ''', (namespace, str(key), json.dumps(value, ensure_ascii=False, default=str),
+              ttl, f'+{int(ttl or 0)} seconds'))
+
+    def state_pop(self, namespace: str, key: str, default: Any = None) -> Any:
+        """原子地取出并删除共享状态（多个进程同时取出时只有一个能拿到）"""
+        import json
+        with self.get_connection() as conn:
+            row = conn.execute('''
+                DELETE FROM shared_state WHERE namespace = ? AND key = ?
+                RETURNING value, expires_at IS NULL OR expires_at > datetime('now') AS valid
+            ''', (namespace, str(key))).fetchone()
+            conn.commit()
+        return json.loads(row['value']) if row and row['valid'] else default
+
+    def state_add(self, namespace: str, key: str, ttl: int = None) -> bool:
+        """加入共享去重集合，返回是否为首次加入（已过期的视为不存在）"""
+        with self.get_connection() as conn:
+            cursor = conn.execute('''
+                INSERT INTO shared_state (namespace, key, value, expires_at)
+                VALUES (?, ?, 'true', CASE WHEN ? IS NULL THEN NULL ELSE datetime('now', ?) END)
+                ON CONFLICT(namespace, key) DO UPDATE SET
+                    value = excluded.value, expires_at = excluded.expires_at
+                WHERE shared_state.expires_at IS NOT NULL AND shared_state.expires_at <= datetime('now')
+            ''', (namespace, str(key), ttl, f'+{int(ttl or 0)} seconds'))
+            conn.commit()
+            return cursor.rowcount == 1
+
+    def state_keys(self, namespace: str) -> List[str]:
+        """列出命名空间下未过期的键"""
+        rows = self.execute_query('''
+            SELECT key FROM shared_state
+            WHERE namespace = ? AND (expires_at IS NULL OR expires_at > datetime('now'))
+        ''', (namespace,))
+        return [row['key'] for row in rows]
+
+    def purge_expired_state(self) -> bool:
+        """清理过期的共享状态"""
+        return self.execute_update(
+            "DELETE FROM shared_state WHERE expires_at IS NOT NULL AND expires_at <= datetime('now')")
+
+    def acquire_lease(self, name: str, owner: str, ttl: int) -> bool:
+        """获取或续期租约（租约空闲、已过期或本来就属于 owner 时成功）"""
+        with self.get_connection() as conn:
+            conn.execute('''
+                INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, datetime('now', ?))
+                ON CONFLICT(name) DO UPDATE SET
+                    owner = excluded.owner, expires_at = excluded.expires_at
+                WHERE leases.owner = excluded.owner OR leases.expires_at <= datetime('now')
+            ''', (name, owner, f'+{int(ttl)} seconds'))
+            conn.commit()
+            row = conn.execute('SELECT owner FROM leases WHERE name = ?', (name,)).fetchone()
+        return bool(row) and row['owner'] == owner
+
+    def release_lease(self, name: str, owner: str) -> bool:
+        """释放租约（仅持有者可以释放）"""
+        return self.execute_update('DELETE FROM leases WHERE name = ? AND owner = ?', (name, owner))
+
+    def get_lease(self, name: str) -> Optional[Dict[str, Any]]:
+        """获取未过期的租约"""
+        results = self.execute_query(
+            "SELECT * FROM leases WHERE name = ? AND expires_at > datetime('now')", (name,))
+        return results[0] if results else None
+
+    def get_file_hashes(self) -> Dict[str, Dict[str, Any]]:
+        """获取全部文件哈希记录（文件名 -> 记录）"""
+        return {row['name']: row for row in self.execute_query('SELECT * FROM file_hashes')}
+
+    def save_file_hash(self, name: str, size: int, mtime_ns: int, inode: int,
+                       partial_hash: str, full_hash: str = None, linked_to: str = None) -> bool:
+        """保存文件哈希记录（linked_to 为已去重时共享数据的文件名）"""
+        return self.execute_update('''
+            INSERT OR REPLACE INTO file_hashes
+                (name, size, mtime_ns, inode, partial_hash, full_hash, linked_to, hashed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ''', (name, size, mtime_ns, inode, partial_hash, full_hash, linked_to))
+
+    def delete_file_hashes(self, names: List[str]) -> int:
+        """删除文件哈希记录（文件已不存在）"""
+        if not names:
+            return 0
+        with self.get_connection() as conn:
+            cursor = conn.executemany('DELETE FROM file_hashes WHERE name = ?', [(name,) for name in names])
+            conn.commit()
+            return cursor.rowcount
+
+    MEDIA_FIELDS = ('name', 'size', 'mtime_ns', 'mimetype', 'container', 'duration', 'width', 'height',
+                    'video_codec', 'audio_codec', 'bit_rate', 'info')
+
+    def get_media_entries(self, names: List[str]) -> Dict[str, Dict[str, Any]]:
+        """批量获取媒体信息（文件名 -> 记录，info 已解析）"""
+        import json
+        entries = {}
+        names = list(names)
+        # SQLite 变量个数有上限，分批查询
+        for start in range(0, len(names), 500):
+            batch = names[start:start + 500]
+            rows = self.execute_query(
+                f"SELECT * FROM media_catalog WHERE name IN ({','.join('?' * len(batch))})", tuple(batch))
+            for row in rows:
+                row['info'] = json.loads(row['info']) if row.get('info') else {}
+                entries[row['name']] = row
+        return entries
+
+    def save_media_entry(self, entry: Dict[str, Any]) -> bool:
+        """保存媒体信息"""
+        import json
+        values = [entry.get(field) for field in self.MEDIA_FIELDS]
+        values[-1] = json.dumps(entry.get('info') or {}, ensure_ascii=False, default=str)
+        return self.execute_update(f'''
+            INSERT OR REPLACE INTO media_catalog ({', '.join(self.MEDIA_FIELDS)}, probed_at)
+            VALUES ({', '.join('?' * len(self.MEDIA_FIELDS))}, CURRENT_TIMESTAMP)
+        ''', tuple(values))
+
+    def prune_media_entries(self, keep_names: List[str]) -> int:
+        """删除已不在下载目录中的文件的媒体信息"""
+        keep = set(keep_names)
+        stale = [(row['name'],) for row in self.execute_query('SELECT name FROM media_catalog')
+                 if row['name'] not in keep]
+        if not stale:
+            return 0
+        with self.get_connection() as conn:
+            cursor = conn.executemany('DELETE FROM media_catalog WHERE name = ?', stale)
+            conn.commit()
+            return cursor.rowcount
+
+    def _check_settings_version(self):
+        """设置版本号变化时清空缓存
+
+        版本号由 settings / telegram_config 表上的触发器维护。每个检查间隔内
+        最多查询一次，其他进程的修改（如吊销API密钥）在间隔结束后的下一次读取
+        时可见；间隔内的读取直接命中缓存。查询在缓存锁之外执行。
+        """
+        now = time.monotonic()
+        checked_at = self._settings_checked_at
+        if checked_at is not None and now - checked_at < self._settings_check_interval:
+            return
+        self._settings_checked_at = now
+        rows = self.execute_query('SELECT version FROM settings_version WHERE id = 1')
+        version = rows[0]['version'] if rows else None
+        with self._cache_lock:
+            if version != self._settings_version:
+                self.invalidate_settings_cache()
+                self._settings_version = version
+
+    def _get_settings(self) -> Dict[str, Any]:
+        """加载全部设置到缓存（只在首次访问或设置版本号变化后查询全部设置）"""
+        self._check_settings_version()
+        with self._cache_lock:
+            if self._settings_cache is None:
+                rows = self.execute_query('SELECT key, value FROM settings')
+                self._settings_cache = {row['key']: row['value'] for row in rows}
+            return self._settings_cache
+
+    def invalidate_settings_cache(self):
+        """使设置缓存失效（外部直接修改数据库后调用）"""
+        with self._cache_lock:
+            self._settings_cache = None
+            self._api_keys_cache = None
+            self._telegram_config_loaded = False
+            self._telegram_config_cache = None
+
     def get_setting(self, key: str, default: Any = None) -> Any:
         """获取系统设置"""
-        results = self.execute_query('SELECT value FROM settings WHERE key = ?', (key,))
-        if results:
-            return results[0]['value']
-        return default
+        return self._get_settings().get(key, default)
     
     def set_setting(self, key: str, value: str) -> bool:
         """设置系统设置"""
-        return self.execute_update('''
+        success = self.execute_update('''
             INSERT OR REPLACE INTO settings (key, value, updated_at)
             VALUES (?, ?, CURRENT_TIMESTAMP)
         ''', (key, value))
+        with self._cache_lock:
+            if success and self._settings_cache is not None:
+                self._settings_cache[key] = value
+            else:
+                self._settings_cache = None
+            self._api_keys_cache = None
+        return success
+
+    def delete_setting(self, key: str) -> bool:
+        """删除系统设置"""
+        success = self.execute_update('DELETE FROM settings WHERE key = ?', (key,))
+        with self._cache_lock:
+            if success and self._settings_cache is not None:
+                self._settings_cache.pop(key, None)
+            else:
+                self._settings_cache = None
+            self._api_keys_cache = None
+        return success
+
+    def get_api_keys(self) -> List[Dict[str, Any]]:
+        """获取API密钥列表（只含哈希与前缀，不含明文）"""
+        import json
+        self._check_settings_version()
+        with self._cache_lock:
+            if self._api_keys_cache is None:
+                try:
+                    keys = json.loads(self.get_setting('api_keys') or '[]')
+                except ValueError:
+                    logger.error("❌ API密钥设置格式错误")
+                    keys = []
+                self._api_keys_cache = keys
+            return [dict(k) for k in self._api_keys_cache]
+
+    def _save_api_keys(self, keys: List[Dict[str, Any]]) -> bool:
+        import json
+        if not keys:
+            return self.delete_setting('api_keys')
+        return self.set_setting('api_keys', json.dumps(keys, ensure_ascii=False))
+
+    def add_api_key(self, api_key: str, name: str = None, replace: bool = False) -> Optional[Dict[str, Any]]:
+        """保存API密钥（只存SHA-256哈希），返回密钥记录"""
+        import uuid
+        from datetime import datetime
+
+        record = {
+            'id': uuid.uuid4().hex[:12],
+            'name': name or '',
+            'prefix': api_key[:6],
+            'hash': hash_api_key(api_key),
+            'created_at': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        }
+        with self._cache_lock:
+            keys = [] if replace else self.get_api_keys()
+            keys.append(record)
+            if not self._save_api_keys(keys):
+                return None
+        return record
+
+    def delete_api_key(self, key_id: str = None) -> bool:
+        """删除指定API密钥；key_id 为空时删除全部"""
+        with self._cache_lock:
+            keys = self.get_api_keys()
+            remaining = [k for k in keys if key_id and k['id'] != key_id]
+            if len(remaining) == len(keys):
+                return False
+            return self._save_api_keys(remaining)
+
+    def verify_api_key(self, api_key: str) -> bool:
+        """常量时间校验API密钥（与所有已保存的哈希逐一比较，不提前返回）"""
+        import hmac
+        if not api_key:
+            return False
+
+        candidate = hash_api_key(api_key)
+        matched = False
+        for key in self.get_api_keys():
+            matched |= hmac.compare_digest(candidate, key.get('hash', ''))
+        return matched
+
+    def get_subscriptions(self, enabled_only: bool = False) -> List[Dict[str, Any]]:
+        """获取订阅列表"""
+        query = 'SELECT * FROM subscriptions'
+        if enabled_only:
+            query += ' WHERE enabled = 1'
+        return self.execute_query(query + ' ORDER BY created_at DESC')
+
+    def get_subscription(self, subscription_id: int) -> Optional[Dict[str, Any]]:
+        """获取单个订阅"""
+        results = self.execute_query('SELECT * FROM subscriptions WHERE id = ?', (subscription_id,))
+        return results[0] if results else None
+
+    def get_due_subscriptions(self) -> List[Dict[str, Any]]:
+        """获取到期需要检查的订阅"""
+        return self.execute_query('''
+            SELECT * FROM subscriptions
+            WHERE enabled = 1 AND (
+                last_checked_at IS NULL OR
+                last_checked_at <= datetime('now', '-' || check_interval || ' seconds')
+            )
+            ORDER BY last_checked_at IS NOT NULL, last_checked_at
+        ''')
+
+    def add_subscription(self, url: str, title: str = None, check_interval: int = 3600,
+                         options: str = '{}') -> Optional[int]:
+        """添加订阅，返回订阅ID"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.execute('''
+                    INSERT INTO subscriptions (url, title, check_interval, options)
+                    VALUES (?, ?, ?, ?)
+                ''', (url, title, check_interval, options))
+                conn.commit()
+                return cursor.lastrowid
+        except sqlite3.IntegrityError:
+            logger.warning(f"⚠️ 订阅已存在: {url}")
+            return None
+        except Exception as e:
+            logger.error(f"❌ 添加订阅失败: {e}")
+            return None
+
+    def update_subscription_check(self, subscription_id: int, title: str = None,
+                                  last_video_id: str = None, last_error: str = None,
+                                  seeded: bool = False) -> bool:
+        """记录订阅检查结果（seeded 表示已完成首次记录现有视频）"""
+        return self.execute_update('''
+            UPDATE subscriptions SET
+                title = COALESCE(?, title),
+                last_video_id = COALESCE(?, last_video_id),
+                last_error = ?,
+                last_checked_at = CURRENT_TIMESTAMP,
+                seeded_at = CASE WHEN ? THEN COALESCE(seeded_at, CURRENT_TIMESTAMP) ELSE seeded_at END
+            WHERE id = ?
+        ''', (title, last_video_id, last_error, 1 if seeded else 0, subscription_id))
+
+    def get_download_states(self, urls: List[str]) -> Dict[str, Dict[str, int]]:
+        """按URL统计进行中与失败的下载任务数（订阅据此跳过已入队的视频、限制失败重试）"""
+        states = {}
+        urls = list(dict.fromkeys(urls))
+        for start in range(0, len(urls), 500):
+            batch = urls[start:start + 500]
+            rows = self.execute_query(f'''
+                SELECT url,
+                    SUM(status IN ('pending', 'downloading', 'retrying')) AS active,
+                    SUM(status = 'failed') AS failed
+                FROM downloads WHERE url IN ({','.join('?' * len(batch))})
+                GROUP BY url
+            ''', tuple(batch))
+            states.update({row['url']: {'active': row['active'] or 0, 'failed': row['failed'] or 0}
+                           for row in rows})
+        return states
+
+    def set_subscription_enabled(self, subscription_id: int, enabled: bool) -> bool:
+        """启用/停用订阅"""
+        return self.execute_update(
+            'UPDATE subscriptions SET enabled = ? WHERE id = ?',
+            (1 if enabled else 0, subscription_id)
+        )
+
+    def delete_subscription(self, subscription_id: int) -> bool:
+        """删除订阅"""
+        return self.execute_update('DELETE FROM subscriptions WHERE id = ?', (subscription_id,))
+
+    def get_archive_keys(self) -> List[str]:
+        """获取全部存档键（用于构建Bloom过滤器）"""
+        return [row['archive_key'] for row in self.execute_query('SELECT archive_key FROM download_archive')]
+
+    def archive_contains(self, archive_key: str) -> bool:
+        """检查存档键是否存在"""
+        return bool(self.execute_query(
+            'SELECT 1 FROM download_archive WHERE archive_key = ?', (archive_key,)
+        ))
+
+    def add_archive_key(self, archive_key: str, source: str = None) -> bool:
+        """添加存档键"""
+        return self.execute_update(
+            'INSERT OR IGNORE INTO download_archive (archive_key, source) VALUES (?, ?)',
+            (archive_key, source)
+        )
 
     def ensure_admin_user_exists(self) -> bool:
         """确保管理员用户存在（智能创建/更新）"""
@@ -381,6 +1314,12 @@ class Database:
             return False
 
 
+def hash_api_key(api_key: str) -> str:
+    """API密钥哈希（密钥为高熵随机串，SHA-256即可）"""
+    import hashlib
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
+
 # 全局数据库实例
 _db_instance = None
 
@@ -393,5 +1332,15 @@ def get_database() -> Database:
         # 提取SQLite文件路径
         if db_path.startswith('sqlite:///'):
             db_path = db_path[10:]  # 移除 'sqlite:///' 前缀
-        _db_instance = Database(db_path)
+        _db_instance = Database(
+            db_path,
+            pool_size=get_config('database.pool_size', 8),
+            busy_timeout=get_config('database.busy_timeout', 5000),
+            cache_size_kb=get_config('database.cache_size_kb', 16384),
+            mmap_size=get_config('database.mmap_size', 256 * 1024 * 1024),
+            write_behind=get_config('database.write_behind.enabled', True),
+            write_batch_size=get_config('database.write_behind.batch_size', 200),
+            write_flush_interval=get_config('database.write_behind.flush_interval', 0.05),
+            settings_check_interval=get_config('database.settings_check_interval', 1.0)
+        )
     return _db_instance
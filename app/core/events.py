@@ -1,14 +1,176 @@
 # -*- coding: utf-8 -*-
 """
 事件总线 - 轻量化事件驱动系统
+
+监听器按分组注册，每个分组有独立的有界队列和工作线程池；emit 只负责入队，
+慢速监听器（如Telegram上传）不会占用发送方线程，也不会拖慢其他分组。
+
+高频事件（如下载进度）可设置为合并主题：同一监听器、同一键（如 download_id）
+尚未处理的事件只保留最新一条，监听器跟不上时中间值直接被覆盖。
 """
 
+import time
+import queue
 import logging
 import threading
 from typing import Dict, List, Callable, Any
 
 logger = logging.getLogger(__name__)
 
+# 队列满时的处理策略
+OVERFLOW_POLICIES = ('block', 'drop_newest', 'drop_oldest', 'caller_runs')
+
+DEFAULT_GROUP = 'default'
+DEFAULT_GROUP_CONFIG = {
+    'workers': 2,
+    'queue_size': 1000,
+    'overflow': 'block',
+    'block_timeout': 5,
+}
+
+
+class ListenerGroup:
+    """监听器分组：有界队列 + 专用工作线程池"""
+
+    _STOP = object()
+    _COALESCED = object()
+
+    def __init__(self, name: str, handler: Callable, workers: int = 2, queue_size: int = 1000,
+                 overflow: str = 'block', block_timeout: float = 5):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"未知的溢出策略: {overflow}")
+
+        self.name = name
+        self._handler = handler
+        self.workers = max(1, int(workers))
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self._queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._unfinished = 0
+        # 合并主题中待处理的最新事件：(监听器, 事件名, 键) -> 事件
+        self._latest: Dict[tuple, tuple] = {}
+        self._stats = {'dispatched': 0, 'dropped': 0, 'coalesced': 0, 'caller_runs': 0}
+
+    def _ensure_started(self):
+        """延迟启动工作线程"""
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, daemon=True, name=f"EventBus-{self.name}-{i}")
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, item: tuple, coalesce_key: Any = None) -> bool:
+        """按溢出策略入队
+
+        指定 coalesce_key 时，若同一监听器同一键已有未处理的事件，只替换其内容
+        （返回 False 表示被合并），不再占用队列位置。
+        """
+        self._ensure_started()
+        with self._lock:
+            if coalesce_key is not None:
+                slot = (item[0], item[1], coalesce_key)
+                if slot in self._latest:
+                    self._latest[slot] = item
+                    self._stats['coalesced'] += 1
+                    return False
+                self._latest[slot] = item
+                item = (self._COALESCED, slot)
+            self._unfinished += 1
+
+        try:
+            if self.overflow == 'block':
+                self._queue.put(item, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(item)
+        except queue.Full:
+            if self.overflow == 'drop_oldest':
+                try:
+                    self._resolve(self._queue.get_nowait())
+                    self._task_done(dropped=True)
+                except queue.Empty:
+                    pass
+                try:
+                    self._queue.put_nowait(item)
+                except queue.Full:
+                    self._resolve(item)
+                    self._task_done(dropped=True)
+                    return True
+            elif self.overflow == 'caller_runs':
+                with self._lock:
+                    self._stats['caller_runs'] += 1
+                try:
+                    # 在发送方线程执行，自然形成背压
+                    self._handler(self._resolve(item))
+                finally:
+                    self._task_done()
+                return True
+            else:
+                item = self._resolve(item)
+                self._task_done(dropped=True)
+                logger.warning(f"⚠️ 事件队列已满，丢弃事件: {self.name} <- {item[1]}")
+                return True
+
+        with self._lock:
+            self._stats['dispatched'] += 1
+        return True
+
+    def _resolve(self, item: tuple) -> tuple:
+        """取出合并占位对应的最新事件"""
+        if item[0] is self._COALESCED:
+            with self._lock:
+                return self._latest.pop(item[1])
+        return item
+
+    def _task_done(self, dropped: bool = False):
+        with self._lock:
+            self._unfinished -= 1
+            if dropped:
+                self._stats['dropped'] += 1
+            if self._unfinished <= 0:
+                self._idle.notify_all()
+
+    def _run(self):
+        """工作线程主循环"""
+        while True:
+            item = self._queue.get()
+            if item is self._STOP:
+                break
+            try:
+                self._handler(self._resolve(item))
+            finally:
+                self._task_done()
+
+    def join(self, timeout: float = None) -> bool:
+        """等待已入队的事件全部处理完成"""
+        with self._lock:
+            return self._idle.wait_for(lambda: self._unfinished <= 0, timeout)
+
+    def stop(self, timeout: float = 5):
+        """处理完剩余事件后停止工作线程"""
+        threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(self._STOP)
+        for thread in threads:
+            thread.join(timeout)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({
+            'workers': self.workers,
+            'overflow': self.overflow,
+            'queue_size': self._queue.maxsize,
+            'pending': self._queue.qsize(),
+        })
+        return stats
+
 
 class EventBus:
     """轻量化事件总线"""
@@ -27,17 +189,26 @@ class EventBus:
         if not hasattr(self, '_initialized'):
             self._initialized = True
             self._listeners: Dict[str, List[Callable]] = {}
+            self._listener_groups: Dict[Callable, str] = {}
+            self._groups: Dict[str, ListenerGroup] = {}
+            self._metrics: Dict[str, Dict[str, Any]] = {}
+            self._coalescing: Dict[str, str] = {}
+            self._event_counters: Dict[str, Dict[str, int]] = {}
             self._lock = threading.RLock()
 
-    def on(self, event_name: str):
+    def on(self, event_name: str, group: str = None):
         """装饰器：注册事件监听器"""
         def decorator(func: Callable):
-            self.add_listener(event_name, func)
+            self.add_listener(event_name, func, group)
             return func
         return decorator
 
-    def add_listener(self, event_name: str, callback: Callable):
-        """添加事件监听器"""
+    def add_listener(self, event_name: str, callback: Callable, group: str = None):
+        """添加事件监听器
+
+        group 为监听器分组名，同组监听器共享一个有界队列和工作线程池；
+        分组参数从配置 events.groups.<group> 读取。
+        """
         with self._lock:
             if event_name not in self._listeners:
                 self._listeners[event_name] = []
@@ -45,14 +216,55 @@ class EventBus:
             # 防止重复注册同一个回调函数
             if callback not in self._listeners[event_name]:
                 self._listeners[event_name].append(callback)
-                logger.debug(f"📡 注册事件监听器: {event_name} -> {callback.__name__}")
+                self._listener_groups[callback] = group or DEFAULT_GROUP
+                logger.debug(f"📡 注册事件监听器: {event_name} -> {callback.__name__} [{group or DEFAULT_GROUP}]")
             else:
                 logger.debug(f"📡 监听器已存在，跳过注册: {event_name} -> {callback.__name__}")
 
+    def remove_listener(self, event_name: str, callback: Callable):
+        """移除事件监听器"""
+        with self._lock:
+            listeners = self._listeners.get(event_name, [])
+            if callback in listeners:
+                listeners.remove(callback)
+
+    def set_coalescing(self, event_name: str, key: str = None):
+        """设置合并主题：未处理的同键事件只投递最新一条（key=None 取消）"""
+        with self._lock:
+            if key:
+                self._coalescing[event_name] = key
+            else:
+                self._coalescing.pop(event_name, None)
+
+    def configure_group(self, name: str, **options) -> ListenerGroup:
+        """创建或重建监听器分组（未指定的参数使用配置/默认值）"""
+        with self._lock:
+            old = self._groups.pop(name, None)
+            group = self._get_group(name, **options)
+        if old:
+            old.stop()
+        return group
+
+    def _get_group(self, name: str, **options) -> ListenerGroup:
+        with self._lock:
+            group = self._groups.get(name)
+            if group is None:
+                config = dict(DEFAULT_GROUP_CONFIG)
+                try:
+                    from .config import get_config
+                    config.update(get_config(f'events.groups.{name}', None) or {})
+                except Exception:
+                    pass
+                config.update(options)
+                group = self._groups[name] = ListenerGroup(name, self._invoke, **config)
+            return group
+
     def emit(self, event_name: str, data: Any = None):
-        """发送事件"""
+        """发送事件（入队到各监听器所属分组，立即返回）"""
         with self._lock:
-            listeners = self._listeners.get(event_name, []).copy()
+            listeners = [(callback, self._listener_groups.get(callback, DEFAULT_GROUP))
+                         for callback in self._listeners.get(event_name, [])]
+            key_field = self._coalescing.get(event_name)
 
         if not listeners:
             logger.debug(f"📡 事件无监听器: {event_name}")
@@ -60,32 +272,99 @@ class EventBus:
 
         logger.debug(f"📡 发送事件: {event_name} -> {len(listeners)} 个监听器")
 
-        for callback in listeners:
-            try:
-                if data is not None:
-                    callback(data)
-                else:
-                    callback()
-            except Exception as e:
-                logger.error(f"❌ 事件处理器错误 {event_name}->{callback.__name__}: {e}")
+        coalesce_key = data.get(key_field) if key_field and isinstance(data, dict) else None
+        coalesced = 0
+        for callback, group_name in listeners:
+            item = (callback, event_name, data, time.monotonic())
+            if not self._get_group(group_name).submit(item, coalesce_key):
+                coalesced += 1
+
+        with self._lock:
+            counters = self._event_counters.setdefault(event_name, {'emitted': 0, 'coalesced': 0})
+            counters['emitted'] += 1
+            counters['coalesced'] += coalesced
 
     def emit_async(self, event_name: str, data: Any = None):
-        """异步发送事件"""
-        import threading
-        thread = threading.Thread(
-            target=self.emit,
-            args=(event_name, data),
-            daemon=True
-        )
-        thread.start()
+        """异步发送事件（emit 已经是异步分发，保留此接口兼容旧调用）"""
+        self.emit(event_name, data)
+
+    def _invoke(self, item: tuple):
+        """执行监听器并记录耗时"""
+        callback, event_name, data, enqueued_at = item
+        started = time.monotonic()
+        error = False
+        try:
+            if data is not None:
+                callback(data)
+            else:
+                callback()
+        except Exception as e:
+            error = True
+            logger.error(f"❌ 事件处理器错误 {event_name}->{callback.__name__}: {e}")
+        finally:
+            self._record_metrics(f"{event_name}->{callback.__name__}", started - enqueued_at,
+                                 time.monotonic() - started, error)
+
+    def _record_metrics(self, key: str, wait: float, duration: float, error: bool):
+        with self._lock:
+            metrics = self._metrics.setdefault(key, {
+                'calls': 0, 'errors': 0, 'total_time': 0.0, 'max_time': 0.0,
+                'total_wait': 0.0, 'max_wait': 0.0,
+            })
+            metrics['calls'] += 1
+            metrics['errors'] += int(error)
+            metrics['total_time'] += duration
+            metrics['max_time'] = max(metrics['max_time'], duration)
+            metrics['total_wait'] += wait
+            metrics['max_wait'] = max(metrics['max_wait'], wait)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取分组队列与监听器耗时统计"""
+        with self._lock:
+            groups = dict(self._groups)
+            listeners = {}
+            for key, metrics in self._metrics.items():
+                calls = metrics['calls'] or 1
+                listeners[key] = {
+                    'calls': metrics['calls'],
+                    'errors': metrics['errors'],
+                    'avg_ms': round(metrics['total_time'] / calls * 1000, 2),
+                    'max_ms': round(metrics['max_time'] * 1000, 2),
+                    'avg_wait_ms': round(metrics['total_wait'] / calls * 1000, 2),
+                    'max_wait_ms': round(metrics['max_wait'] * 1000, 2),
+                }
+            events = {name: dict(counters) for name, counters in self._event_counters.items()}
+        return {
+            'groups': {name: group.get_stats() for name, group in groups.items()},
+            'listeners': listeners,
+            'events': events,
+        }
+
+    def flush(self, timeout: float = None) -> bool:
+        """等待所有分组中已入队的事件处理完成"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            groups = list(self._groups.values())
+        for group in groups:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not group.join(remaining):
+                return False
+        return True
+
+    def shutdown(self, timeout: float = 5):
+        """处理完剩余事件后停止所有分组"""
+        with self._lock:
+            groups, self._groups = list(self._groups.values()), {}
+        for group in groups:
+            group.stop(timeout)
 
 
 # 全局事件总线实例
 event_bus = EventBus()
 
 # 便捷函数
-def on(event_name: str):
-    return event_bus.on(event_name)
+def on(event_name: str, group: str = None):
+    return event_bus.on(event_name, group)
 
 def emit(event_name: str, data: Any = None):
     event_bus.emit(event_name, data)
@@ -110,6 +389,7 @@ class Events:
     DOWNLOAD_PROGRESS = 'download.progress'
     DOWNLOAD_COMPLETED = 'download.completed'
     DOWNLOAD_FAILED = 'download.failed'
+    DOWNLOAD_CANCELLED = 'download.cancelled'
 
     # 文件相关
     FILE_CREATED = 'file.created'
@@ -122,3 +402,7 @@ class Events:
     # 扩展接口（预留）
     AI_ANALYSIS_COMPLETED = 'ai.analysis_completed'
     CLOUD_UPLOAD_COMPLETED = 'cloud.upload_completed'
+
+
+# 下载进度按任务合并，监听器跟不上时只处理最新进度
+event_bus.set_coalescing(Events.DOWNLOAD_PROGRESS, 'download_id')
@@ -0,0 +1,497 @@
+# -*- coding: utf-8 -*-
+"""
+数据库迁移 - 按版本号顺序执行的结构变更
+"""
+
+import logging
+import sqlite3
+from typing import Callable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def _column_exists(conn: sqlite3.Connection, table: str, column: str) -> bool:
+    """检查表中是否存在字段"""
+    return any(row[1] == column for row in conn.execute(f'PRAGMA table_info({table})'))
+
+
+def _add_column(conn: sqlite3.Connection, table: str, column: str, definition: str):
+    """添加字段（已存在时跳过，兼容迁移框架引入前的旧库）"""
+    if not _column_exists(conn, table, column):
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
+def _migration_001_baseline(conn: sqlite3.Connection):
+    """基础表结构"""
+    # 用户表
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            is_admin BOOLEAN DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_login TIMESTAMP
+        )
+    ''')
+
+    # Telegram配置表
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS telegram_config (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            bot_token TEXT,
+            chat_id TEXT,
+            api_id INTEGER,
+            api_hash TEXT,
+            enabled BOOLEAN DEFAULT 0,
+            push_mode TEXT DEFAULT 'file',
+            auto_download BOOLEAN DEFAULT 1,
+            file_size_limit INTEGER DEFAULT 50,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # 下载记录表
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS downloads (
+            id TEXT PRIMARY KEY,
+            url TEXT NOT NULL,
+            title TEXT,
+            status TEXT DEFAULT 'pending',
+            progress INTEGER DEFAULT 0,
+            file_path TEXT,
+            file_size INTEGER,
+            error_message TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            completed_at TIMESTAMP
+        )
+    ''')
+
+    # 系统设置表
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _migration_002_telegram_webhook_url(conn: sqlite3.Connection):
+    """Telegram配置增加webhook_url字段"""
+    _add_column(conn, 'telegram_config', 'webhook_url', "TEXT DEFAULT ''")
+
+
+def _migration_003_subscriptions(conn: sqlite3.Connection):
+    """频道订阅与下载存档"""
+    # 订阅表（频道/播放列表）
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            url TEXT UNIQUE NOT NULL,
+            title TEXT,
+            enabled BOOLEAN DEFAULT 1,
+            check_interval INTEGER DEFAULT 3600,
+            options TEXT DEFAULT '{}',
+            last_checked_at TIMESTAMP,
+            last_video_id TEXT,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # 下载存档表（已下载/已入队的视频ID）
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS download_archive (
+            archive_key TEXT PRIMARY KEY,
+            source TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _migration_004_downloads_indexes(conn: sqlite3.Connection):
+    """下载记录增加规范视频ID并建立常用查询索引"""
+    _add_column(conn, 'downloads', 'extractor', 'TEXT')
+    _add_column(conn, 'downloads', 'video_id', 'TEXT')
+
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_downloads_status ON downloads (status)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_downloads_created_at ON downloads (created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_downloads_file_path ON downloads (file_path)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_downloads_video ON downloads (extractor, video_id)')
+
+
+def url_host(url: str) -> str:
+    """提取URL主机名（小写，去掉www.前缀），用于历史记录按站点过滤"""
+    from urllib.parse import urlparse
+
+    try:
+        host = (urlparse(url or '').hostname or '').lower()
+    except ValueError:
+        return ''
+    return host[4:] if host.startswith('www.') else host
+
+
+def _migration_005_downloads_history(conn: sqlite3.Connection):
+    """下载记录增加来源/站点字段与分页索引"""
+    _add_column(conn, 'downloads', 'source', 'TEXT')
+    _add_column(conn, 'downloads', 'host', 'TEXT')
+
+    rows = conn.execute('SELECT id, url FROM downloads WHERE host IS NULL').fetchall()
+    conn.executemany('UPDATE downloads SET host = ? WHERE id = ?',
+                     [(url_host(row[1]), row[0]) for row in rows])
+
+    # 游标分页按 (created_at, id) 排序
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_downloads_created_id ON downloads (created_at, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_downloads_source ON downloads (source, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_downloads_host ON downloads (host, created_at)')
+
+
+def _fts5_available(conn: sqlite3.Connection) -> bool:
+    """检查SQLite是否编译了FTS5"""
+    try:
+        conn.execute('CREATE VIRTUAL TABLE temp._fts5_probe USING fts5(x)')
+        conn.execute('DROP TABLE temp._fts5_probe')
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def _migration_006_downloads_search(conn: sqlite3.Connection):
+    """下载记录全文索引（标题/上传者/URL/提取器/标签）"""
+    _add_column(conn, 'downloads', 'uploader', 'TEXT')
+    _add_column(conn, 'downloads', 'tags', 'TEXT')
+
+    if not _fts5_available(conn):
+        logger.warning("⚠️ 当前SQLite不支持FTS5，跳过全文索引")
+        return
+
+    # 索引内容经 fts_segment() 分词（中日韩字符单字成词），该函数由连接创建时注册。
+    # 其他未注册该函数的写入方会因触发器报错，迁移16已把触发器改为不依赖它
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS downloads_fts USING fts5(
+            title, uploader, url, extractor, tags,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS downloads_fts_insert AFTER INSERT ON downloads BEGIN
+            INSERT INTO downloads_fts (rowid, title, uploader, url, extractor, tags)
+            VALUES (new.rowid, fts_segment(new.title), fts_segment(new.uploader),
+                    new.url, new.extractor, fts_segment(new.tags));
+        END
+    ''')
+    # 只在被索引的字段变化时更新，进度/状态更新不会触发
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS downloads_fts_update
+        AFTER UPDATE OF title, uploader, url, extractor, tags ON downloads BEGIN
+            DELETE FROM downloads_fts WHERE rowid = old.rowid;
+            INSERT INTO downloads_fts (rowid, title, uploader, url, extractor, tags)
+            VALUES (new.rowid, fts_segment(new.title), fts_segment(new.uploader),
+                    new.url, new.extractor, fts_segment(new.tags));
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS downloads_fts_delete AFTER DELETE ON downloads BEGIN
+            DELETE FROM downloads_fts WHERE rowid = old.rowid;
+        END
+    ''')
+
+    conn.execute('''
+        INSERT INTO downloads_fts (rowid, title, uploader, url, extractor, tags)
+        SELECT rowid, fts_segment(title), fts_segment(uploader), url, extractor, fts_segment(tags)
+        FROM downloads
+    ''')
+
+
+def _migration_007_download_stats(conn: sqlite3.Connection):
+    """下载统计小时/日汇总表（按站点、来源、状态）"""
+    for table, bucket_format in (('download_stats_hourly', '%Y-%m-%d %H:00'),
+                                 ('download_stats_daily', '%Y-%m-%d')):
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                bucket TEXT NOT NULL,
+                host TEXT NOT NULL DEFAULT '',
+                source TEXT NOT NULL DEFAULT '',
+                status TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                bytes INTEGER NOT NULL DEFAULT 0,
+                duration REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (bucket, host, source, status)
+            )
+        ''')
+
+        # 用已有的终态记录回填
+        conn.execute(f'''
+            INSERT OR IGNORE INTO {table} (bucket, host, source, status, count, bytes, duration)
+            SELECT strftime('{bucket_format}', COALESCE(completed_at, created_at)),
+                   COALESCE(host, ''), COALESCE(source, ''), status, COUNT(*),
+                   SUM(COALESCE(file_size, 0)),
+                   SUM(CASE WHEN completed_at IS NOT NULL
+                            THEN MAX(0, (julianday(completed_at) - julianday(created_at)) * 86400)
+                            ELSE 0 END)
+            FROM downloads
+            WHERE status IN ('completed', 'failed', 'cancelled')
+            GROUP BY 1, 2, 3, 4
+        ''')
+
+
+def _migration_008_hash_api_keys(conn: sqlite3.Connection):
+    """明文API密钥迁移为哈希存储（支持多个密钥）"""
+    import json
+    from datetime import datetime
+    from .database import hash_api_key
+
+    row = conn.execute("SELECT value FROM settings WHERE key = 'api_key'").fetchone()
+    if not row or not row[0]:
+        conn.execute("DELETE FROM settings WHERE key = 'api_key'")
+        return
+
+    keys = [{
+        'id': 'legacy',
+        'name': '原API密钥',
+        'prefix': row[0][:6],
+        'hash': hash_api_key(row[0]),
+        'created_at': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+    }]
+    conn.execute(
+        "INSERT OR REPLACE INTO settings (key, value, updated_at) VALUES ('api_keys', ?, CURRENT_TIMESTAMP)",
+        (json.dumps(keys, ensure_ascii=False),)
+    )
+    conn.execute("DELETE FROM settings WHERE key = 'api_key'")
+
+
+def _migration_009_downloads_archive(conn: sqlite3.Connection):
+    """历史归档表（精简字段，错误信息截断）"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS downloads_archive (
+            id TEXT PRIMARY KEY,
+            url TEXT NOT NULL,
+            title TEXT,
+            status TEXT,
+            host TEXT,
+            source TEXT,
+            extractor TEXT,
+            video_id TEXT,
+            file_size INTEGER,
+            error_message TEXT,
+            created_at TIMESTAMP,
+            completed_at TIMESTAMP,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_downloads_archive_created_at ON downloads_archive (created_at)')
+
+
+def _migration_010_outbox(conn: sqlite3.Connection):
+    """事务性发件箱（与状态变更同一事务写入，由分发器投递）"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event TEXT NOT NULL,
+            idempotency_key TEXT UNIQUE NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            locked_until TIMESTAMP,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            delivered_at TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_outbox_status_next ON outbox (status, next_attempt_at)')
+
+
+def _migration_011_shared_state(conn: sqlite3.Connection):
+    """多进程共享状态：键值表、协调租约、任务选项"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS shared_state (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT,
+            expires_at TIMESTAMP,
+            PRIMARY KEY (namespace, key)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at TIMESTAMP NOT NULL
+        )
+    ''')
+    # 任务选项随记录保存，由协调进程领取执行
+    _add_column(conn, 'downloads', 'options', 'TEXT')
+
+
+def _migration_012_file_hashes(conn: sqlite3.Connection):
+    """下载目录文件内容哈希（去重）"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS file_hashes (
+            name TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            partial_hash TEXT NOT NULL,
+            full_hash TEXT,
+            linked_to TEXT,
+            hashed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_file_hashes_partial ON file_hashes (size, partial_hash)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_file_hashes_full ON file_hashes (full_hash)')
+
+
+def _migration_013_media_catalog(conn: sqlite3.Connection):
+    """媒体信息目录（ffprobe 与 yt-dlp 信息，按文件名+大小+修改时间校验）"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS media_catalog (
+            name TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            mimetype TEXT,
+            container TEXT,
+            duration REAL,
+            width INTEGER,
+            height INTEGER,
+            video_codec TEXT,
+            audio_codec TEXT,
+            bit_rate INTEGER,
+            info TEXT,
+            probed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _migration_014_settings_version(conn: sqlite3.Connection):
+    """设置版本号（各进程据此判断设置、API密钥与Telegram配置缓存是否失效）"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS settings_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('INSERT OR IGNORE INTO settings_version (id, version) VALUES (1, 0)')
+    for table in ('settings', 'telegram_config'):
+        for action in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_version_{action.lower()} AFTER {action} ON {table} BEGIN
+                    UPDATE settings_version SET version = version + 1 WHERE id = 1;
+                END
+            ''')
+
+
+def _migration_015_subscription_seeded(conn: sqlite3.Connection):
+    """订阅记录首次检查（记录现有视频）的完成时间，与最近检查时间分开"""
+    _add_column(conn, 'subscriptions', 'seeded_at', 'TIMESTAMP')
+    # 已有订阅：检查成功过（有最新视频ID或最近一次没有错误）的视为已完成首次检查
+    conn.execute('''
+        UPDATE subscriptions SET seeded_at = last_checked_at
+        WHERE seeded_at IS NULL AND last_checked_at IS NOT NULL
+          AND (last_video_id IS NOT NULL OR last_error IS NULL)
+    ''')
+
+
+def _migration_016_fts_triggers_without_udf(conn: sqlite3.Connection):
+    """全文索引触发器不再调用 fts_segment()
+
+    迁移6的触发器依赖应用在连接上注册的 Python 函数，sqlite3 命令行、备份/恢复
+    脚本等其他写入方修改 downloads 时会报 "no such function"。触发器改为写入
+    原始内容（任何写入方都能执行，英文等按词搜索不受影响），应用写入时再用
+    fts_segment() 重写分词后的索引行（见 Database._fts_reindex_statements）。
+    """
+    if not conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'downloads_fts'").fetchone():
+        return
+
+    conn.execute('DROP TRIGGER IF EXISTS downloads_fts_insert')
+    conn.execute('DROP TRIGGER IF EXISTS downloads_fts_update')
+    conn.execute('''
+        CREATE TRIGGER downloads_fts_insert AFTER INSERT ON downloads BEGIN
+            INSERT INTO downloads_fts (rowid, title, uploader, url, extractor, tags)
+            VALUES (new.rowid, new.title, new.uploader, new.url, new.extractor, new.tags);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER downloads_fts_update
+        AFTER UPDATE OF title, uploader, url, extractor, tags ON downloads BEGIN
+            DELETE FROM downloads_fts WHERE rowid = old.rowid;
+            INSERT INTO downloads_fts (rowid, title, uploader, url, extractor, tags)
+            VALUES (new.rowid, new.title, new.uploader, new.url, new.extractor, new.tags);
+        END
+    ''')
+
+
+# 迁移列表：(版本号, 说明, 执行函数)，只允许追加，不要修改已发布的迁移
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, '基础表结构', _migration_001_baseline),
+    (2, 'Telegram配置增加webhook_url字段', _migration_002_telegram_webhook_url),
+    (3, '频道订阅与下载存档', _migration_003_subscriptions),
+    (4, '下载记录规范视频ID与索引', _migration_004_downloads_indexes),
+    (5, '下载记录来源/站点字段与分页索引', _migration_005_downloads_history),
+    (6, '下载记录全文索引', _migration_006_downloads_search),
+    (7, '下载统计小时/日汇总表', _migration_007_download_stats),
+    (8, 'API密钥哈希存储', _migration_008_hash_api_keys),
+    (9, '下载历史归档表', _migration_009_downloads_archive),
+    (10, '事务性发件箱', _migration_010_outbox),
+    (11, '多进程共享状态与协调租约', _migration_011_shared_state),
+    (12, '文件内容哈希', _migration_012_file_hashes),
+    (13, '媒体信息目录', _migration_013_media_catalog),
+    (14, '设置版本号', _migration_014_settings_version),
+    (15, '订阅首次检查完成时间', _migration_015_subscription_seeded),
+    (16, '全文索引触发器不依赖自定义函数', _migration_016_fts_triggers_without_udf),
+]
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """获取当前数据库结构版本"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    return row[0] or 0
+
+
+def apply_migrations(conn: sqlite3.Connection, migrations=None) -> int:
+    """按顺序执行未应用的迁移，每个迁移在独立事务中完成
+
+    多个进程同时启动时，每个迁移都先取得写锁（BEGIN IMMEDIATE）并在事务内
+    重新读取结构版本，已由其他进程完成的迁移直接跳过。返回迁移后的结构版本。
+    """
+    migrations = sorted(migrations or MIGRATIONS, key=lambda m: m[0])
+    current = get_schema_version(conn)
+    conn.commit()
+
+    for version, description, migrate in migrations:
+        if version <= current:
+            continue
+
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            current = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0] or 0
+            if version <= current:
+                conn.rollback()
+                continue
+
+            logger.info(f"🔧 执行数据库迁移 v{version}: {description}")
+            migrate(conn)
+            conn.execute(
+                'INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                (version, description)
+            )
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"❌ 数据库迁移 v{version} 失败: {e}")
+            raise
+
+        current = version
+
+    return current
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+事务性发件箱分发器 - 至少一次投递下载完成/失败通知
+
+发件箱消息与下载状态变更在同一事务中写入 outbox 表，进程在状态落盘后、
+通知发出前崩溃也不会丢失通知；分发器重启后会继续投递未完成的消息。
+处理器成功返回后才标记为已投递，因此同一消息可能被重复投递，处理器可以
+利用幂等键自行去重。
+
+多进程部署时只在协调进程中运行；消息逐条领取，投递期间定期续租，
+耗时很长的投递（如大文件上传）不会因租约过期被其他进程重复领取。
+"""
+
+import json
+import logging
+import threading
+from typing import Dict, Any, Callable, List
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxDispatcher:
+    """发件箱分发器"""
+
+    def __init__(self):
+        self._handlers: Dict[str, List[Callable]] = {}
+        self._lock = threading.Lock()
+        self.dispatch_thread = None
+        self.stop_event = threading.Event()
+        self.wake_event = threading.Event()
+        self.running = False
+        self._stats = {'delivered': 0, 'retried': 0, 'dead': 0}
+
+    def register_handler(self, event: str, handler: Callable):
+        """注册投递处理器 handler(payload, idempotency_key)
+
+        处理器抛出异常或返回 False 视为投递失败，稍后按指数退避重试。
+        """
+        with self._lock:
+            handlers = self._handlers.setdefault(event, [])
+            if handler not in handlers:
+                handlers.append(handler)
+
+    def handler(self, event: str):
+        """装饰器：注册投递处理器"""
+        def decorator(func: Callable):
+            self.register_handler(event, func)
+            return func
+        return decorator
+
+    def start(self):
+        """启动分发线程"""
+        if self.running:
+            return
+
+        try:
+            from .config import get_config
+
+            if not get_config('outbox.enabled', True):
+                logger.info("📮 发件箱分发已禁用")
+                return
+
+            self.running = True
+            self.stop_event.clear()
+
+            self.dispatch_thread = threading.Thread(
+                target=self._dispatch_loop,
+                daemon=True,
+                name="OutboxDispatcher"
+            )
+            self.dispatch_thread.start()
+
+            logger.info("✅ 发件箱分发器已启动")
+
+        except Exception as e:
+            logger.error(f"❌ 启动发件箱分发器失败: {e}")
+
+    def stop(self):
+        """停止分发线程"""
+        if not self.running:
+            return
+
+        self.running = False
+        self.stop_event.set()
+        self.wake_event.set()
+
+        if self.dispatch_thread and self.dispatch_thread.is_alive():
+            self.dispatch_thread.join(timeout=5)
+
+        logger.info("✅ 发件箱分发器已停止")
+
+    def notify(self):
+        """有新消息写入，立即唤醒分发线程"""
+        self.wake_event.set()
+
+    def _dispatch_loop(self):
+        """分发循环：有消息时连续投递，空闲时按轮询间隔等待或被唤醒"""
+        from .config import get_config
+
+        while not self.stop_event.is_set():
+            try:
+                processed = self.run_once()
+            except Exception as e:
+                logger.error(f"❌ 发件箱分发失败: {e}")
+                processed = 0
+
+            if not processed:
+                self.wake_event.wait(get_config('outbox.poll_interval', 5))
+                self.wake_event.clear()
+
+    def run_once(self, db=None) -> int:
+        """逐条领取并投递消息（每轮最多 batch_size 条），返回处理条数"""
+        from .config import get_config
+
+        if db is None:
+            from .database import get_database
+            db = get_database()
+
+        with self._lock:
+            events = list(self._handlers)
+        if not events:
+            return 0
+
+        lease_seconds = get_config('outbox.lease_seconds', 600)
+        processed = 0
+        for _ in range(get_config('outbox.batch_size', 20)):
+            # 停止（如不再是协调进程）后不再领取新消息
+            if self.stop_event.is_set():
+                break
+            messages = db.claim_outbox_messages(events, limit=1, lease_seconds=lease_seconds)
+            if not messages:
+                break
+            self._deliver(db, messages[0], lease_seconds)
+            processed += 1
+        return processed
+
+    def _renew_lease(self, db, message_id: int, lease_seconds: int, done: threading.Event):
+        """投递期间每隔三分之一租约时长续租一次"""
+        while not done.wait(max(1, lease_seconds / 3)):
+            try:
+                db.renew_outbox_lease(message_id, lease_seconds)
+            except Exception as e:
+                logger.warning(f"⚠️ 发件箱消息续租失败: {message_id} - {e}")
+
+    def _deliver(self, db, message: Dict[str, Any], lease_seconds: int = 600):
+        """投递单条消息，失败时按指数退避重新排队"""
+        from .config import get_config
+
+        with self._lock:
+            handlers = list(self._handlers.get(message['event'], []))
+
+        done = threading.Event()
+        threading.Thread(
+            target=self._renew_lease,
+            args=(db, message['id'], lease_seconds, done),
+            daemon=True,
+            name="OutboxLease"
+        ).start()
+
+        try:
+            payload = json.loads(message['payload'])
+            for handler in handlers:
+                if handler(payload, message['idempotency_key']) is False:
+                    raise RuntimeError(f"{handler.__name__} 投递失败")
+
+            db.complete_outbox_message(message['id'])
+            with self._lock:
+                self._stats['delivered'] += 1
+
+        except Exception as e:
+            attempts = message['attempts']
+            max_attempts = get_config('outbox.max_attempts', 8)
+            if attempts >= max_attempts:
+                db.fail_outbox_message(message['id'], str(e))
+                with self._lock:
+                    self._stats['dead'] += 1
+                logger.error(f"❌ 发件箱消息投递失败，已放弃: {message['idempotency_key']} - {e}")
+                return
+
+            base_delay = get_config('outbox.retry_base_delay', 10)
+            max_delay = get_config('outbox.retry_max_delay', 3600)
+            retry_delay = min(max_delay, base_delay * 2 ** (attempts - 1))
+            db.fail_outbox_message(message['id'], str(e), retry_delay)
+            with self._lock:
+                self._stats['retried'] += 1
+            logger.warning(f"⚠️ 发件箱消息投递失败，{retry_delay}秒后重试 "
+                           f"({attempts}/{max_attempts}): {message['idempotency_key']} - {e}")
+
+        finally:
+            done.set()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取分发统计与发件箱积压"""
+        with self._lock:
+            stats = dict(self._stats)
+        try:
+            from .database import get_database
+            stats['outbox'] = get_database().get_outbox_stats()
+        except Exception as e:
+            logger.warning(f"⚠️ 获取发件箱统计失败: {e}")
+        return stats
+
+
+# 全局分发器实例
+_outbox_dispatcher = None
+
+def get_outbox_dispatcher() -> OutboxDispatcher:
+    """获取发件箱分发器实例"""
+    global _outbox_dispatcher
+    if _outbox_dispatcher is None:
+        _outbox_dispatcher = OutboxDispatcher()
+    return _outbox_dispatcher
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+全文搜索 - FTS5 分词与查询构建
+
+unicode61 分词器会把连续的中日韩文字当作一个词，无法搜索其中的片段。
+写入索引前在每个中日韩字符两侧加空格（单字成词），查询时把中文词转换为
+相邻单字组成的短语，这样任意长度的中文片段都能通过索引命中。
+"""
+
+import re
+import html
+from typing import Optional
+
+# 中日韩统一表意文字、假名、谚文
+_CJK_CHARS = (
+    '\u3040-\u30ff'   # 平假名、片假名
+    '\u3400-\u4dbf'   # 扩展A
+    '\u4e00-\u9fff'   # 基本区
+    '\uac00-\ud7af'   # 谚文
+    '\uf900-\ufaff'   # 兼容表意文字
+)
+_CJK_RE = re.compile(f'([{_CJK_CHARS}])')
+
+# 高亮标记使用私有区字符，转义HTML后再替换为<mark>
+HIGHLIGHT_START = '\ue000'
+HIGHLIGHT_END = '\ue001'
+
+# 还原中文单字之间的分词空格（允许中间夹着高亮标记）
+_CJK_GAP_RE = re.compile(f'([{_CJK_CHARS}][\ue000\ue001]?) +(?=[\ue000\ue001]?[{_CJK_CHARS}])')
+
+
+def segment_text(text: Optional[str]) -> Optional[str]:
+    """索引前分词：中日韩字符单字成词"""
+    if not text:
+        return text
+    return _CJK_RE.sub(r' \1 ', text)
+
+
+def build_match_query(query: str) -> Optional[str]:
+    """将用户输入转换为FTS5 MATCH表达式
+
+    每个空格分隔的词都必须命中（AND）；中文词转为相邻单字短语，
+    其他词按前缀匹配。返回None表示没有可搜索的内容。
+    """
+    terms = []
+    for word in (query or '').split():
+        tokens = re.findall(r'\w+', segment_text(word))
+        if not tokens:
+            continue
+        phrase = ' '.join(tokens).replace('"', '')
+        # 末尾不是中文时按前缀匹配，支持边输入边搜索
+        prefix = '' if _CJK_RE.match(tokens[-1][-1]) else '*'
+        terms.append(f'"{phrase}"{prefix}')
+
+    return ' AND '.join(terms) if terms else None
+
+
+def format_snippet(snippet: Optional[str]) -> str:
+    """将FTS5片段转换为安全的HTML（高亮部分用<mark>包裹）"""
+    if not snippet:
+        return ''
+    text = _CJK_GAP_RE.sub(r'\1', snippet.strip())
+    text = re.sub(r'\s{2,}', ' ', text)
+    text = html.escape(text)
+    return text.replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_END, '</mark>')
+
+
+def highlight_text(text: Optional[str], words) -> str:
+    """为未走FTS5的结果生成片段：转义HTML并用<mark>包裹命中的词（不区分大小写）"""
+    if not text:
+        return ''
+    words = [w for w in words if w]
+    if words:
+        pattern = re.compile('|'.join(re.escape(w) for w in sorted(words, key=len, reverse=True)),
+                             re.IGNORECASE)
+        text = pattern.sub(lambda m: f'{HIGHLIGHT_START}{m.group(0)}{HIGHLIGHT_END}', text)
+    return format_snippet(text)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+写后队列 - 单写线程批量提交数据库状态变更（group commit）
+"""
+
+import time
+import queue
+import atexit
+import logging
+import threading
+from typing import Any, Dict, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+
+class WriteWaiter:
+    """等待某次写入被提交"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.success = False
+
+    def _set(self, success: bool):
+        self.success = success
+        self._event.set()
+
+    def wait(self, timeout: float = None) -> bool:
+        """等待提交完成，返回是否成功写入"""
+        if not self._event.wait(timeout):
+            return False
+        return self.success
+
+
+class WriteBehindQueue:
+    """写后队列
+
+    调用方只负责入队，由单个写线程按批次（条数上限或时间窗口）在同一事务中提交。
+    需要持久化保证的写入可以等待返回的 WriteWaiter；带等待的写入会立即触发提交，
+    不必等满时间窗口。
+    """
+
+    _STOP = object()
+
+    def __init__(self, db, batch_size: int = 200, flush_interval: float = 0.05):
+        self.db = db
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = max(0.0, float(flush_interval))
+        self._queue = queue.Queue()
+        self._thread = None
+        self._atexit_registered = False
+        self._lock = threading.Lock()
+        self._stats = {'submitted': 0, 'committed': 0, 'failed': 0, 'batches': 0}
+
+    def _ensure_started(self):
+        """延迟启动写线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True, name="DatabaseWriter")
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.stop)
+                self._atexit_registered = True
+
+    def submit(self, query: Union[str, list], params: tuple = (), wait: bool = False) -> Optional[WriteWaiter]:
+        """提交写操作；wait=True 时返回可等待的 WriteWaiter
+
+        query 为 [(query, params), ...] 列表时，这些语句作为一个原子单元提交。
+        """
+        waiter = WriteWaiter() if wait else None
+        self._ensure_started()
+        self._queue.put((query, params, waiter))
+        with self._lock:
+            self._stats['submitted'] += 1
+        return waiter
+
+    def flush(self, timeout: float = None) -> bool:
+        """等待此前入队的所有写操作提交完成"""
+        if not self._thread or not self._thread.is_alive():
+            return True
+        waiter = WriteWaiter()
+        self._queue.put((None, (), waiter))
+        return waiter.wait(timeout)
+
+    def stop(self, timeout: float = 5):
+        """提交剩余写操作并停止写线程"""
+        thread = self._thread
+        if not thread or not thread.is_alive():
+            return
+        self._queue.put(self._STOP)
+        thread.join(timeout)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取统计信息"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['pending'] = self._queue.qsize()
+        return stats
+
+    def _run(self):
+        """写线程主循环"""
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is self._STOP:
+                break
+
+            batch = [item]
+            urgent = item[2] is not None
+            deadline = time.monotonic() + self.flush_interval
+
+            # 在时间窗口内继续收集，遇到需要等待的写入则立即提交
+            while len(batch) < self.batch_size:
+                try:
+                    if urgent:
+                        item = self._queue.get_nowait()
+                    else:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+                if item is self._STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                urgent = urgent or item[2] is not None
+
+            self._commit(batch)
+
+        # 停止前提交队列中剩余的写操作
+        remaining = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not self._STOP:
+                remaining.append(item)
+        if remaining:
+            self._commit(remaining)
+
+    def _commit(self, batch: list):
+        """在单个事务中提交一批写操作"""
+        writes = [(query, params) for query, params, _ in batch if query]
+        results = [True] * len(batch)
+
+        if writes:
+            try:
+                with self.db.get_connection() as conn:
+                    for query, params in writes:
+                        if isinstance(query, list):
+                            for statement, statement_params in query:
+                                conn.execute(statement, statement_params)
+                        else:
+                            conn.execute(query, params)
+                    conn.commit()
+            except Exception as e:
+                logger.warning(f"⚠️ 批量提交失败，逐条重试: {e}")
+                results = self._commit_individually(batch)
+
+        committed = sum(1 for ok, (query, _, _) in zip(results, batch) if query and ok)
+        failed = sum(1 for ok, (query, _, _) in zip(results, batch) if query and not ok)
+        with self._lock:
+            self._stats['batches'] += 1
+            self._stats['committed'] += committed
+            self._stats['failed'] += failed
+
+        for ok, (_, _, waiter) in zip(results, batch):
+            if waiter:
+                waiter._set(ok)
+
+    def _commit_individually(self, batch: list) -> list:
+        """逐条提交，避免单条错误语句拖累整批"""
+        results = []
+        for query, params, _ in batch:
+            if not query:
+                results.append(True)
+                continue
+            if isinstance(query, list):
+                results.append(self.db.execute_transaction(query))
+            else:
+                results.append(self.db.execute_update(query, params))
+        return results
@@ -133,15 +133,16 @@ class UnifiedDownloadAPI:
         """获取所有下载任务"""
         try:
             downloads = self.download_manager.get_all_downloads()
+            counts = self.download_manager.get_status_counts()
             
             return {
                 'success': True,
                 'data': {
                     'downloads': downloads,
-                    'total': len(downloads),
-                    'active': len([d for d in downloads if d['status'] in ['pending', 'downloading']]),
-                    'completed': len([d for d in downloads if d['status'] == 'completed']),
-                    'failed': len([d for d in downloads if d['status'] == 'failed'])
+                    'total': counts['total'],
+                    'active': counts.get('pending', 0) + counts.get('downloading', 0),
+                    'completed': counts.get('completed', 0),
+                    'failed': counts.get('failed', 0)
                 }
             }
             
@@ -264,7 +265,8 @@ class UnifiedDownloadAPI:
             'telegram_push': options.get('telegram_push', False),
             'telegram_push_mode': options.get('telegram_push_mode', 'file'),
             'web_callback': options.get('web_callback', False),
-            'ios_callback': options.get('ios_callback', False)
+            'ios_callback': options.get('ios_callback', False),
+            'subscription_id': options.get('subscription_id')
         }
         
         return standardized
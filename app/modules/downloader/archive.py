@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+下载存档 - 已下载视频ID索引（Bloom过滤器 + 数据库）
+"""
+
+import math
+import hashlib
+import logging
+import threading
+from typing import Optional, Iterable
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """简单的Bloom过滤器 - 用于快速排除未见过的视频ID"""
+
+    def __init__(self, capacity: int = 100000, error_rate: float = 0.001):
+        capacity = max(1000, int(capacity))
+        self.size = int(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self.hash_count = max(1, int(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key: str):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class DownloadArchive:
+    """下载存档 - 与yt-dlp的 --download-archive 使用相同的键格式"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._bloom = None
+
+    @staticmethod
+    def make_key(extractor: str, video_id: str) -> Optional[str]:
+        """生成存档键: '<extractor小写> <视频ID>'"""
+        if not extractor or not video_id:
+            return None
+        return f"{extractor.lower()} {video_id}"
+
+    def _get_bloom(self) -> BloomFilter:
+        """延迟从数据库加载Bloom过滤器"""
+        if self._bloom is None:
+            with self._lock:
+                if self._bloom is None:
+                    from ...core.database import get_database
+                    db = get_database()
+                    keys = db.get_archive_keys()
+                    bloom = BloomFilter(capacity=max(len(keys) * 2, 100000))
+                    for key in keys:
+                        bloom.add(key)
+                    self._bloom = bloom
+                    logger.info(f"✅ 下载存档已加载: {len(keys)} 条记录")
+        return self._bloom
+
+    def contains(self, extractor: str, video_id: str) -> bool:
+        """检查视频是否已在存档中"""
+        key = self.make_key(extractor, video_id)
+        if not key:
+            return False
+
+        # Bloom过滤器判定不存在则一定不存在，无需查库
+        if key not in self._get_bloom():
+            return False
+
+        from ...core.database import get_database
+        return get_database().archive_contains(key)
+
+    def add(self, extractor: str, video_id: str, source: str = None) -> bool:
+        """添加视频到存档"""
+        key = self.make_key(extractor, video_id)
+        if not key:
+            return False
+
+        from ...core.database import get_database
+        if not get_database().add_archive_key(key, source):
+            return False
+
+        with self._lock:
+            self._get_bloom().add(key)
+        return True
+
+    def add_many(self, entries: Iterable[tuple], source: str = None) -> int:
+        """批量添加 (extractor, video_id)"""
+        added = 0
+        for extractor, video_id in entries:
+            if self.add(extractor, video_id, source):
+                added += 1
+        return added
+
+
+# 全局存档实例
+_download_archive = None
+
+def get_download_archive() -> DownloadArchive:
+    """获取下载存档实例"""
+    global _download_archive
+    if _download_archive is None:
+        _download_archive = DownloadArchive()
+    return _download_archive
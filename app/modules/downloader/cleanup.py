@@ -157,18 +157,17 @@ class DownloadCleanup:
             logger.error(f"❌ 执行清理失败: {e}")
     
     def _get_download_files(self, directory: Path) -> List[Dict[str, Any]]:
-        """获取下载文件列表"""
+        """获取下载文件列表（来自下载目录索引）"""
         files = []
         try:
-            for file_path in directory.iterdir():
-                if file_path.is_file():
-                    stat = file_path.stat()
-                    files.append({
-                        'path': file_path,
-                        'name': file_path.name,
-                        'size': stat.st_size,
-                        'modified': stat.st_mtime
-                    })
+            from ..files.index import get_library_index
+            for entry in get_library_index().list_files():
+                files.append({
+                    'path': directory / entry['name'],
+                    'name': entry['name'],
+                    'size': entry['size'],
+                    'modified': entry['modified']
+                })
         except Exception as e:
             logger.error(f"❌ 获取文件列表失败: {e}")
         
@@ -178,6 +177,8 @@ class DownloadCleanup:
         """删除文件"""
         try:
             file_path.unlink()
+            from ..files.index import get_library_index
+            get_library_index().discard(file_path.name)
             logger.debug(f"🗑️ 删除文件: {file_path.name}")
             return True
         except Exception as e:
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+下载实时推送 - 由事件总线驱动的 Server-Sent Events 流
+
+下载事件被转换为任务状态增量，写入有界环形缓冲区并唤醒所有连接；
+客户端断线重连时携带 Last-Event-ID，从缓冲区补发错过的增量，
+超出缓冲范围（或服务重启）时发送 reset 让客户端重新加载列表。
+
+多进程部署时下载只在协调进程执行，其他进程收不到下载事件，
+改为在有连接时轮询数据库中的任务状态生成增量。
+"""
+
+import json
+import time
+import logging
+import threading
+from collections import deque
+from typing import Dict, Any, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadEventStream:
+    """下载状态增量广播"""
+
+    def __init__(self, buffer_size: int = 1000):
+        # 每次启动使用新的纪元，重启后旧的 Last-Event-ID 会触发 reset
+        self.epoch = format(int(time.time() * 1000), 'x')
+        self._buffer = deque(maxlen=max(1, int(buffer_size)))
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._started = False
+        self._clients = 0
+        self._board: Dict[str, Dict[str, Any]] = {}
+
+    def start(self):
+        """注册事件监听器（幂等）"""
+        with self._cond:
+            if self._started:
+                return
+            self._started = True
+
+        from ...core.events import event_bus, Events
+
+        # 单工作线程保证同一任务的增量按顺序发布
+        event_bus.configure_group('live', workers=1)
+        for event_name, kind in ((Events.DOWNLOAD_STARTED, 'started'),
+                                 (Events.DOWNLOAD_PROGRESS, 'progress'),
+                                 (Events.DOWNLOAD_COMPLETED, 'completed'),
+                                 (Events.DOWNLOAD_FAILED, 'failed'),
+                                 (Events.DOWNLOAD_CANCELLED, 'cancelled')):
+            event_bus.add_listener(event_name, self._make_listener(kind), group='live')
+
+        threading.Thread(target=self._poll_loop, daemon=True, name="LiveUpdatesPoller").start()
+
+        logger.info("✅ 下载实时推送已启动")
+
+    def _poll_loop(self):
+        """非协调进程：有连接时从数据库轮询任务状态变化"""
+        from ...core.config import get_config
+        from ...core.coordinator import get_coordinator
+
+        while True:
+            time.sleep(get_config('live_updates.poll_interval', 1))
+            coordinator = get_coordinator()
+            if not self._clients or not coordinator.running or coordinator.is_leader:
+                self._board.clear()
+                continue
+            try:
+                self._poll_board()
+            except Exception as e:
+                logger.warning(f"⚠️ 轮询任务状态失败: {e}")
+
+    def _poll_board(self):
+        """对比数据库中最近任务的快照，发布变化的增量"""
+        from .manager import get_download_manager
+        from ...core.database import get_database
+
+        manager = get_download_manager()
+        first = not self._board
+        board = {}
+        for record in get_database().get_recent_downloads(limit=20):
+            snapshot = self._snapshot(manager._record_to_info(record))
+            board[snapshot['id']] = snapshot
+            previous = self._board.get(snapshot['id'])
+            if first or previous == snapshot:
+                continue
+            if previous is None:
+                kind = 'started'
+            elif snapshot['status'] != previous['status'] and snapshot['status'] in manager.FINAL_STATUSES:
+                kind = snapshot['status']
+            else:
+                kind = 'progress'
+            self.publish({**snapshot, 'event': kind})
+        self._board = board
+
+    def _make_listener(self, kind: str):
+        def listener(data):
+            self._on_download_event(kind, data)
+        listener.__name__ = f'live_{kind}'
+        return listener
+
+    def _on_download_event(self, kind: str, data: Dict[str, Any]):
+        """将下载事件转换为任务快照增量（取处理时的最新状态）"""
+        download_id = (data or {}).get('download_id')
+        if not download_id:
+            return
+
+        from .manager import get_download_manager
+        download_info = get_download_manager().get_download(download_id)
+        delta = self._snapshot(download_info) if download_info else {
+            'id': download_id,
+            'status': data.get('status') or kind,
+            'progress': data.get('progress'),
+        }
+        delta['event'] = kind
+        self.publish(delta)
+
+    @staticmethod
+    def _snapshot(download_info: Dict[str, Any]) -> Dict[str, Any]:
+        """任务状态快照（字段与下载列表/历史接口一致）"""
+        status = download_info.get('status')
+        created_at = download_info.get('created_at')
+        item = {
+            'id': download_info['id'],
+            'url': download_info.get('url'),
+            'title': download_info.get('title'),
+            'status': status,
+            'progress': download_info.get('progress', 0),
+            'source': (download_info.get('options') or {}).get('source'),
+            'created_at': created_at.isoformat() if created_at else None,
+        }
+        file_path = download_info.get('file_path')
+        if status == 'completed' and file_path:
+            item['filename'] = file_path.split('/')[-1]
+            item['file_size'] = download_info.get('file_size')
+        if status == 'failed' and download_info.get('error_message'):
+            item['error_message'] = download_info['error_message']
+        return item
+
+    def publish(self, data: Dict[str, Any]) -> str:
+        """发布一条增量，返回事件ID"""
+        with self._cond:
+            self._seq += 1
+            self._buffer.append((self._seq, data))
+            self._cond.notify_all()
+            return f'{self.epoch}-{self._seq}'
+
+    def _resume_point(self, last_event_id: Optional[str]) -> Optional[int]:
+        """解析 Last-Event-ID，返回续传起点序号；无法续传时返回None"""
+        with self._cond:
+            if not last_event_id:
+                return self._seq
+            epoch, _, seq = last_event_id.partition('-')
+            if epoch != self.epoch or not seq.isdigit() or int(seq) > self._seq:
+                return None
+            if self._buffer and int(seq) < self._buffer[0][0] - 1:
+                return None
+            return int(seq)
+
+    def _format(self, seq: int, event: str, data: Dict[str, Any]) -> str:
+        return f"id: {self.epoch}-{seq}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    def stream(self, last_event_id: str = None, heartbeat: float = 15,
+               max_duration: float = 300) -> Iterator[str]:
+        """生成SSE文本流
+
+        连接在 max_duration 秒后主动结束，浏览器会携带 Last-Event-ID 自动重连，
+        避免长期占用工作线程。
+        """
+        self.start()
+        with self._cond:
+            self._clients += 1
+        try:
+            yield 'retry: 3000\n\n'
+            yield from self._stream(last_event_id, heartbeat, max_duration)
+        finally:
+            with self._cond:
+                self._clients -= 1
+
+    def _stream(self, last_event_id: Optional[str], heartbeat: float, max_duration: float) -> Iterator[str]:
+        seq = self._resume_point(last_event_id)
+        if seq is None:
+            with self._cond:
+                seq = self._seq
+            yield self._format(seq, 'reset', {})
+
+        deadline = time.monotonic() + max_duration
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._seq > seq,
+                                    min(heartbeat, max(0.0, deadline - time.monotonic())))
+                pending = [(s, data) for s, data in self._buffer if s > seq]
+                lost = bool(self._buffer) and self._buffer[0][0] > seq + 1
+                seq = self._seq
+
+            if lost:
+                # 客户端消费过慢，缓冲区已覆盖未发送的增量
+                yield self._format(seq, 'reset', {})
+            elif pending:
+                for s, data in pending:
+                    yield self._format(s, 'download', data)
+            else:
+                yield ': keepalive\n\n'
+
+            if time.monotonic() >= deadline:
+                break
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {'epoch': self.epoch, 'last_seq': self._seq, 'buffered': len(self._buffer),
+                    'clients': self._clients}
+
+
+# 全局实时推送实例
+_event_stream = None
+
+def get_download_event_stream() -> DownloadEventStream:
+    """获取下载实时推送实例"""
+    global _event_stream
+    if _event_stream is None:
+        from ...core.config import get_config
+        _event_stream = DownloadEventStream(get_config('live_updates.buffer_size', 1000))
+    return _event_stream
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+下载历史维护 - 过期记录归档与数据库空闲整理
+"""
+
+import gzip
+import json
+import logging
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Any, List
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryMaintenance:
+    """下载历史维护器
+
+    定期把超过保留期的已结束记录移出 downloads 表（写入精简归档表或压缩NDJSON文件），
+    统计汇总表保留日汇总；系统空闲时执行增量 VACUUM、PRAGMA optimize 并截断WAL。
+    """
+
+    def __init__(self):
+        self.maintenance_thread = None
+        self.stop_event = threading.Event()
+        self.running = False
+        self.last_result = None
+
+    def start(self):
+        """启动定期维护"""
+        if self.running:
+            return
+
+        try:
+            from ...core.config import get_config
+
+            if not get_config('database.maintenance.enabled', True):
+                logger.info("🧹 数据库维护已禁用")
+                return
+
+            self.running = True
+            self.stop_event.clear()
+
+            self.maintenance_thread = threading.Thread(
+                target=self._maintenance_loop,
+                daemon=True,
+                name="HistoryMaintenance"
+            )
+            self.maintenance_thread.start()
+
+            logger.info("✅ 数据库定期维护已启动")
+
+        except Exception as e:
+            logger.error(f"❌ 启动数据库维护失败: {e}")
+
+    def stop(self):
+        """停止定期维护"""
+        if not self.running:
+            return
+
+        self.running = False
+        self.stop_event.set()
+
+        if self.maintenance_thread and self.maintenance_thread.is_alive():
+            self.maintenance_thread.join(timeout=5)
+
+        logger.info("✅ 数据库定期维护已停止")
+
+    def _maintenance_loop(self):
+        """维护循环（启动后先等待一个周期，避开启动高峰）"""
+        from ...core.config import get_config
+
+        while not self.stop_event.wait(get_config('database.maintenance.interval', 3600)):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"❌ 数据库维护失败: {e}")
+
+    def run_once(self, db=None) -> Dict[str, Any]:
+        """执行一次维护：归档过期记录、清理小时汇总，空闲时整理数据库"""
+        from ...core.config import get_config
+
+        if db is None:
+            from ...core.database import get_database
+            db = get_database()
+
+        now = datetime.utcnow()
+        result = {'archived': 0, 'idle': False, 'vacuum': None}
+
+        retention_days = get_config('database.maintenance.retention_days', 90)
+        if retention_days and retention_days > 0:
+            # 先落盘写后队列，避免归档与排队中的状态更新交错
+            db.flush_writes()
+            cutoff = (now - timedelta(days=retention_days)).strftime('%Y-%m-%d %H:%M:%S')
+            batch_size = get_config('database.maintenance.batch_size', 500)
+
+            exporter = None
+            if get_config('database.maintenance.archive_mode', 'table') == 'ndjson':
+                archive_dir = get_config('database.maintenance.archive_dir') or (db.db_path.parent / 'archive')
+                exporter = NdjsonArchiveExporter(Path(archive_dir) / f"downloads-{now:%Y%m%d}.ndjson.gz")
+
+            result['archived'] = db.archive_old_downloads(cutoff, batch_size=batch_size, exporter=exporter)
+            if result['archived']:
+                logger.info(f"🧹 已归档 {result['archived']} 条早于 {cutoff} 的下载记录")
+
+        hourly_days = get_config('database.maintenance.hourly_rollup_retention_days', 35)
+        if hourly_days and hourly_days > 0:
+            db.prune_hourly_stats((now - timedelta(days=hourly_days)).strftime('%Y-%m-%d %H:00'))
+
+        outbox_days = get_config('outbox.retention_days', 7)
+        if outbox_days and outbox_days > 0:
+            db.prune_outbox((now - timedelta(days=outbox_days)).strftime('%Y-%m-%d %H:%M:%S'))
+
+        db.purge_expired_state()
+
+        if self._is_idle(db):
+            result['idle'] = True
+            result['vacuum'] = db.run_idle_maintenance(get_config('database.maintenance.vacuum_pages', 1000))
+
+        self.last_result = {**result, 'finished_at': now.isoformat()}
+        return result
+
+    def _is_idle(self, db) -> bool:
+        """没有进行中的下载且写后队列为空时视为空闲"""
+        from . import manager
+
+        download_manager = manager._download_manager
+        if download_manager:
+            counts = download_manager.get_status_counts()
+            if any(counts.get(status, 0) for status in ('pending', 'downloading', 'retrying')):
+                return False
+
+        return db.get_write_stats().get('pending', 0) == 0
+
+
+class NdjsonArchiveExporter:
+    """将归档记录追加到 gzip 压缩的 NDJSON 文件（每批一个 gzip 成员）"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+    def __call__(self, rows: List[Dict[str, Any]]):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with gzip.open(self.path, 'at', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False, default=str) + '\n')
+
+
+# 全局维护器实例
+_maintenance_instance = None
+
+def get_history_maintenance() -> HistoryMaintenance:
+    """获取下载历史维护器实例"""
+    global _maintenance_instance
+    if _maintenance_instance is None:
+        _maintenance_instance = HistoryMaintenance()
+    return _maintenance_instance
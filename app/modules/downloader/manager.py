@@ -4,10 +4,11 @@
 """
 
 import os
+import json
 import uuid
 import logging
 import threading
-from datetime import datetime
+from datetime import datetime, timezone
 from pathlib import Path
 from typing import Dict, Any, Optional, List
 from concurrent.futures import ThreadPoolExecutor
@@ -18,10 +19,15 @@ logger = logging.getLogger(__name__)
 class DownloadManager:
     """下载管理器"""
     
+    # 终态：进入时计入统计汇总，离开时（如失败后重试）撤销
+    FINAL_STATUSES = ('completed', 'failed', 'cancelled')
+
     def __init__(self):
         self.downloads: Dict[str, Dict[str, Any]] = {}
         self.lock = threading.RLock()
         self.executor = None
+        self._outcomes: Dict[str, Dict[str, Any]] = {}  # 已计入汇总的终态
+        self._coordinating = False  # 本进程是否负责执行下载（多进程部署时由选举决定）
         self._initialize()
     
     def _initialize(self):
@@ -38,14 +44,15 @@ class DownloadManager:
             self.output_dir.mkdir(parents=True, exist_ok=True)
             self.temp_dir.mkdir(parents=True, exist_ok=True)
 
-            # 清理遗留的下载任务
-            self._cleanup_orphaned_downloads()
-
             # 创建线程池
             self.executor = ThreadPoolExecutor(max_workers=max_concurrent)
 
-            # 启动自动清理
-            self._start_cleanup()
+            # 清理遗留任务、启动自动清理等只在协调进程执行；未启用选举（如脚本中直接使用）时本进程即协调者
+            from ...core.coordinator import get_coordinator
+            coordinator = get_coordinator()
+            coordinator.add_listener(self._on_elected, self._on_demoted)
+            if not coordinator.running:
+                self._on_elected()
 
             logger.info(f"✅ 下载管理器初始化完成 - 最大并发: {max_concurrent}")
 
@@ -53,17 +60,117 @@ class DownloadManager:
             logger.error(f"❌ 下载管理器初始化失败: {e}")
             raise
 
+    def _on_elected(self):
+        """成为协调者：清理遗留任务，接管排队中的任务并启动同步线程"""
+        with self.lock:
+            if self._coordinating:
+                return
+            self._coordinating = True
+
+        self._cleanup_orphaned_downloads()
+        self._adopt_queued_downloads()
+        self._start_cleanup()
+
+        from ...core.coordinator import get_coordinator
+        if get_coordinator().running:
+            threading.Thread(target=self._coordination_loop, daemon=True, name="DownloadCoordination").start()
+
+    def _on_demoted(self):
+        """失去协调者身份：停止领取新任务（进行中的任务继续完成）"""
+        with self.lock:
+            self._coordinating = False
+
+        try:
+            from .cleanup import get_cleanup_manager
+            get_cleanup_manager().stop()
+        except Exception as e:
+            logger.warning(f"⚠️ 停止自动清理失败: {e}")
+
+    def _coordination_loop(self):
+        """协调进程同步循环：领取其他进程提交的任务，处理跨进程取消请求"""
+        import time
+        from ...core.config import get_config
+        from ...core.database import get_database
+
+        while self._coordinating:
+            time.sleep(get_config('coordination.poll_interval', 1))
+            if not self._coordinating:
+                break
+            try:
+                self._adopt_queued_downloads()
+
+                db = get_database()
+                for download_id in db.state_keys('download_cancel'):
+                    if db.state_pop('download_cancel', download_id):
+                        self.cancel_download(download_id)
+            except Exception as e:
+                logger.error(f"❌ 协调同步失败: {e}")
+
+    def _is_coordinator(self) -> bool:
+        """本进程是否负责执行下载"""
+        return self._coordinating
+
+    def _adopt_queued_downloads(self):
+        """领取数据库中排队的任务（其他进程提交，或协调进程重启前未开始的任务）"""
+        try:
+            from ...core.database import get_database
+            for record in get_database().get_queued_downloads():
+                with self.lock:
+                    if not self._coordinating or record['id'] in self.downloads:
+                        continue
+                    download_info = self._record_to_info(record)
+                    self.downloads[record['id']] = download_info
+
+                self.executor.submit(self._execute_download, record['id'])
+                logger.info(f"📥 领取排队任务: {record['id']} - {record['url']}")
+
+        except Exception as e:
+            logger.error(f"❌ 领取排队任务失败: {e}")
+
+    def _record_to_info(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        """将数据库记录转换为与内存任务相同结构的字典（时间转换为本地时间）"""
+        def parse_time(value):
+            if not value:
+                return None
+            try:
+                utc = datetime.strptime(str(value)[:19], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+                return utc.astimezone().replace(tzinfo=None)
+            except ValueError:
+                return None
+
+        options = json.loads(record['options']) if record.get('options') else {}
+        return {
+            'id': record['id'],
+            'url': record['url'],
+            'status': record['status'],
+            'progress': record['progress'] or 0,
+            'title': record['title'],
+            'file_path': record['file_path'],
+            'file_size': record['file_size'],
+            'error_message': record['error_message'],
+            'created_at': parse_time(record['created_at']),
+            'completed_at': parse_time(record['completed_at']),
+            'options': options,
+            'retry_count': 0,
+            'max_retries': self._get_max_retries(options)
+        }
+
     def _cleanup_orphaned_downloads(self):
-        """清理遗留的下载任务（应用重启时调用）"""
+        """清理遗留的下载任务（成为协调者时调用）
+
+        进行中的任务随原协调进程中断，标记为失败；保存了任务选项的 pending 任务
+        尚未开始，由 _adopt_queued_downloads 继续执行。
+        """
         try:
             from ...core.database import get_database
             db = get_database()
 
             # 获取所有pending和downloading状态的任务
-            orphaned_downloads = db.execute_query('''
-                SELECT id, url FROM downloads
-                WHERE status IN ('pending', 'downloading')
-            ''')
+            orphaned_downloads = [download for download in db.execute_query('''
+                SELECT id, url, host, source FROM downloads
+                WHERE status IN ('downloading', 'retrying')
+                   OR (status = 'pending' AND options IS NULL)
+            ''') if download['id'] not in self.downloads]
 
             if orphaned_downloads:
                 logger.info(f"🧹 发现 {len(orphaned_downloads)} 个遗留下载任务，正在清理...")
@@ -81,6 +188,7 @@ class DownloadManager:
                             completed_at = CURRENT_TIMESTAMP
                         WHERE id = ?
                     ''', (download_id,))
+                    db.record_download_outcome('failed', host=download['host'], source=download['source'])
 
                     logger.debug(f"🧹 清理遗留任务: {download_id} - {url}")
 
@@ -122,13 +230,22 @@ class DownloadManager:
                 'max_retries': self._get_max_retries(options)  # 最大重试次数
             }
             
-            with self.lock:
-                self.downloads[download_id] = download_info
-            
-            # 保存到数据库
             from ...core.database import get_database
             db = get_database()
-            db.save_download_record(download_id, url)
+            coordinating = self._is_coordinator()
+            
+            if not coordinating:
+                # 非协调进程只写入排队记录（等待落盘），由协调进程领取执行
+                if not db.save_download_record(download_id, url, source=(options or {}).get('source'),
+                                               options=options or {}, wait=True):
+                    raise Exception("保存下载任务失败")
+            else:
+                with self.lock:
+                    self.downloads[download_id] = download_info
+                
+                # 保存到数据库（带任务选项，协调进程重启后可继续执行）
+                db.save_download_record(download_id, url, source=(options or {}).get('source'),
+                                        options=options or {})
             
             # 发送下载开始事件
             from ...core.events import emit, Events
@@ -139,7 +256,8 @@ class DownloadManager:
             })
             
             # 提交下载任务
-            self.executor.submit(self._execute_download, download_id)
+            if coordinating:
+                self.executor.submit(self._execute_download, download_id)
             
             logger.info(f"📥 创建下载任务: {download_id} - {url}")
             return download_id
@@ -149,14 +267,90 @@ class DownloadManager:
             raise
     
     def get_download(self, download_id: str) -> Optional[Dict[str, Any]]:
-        """获取下载信息"""
+        """获取下载信息（不在本进程时从数据库读取，任务可能由协调进程执行）"""
         with self.lock:
-            return self.downloads.get(download_id)
+            download_info = self.downloads.get(download_id)
+        if download_info or self._is_coordinator():
+            return download_info
+
+        from ...core.database import get_database
+        record = get_database().get_download_record(download_id)
+        return self._record_to_info(record) if record else None
     
+    def get_live_downloads(self, download_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """批量获取本进程内存中的实时任务信息（不查询数据库）
+
+        历史记录本身来自数据库，只有协调进程内存中的任务带有更新的实时进度；
+        其他进程直接返回空字典，避免逐条回查数据库。
+        """
+        with self.lock:
+            return {download_id: dict(self.downloads[download_id])
+                    for download_id in download_ids if download_id in self.downloads}
+
     def get_all_downloads(self) -> List[Dict[str, Any]]:
-        """获取所有下载"""
+        """获取所有下载（非协调进程返回数据库中进行中及最近的任务）"""
+        if not self._is_coordinator():
+            from ...core.database import get_database
+            return [self._record_to_info(record) for record in get_database().get_recent_downloads()]
+
         with self.lock:
             return list(self.downloads.values())
+
+    def get_status_counts(self) -> Dict[str, int]:
+        """获取各状态任务数
+
+        所有进程使用同一口径：终态来自日汇总表（全部历史），进行中的来自数据库，
+        无论请求由哪个工作进程处理结果都一致。
+        """
+        from ...core.database import get_database
+        counts = get_database().get_download_status_counts()
+        counts['total'] = sum(counts.values())
+        return counts
+
+    def _set_status(self, download_info: Dict[str, Any], status: str) -> str:
+        """设置任务状态（调用方需持有 self.lock），返回原状态"""
+        previous = download_info['status']
+        download_info['status'] = status
+        return previous
+
+    def _record_status_transition(self, download_id: str, previous: str, status: str):
+        """终态变化时更新统计汇总表"""
+        if previous == status:
+            return
+        if previous not in self.FINAL_STATUSES and status not in self.FINAL_STATUSES:
+            return
+
+        try:
+            from ...core.database import get_database
+            from ...core.migrations import url_host
+            db = get_database()
+
+            with self.lock:
+                download_info = self.downloads.get(download_id)
+                if not download_info:
+                    return
+                # 离开终态时撤销此前计入的结果
+                undo = self._outcomes.pop(download_id, None) if previous in self.FINAL_STATUSES else None
+                outcome = None
+                if status in self.FINAL_STATUSES:
+                    duration = (datetime.now() - download_info['created_at']).total_seconds()
+                    outcome = {
+                        'status': status,
+                        'host': url_host(download_info['url']),
+                        'source': (download_info.get('options') or {}).get('source'),
+                        'file_size': (download_info.get('file_size') or 0) if status == 'completed' else 0,
+                        'duration': max(0.0, duration),
+                        'finished_at': datetime.utcnow(),
+                    }
+                    self._outcomes[download_id] = outcome
+
+            if undo:
+                db.record_download_outcome(delta=-1, **undo)
+            if outcome:
+                db.record_download_outcome(**outcome)
+
+        except Exception as e:
+            logger.warning(f"⚠️ 更新下载统计失败: {e}")
     
     def cancel_download(self, download_id: str) -> bool:
         """取消下载"""
@@ -164,18 +358,23 @@ class DownloadManager:
             with self.lock:
                 download_info = self.downloads.get(download_id)
                 if not download_info:
-                    return False
+                    return self._request_remote_cancel(download_id)
                 
                 if download_info['status'] in ['completed', 'failed', 'cancelled']:
                     return False
                 
-                download_info['status'] = 'cancelled'
+                previous = self._set_status(download_info, 'cancelled')
                 download_info['error_message'] = '用户取消'
             
+            self._record_status_transition(download_id, previous, 'cancelled')
+            
             # 更新数据库
             from ...core.database import get_database
             db = get_database()
-            db.update_download_status(download_id, 'cancelled', error_message='用户取消')
+            db.update_download_status(download_id, 'cancelled', error_message='用户取消', wait=True)
+            
+            from ...core.events import emit, Events
+            emit(Events.DOWNLOAD_CANCELLED, {'download_id': download_id})
             
             logger.info(f"🚫 取消下载: {download_id}")
             return True
@@ -184,9 +383,47 @@ class DownloadManager:
             logger.error(f"❌ 取消下载失败: {e}")
             return False
     
+    def _request_remote_cancel(self, download_id: str) -> bool:
+        """任务由其他进程（协调者）执行时，写入共享取消请求"""
+        if self._is_coordinator():
+            return False
+
+        from ...core.database import get_database
+        db = get_database()
+        record = db.get_download_record(download_id)
+        if not record or record['status'] in self.FINAL_STATUSES:
+            return False
+        return db.state_set('download_cancel', download_id, True, ttl=3600)
+
+    def _release_download(self, download_id: str):
+        """放弃本进程内存中的任务（由新的协调进程接管或已被取消）"""
+        with self.lock:
+            self.downloads.pop(download_id, None)
+
+    def _claim_download(self, download_id: str) -> bool:
+        """开始执行前领取任务：本进程仍是协调者，且数据库中任务仍在排队或等待重试
+
+        失去协调者身份后线程池中已排队的任务不再执行；新的协调进程已接管
+        （pending 被重新领取、进行中的被标记为失败）或任务已被取消时，条件更新不会成功。
+        """
+        if not self._is_coordinator():
+            logger.info(f"⏭️ 已不是协调进程，放弃执行: {download_id}")
+            self._release_download(download_id)
+            return False
+
+        from ...core.database import get_database
+        if not get_database().claim_download(download_id):
+            logger.info(f"⏭️ 任务已由其他进程处理或已取消，跳过: {download_id}")
+            self._release_download(download_id)
+            return False
+        return True
+
     def _execute_download(self, download_id: str):
         """执行下载任务 - 带智能重试机制"""
         try:
+            if not self._claim_download(download_id):
+                return
+
             with self.lock:
                 download_info = self.downloads.get(download_id)
                 if not download_info:
@@ -214,6 +451,15 @@ class DownloadManager:
             with self.lock:
                 self.downloads[download_id]['title'] = title
 
+            from ...core.database import get_database
+            get_database().update_download_metadata(
+                download_id, title,
+                extractor=video_info.get('extractor_key') or video_info.get('extractor'),
+                video_id=video_info.get('id'),
+                uploader=video_info.get('uploader') or video_info.get('channel'),
+                tags=(video_info.get('tags') or []) + (video_info.get('categories') or [])
+            )
+
             # 执行下载
             file_path = self._download_video(download_id, url, video_info, options)
 
@@ -274,18 +520,20 @@ class DownloadManager:
             else:
                 # 放弃重试，标记为最终失败
                 final_error = f"重试{retry_count}次后仍然失败: {error_msg}"
-                self._update_download_status(download_id, 'failed', error_message=final_error)
+                from ...core.events import emit, Events
+                event_data = {
+                    'download_id': download_id,
+                    'url': url,
+                    'error': final_error
+                }
+                self._update_download_status(download_id, 'failed', error_message=final_error,
+                                             outbox=self._outbox_message(Events.DOWNLOAD_FAILED, event_data))
 
                 logger.error(f"❌ 下载最终失败，已放弃: {download_id}")
                 logger.error(f"❌ 最终错误: {final_error}")
 
                 # 发送下载失败事件
-                from ...core.events import emit, Events
-                emit(Events.DOWNLOAD_FAILED, {
-                    'download_id': download_id,
-                    'url': url,
-                    'error': final_error
-                })
+                emit(Events.DOWNLOAD_FAILED, event_data)
 
         except Exception as e:
             logger.error(f"❌ 处理下载失败时出错: {e}")
@@ -534,8 +782,7 @@ class DownloadManager:
 
             # 执行下载
             with YoutubeDL(ydl_opts) as ydl:
-                # 使用extract_info而不是download，以便更好地处理错误
-                info = ydl.extract_info(url, download=True)
+                info = self._run_download(ydl, download_id, url)
                 if not info:
                     raise Exception("无法获取视频信息")
 
@@ -549,19 +796,33 @@ class DownloadManager:
 
                 # 获取文件大小
                 file_size = Path(final_file).stat().st_size if Path(final_file).exists() else 0
-                self._update_download_status(download_id, 'completed', 100, final_file, file_size)
 
-                # 发送下载完成事件
+                # 记录媒体信息（通知与文件列表直接读取，不再各自调用ffprobe）
+                try:
+                    from ..files.catalog import get_media_catalog
+                    get_media_catalog().record(final_file, info if isinstance(info, dict) else video_info)
+                except Exception as e:
+                    logger.warning(f"⚠️ 记录媒体信息失败: {e}")
+
                 from ...core.events import emit, Events
-                emit(Events.DOWNLOAD_COMPLETED, {
+                event_data = {
                     'download_id': download_id,
                     'url': url,
                     'title': video_info.get('title', 'Unknown'),
                     'file_path': final_file,
                     'file_size': file_size,
                     'options': options
-                })
+                }
+                # 完成通知写入发件箱（与状态同一事务），保证进程重启后仍会投递
+                self._update_download_status(download_id, 'completed', 100, final_file, file_size,
+                                             outbox=self._outbox_message(Events.DOWNLOAD_COMPLETED, event_data))
+
+                # 发送下载完成事件
+                emit(Events.DOWNLOAD_COMPLETED, event_data)
                 logger.info(f"📤 下载完成事件已发送: {download_id}")
+
+                # 记录到下载存档（订阅增量检查依赖）
+                self._record_archive(video_info, options)
             else:
                 logger.warning(f"⚠️ 下载完成但未找到文件: {download_id}")
                 self._update_download_status(download_id, 'failed', error_message="下载完成但未找到文件")
@@ -590,6 +851,80 @@ class DownloadManager:
 
             return None
     
+    def _run_download(self, ydl, download_id: str, url: str) -> Optional[Dict[str, Any]]:
+        """执行下载 - 直链文件满足条件时使用多连接分段下载器"""
+        from ...core.config import get_config
+
+        if not get_config('downloader.segmented.enabled', False):
+            # 使用extract_info而不是download，以便更好地处理错误
+            return ydl.extract_info(url, download=True)
+
+        info = ydl.extract_info(url, download=False)
+        if not info:
+            return None
+
+        if self._try_segmented_download(download_id, ydl, info):
+            return info
+
+        # 复用已提取的信息交给yt-dlp原生下载器，避免重复解析
+        return ydl.process_ie_result(info, download=True)
+
+    def _try_segmented_download(self, download_id: str, ydl, info: Dict[str, Any]) -> bool:
+        """尝试使用分段下载器下载非分片的单一格式"""
+        try:
+            from ...core.config import get_config
+            from .segmented import create_segmented_downloader
+
+            # 只处理单一的渐进式HTTP格式（合并格式、分片格式交给yt-dlp）
+            if info.get('_type', 'video') != 'video' or info.get('requested_formats'):
+                return False
+            if info.get('protocol') not in ('http', 'https') or info.get('fragments'):
+                return False
+            if not info.get('url') or info.get('requested_subtitles'):
+                return False
+
+            min_size = get_config('downloader.segmented.min_size', 8 * 1024 * 1024)
+            known_size = info.get('filesize') or info.get('filesize_approx')
+            if known_size and known_size < min_size:
+                return False
+
+            downloader = create_segmented_downloader(proxy=self._get_proxy_config())
+            headers = dict(info.get('http_headers') or {})
+
+            probe = downloader.probe(info['url'], headers, ydl.cookiejar)
+            if not probe or not probe['accept_ranges'] or probe['size'] < min_size:
+                logger.debug(f"📥 服务器不支持Range或文件过小，使用yt-dlp下载: {download_id}")
+                return False
+
+            last_progress = [-1]
+
+            def on_progress(downloaded: int, total: int):
+                progress = int(downloaded * 100 / total)
+                if progress != last_progress[0]:
+                    last_progress[0] = progress
+                    self._update_download_progress(download_id, progress)
+
+            dest_path = ydl.prepare_filename(info)
+            downloader.download(probe['url'], dest_path, probe['size'], headers, ydl.cookiejar, on_progress)
+            logger.info(f"✅ 分段下载完成: {download_id}")
+            return True
+
+        except Exception as e:
+            logger.warning(f"⚠️ 分段下载失败，回退到yt-dlp下载器: {e}")
+            return False
+
+    def _record_archive(self, video_info: Dict[str, Any], options: Dict[str, Any]):
+        """将已完成的视频写入下载存档"""
+        try:
+            from .archive import get_download_archive
+            get_download_archive().add(
+                video_info.get('extractor_key') or video_info.get('extractor'),
+                video_info.get('id'),
+                source=(options or {}).get('source')
+            )
+        except Exception as e:
+            logger.warning(f"⚠️ 写入下载存档失败: {e}")
+
     def _sanitize_filename(self, filename: str, max_length: int = 80) -> str:
         """清理和截断文件名"""
         import re
@@ -815,10 +1150,8 @@ class DownloadManager:
             related_files = []
 
             # 查找所有以 temp_{download_id}_ 开头的文件
-            pattern = f'temp_{download_id}_*'
-            for file_path in self.output_dir.glob(pattern):
-                if file_path.is_file():
-                    related_files.append(file_path)
+            from ..files.index import get_library_index
+            related_files.extend(get_library_index().find(prefix=f'temp_{download_id}_'))
 
             logger.info(f"🔍 找到 {len(related_files)} 个相关文件: {[f.name for f in related_files]}")
             return related_files
@@ -1170,17 +1503,18 @@ class DownloadManager:
     def _find_downloaded_file(self, download_id: str, video_info: Dict[str, Any]) -> Optional[str]:
         """查找下载的文件"""
         try:
+            from ..files.index import get_library_index
+            index = get_library_index()
+
             # 优先搜索临时文件（新的下载方式）
-            for file_path in self.output_dir.glob(f'temp_{download_id}_*'):
-                if file_path.is_file():
-                    logger.info(f"✅ 找到临时下载文件: {file_path.name}")
-                    return str(file_path)
+            for file_path in index.find(prefix=f'temp_{download_id}_'):
+                logger.info(f"✅ 找到临时下载文件: {file_path.name}")
+                return str(file_path)
 
             # 兼容：搜索包含download_id的文件（旧的命名方式）
-            for file_path in self.output_dir.glob(f'{download_id}_*'):
-                if file_path.is_file():
-                    logger.info(f"✅ 找到下载文件: {file_path.name}")
-                    return str(file_path)
+            for file_path in index.find(prefix=f'{download_id}_'):
+                logger.info(f"✅ 找到下载文件: {file_path.name}")
+                return str(file_path)
 
             # 兼容旧的命名方式：按标题搜索
             title = video_info.get('title', '')
@@ -1196,10 +1530,9 @@ class DownloadManager:
                 # 清理标题中的特殊字符进行搜索
                 safe_title = "".join(c for c in title if c.isalnum() or c in (' ', '-', '_')).strip()
                 if safe_title:
-                    for file_path in self.output_dir.glob(f'*{safe_title}*'):
-                        if file_path.is_file():
-                            logger.info(f"✅ 找到下载文件（模糊匹配）: {file_path.name}")
-                            return str(file_path)
+                    for file_path in index.find(contains=safe_title):
+                        logger.info(f"✅ 找到下载文件（模糊匹配）: {file_path.name}")
+                        return str(file_path)
 
                 # 最后尝试搜索包含部分标题的文件
                 title_words = title.split()[:3]  # 取前3个词
@@ -1207,10 +1540,9 @@ class DownloadManager:
                     if len(word) > 3:  # 只搜索长度大于3的词
                         clean_word = "".join(c for c in word if c.isalnum())
                         if clean_word:
-                            for file_path in self.output_dir.glob(f'*{clean_word}*'):
-                                if file_path.is_file():
-                                    logger.info(f"✅ 找到下载文件（词匹配）: {file_path.name}")
-                                    return str(file_path)
+                            for file_path in index.find(contains=clean_word):
+                                logger.info(f"✅ 找到下载文件（词匹配）: {file_path.name}")
+                                return str(file_path)
 
             logger.warning(f"⚠️ 未找到下载文件: download_id={download_id}, title={title[:50]}...")
             return None
@@ -1220,13 +1552,18 @@ class DownloadManager:
             return None
     
     def _update_download_status(self, download_id: str, status: str, progress: int = None,
-                               file_path: str = None, file_size: int = None, error_message: str = None):
-        """更新下载状态"""
+                               file_path: str = None, file_size: int = None, error_message: str = None,
+                               outbox: Dict[str, Any] = None):
+        """更新下载状态
+
+        outbox 为需要可靠投递的通知（{'event', 'key', 'payload'}），与状态变更在同一事务中写入发件箱。
+        """
         try:
+            previous = status
             with self.lock:
                 download_info = self.downloads.get(download_id)
                 if download_info:
-                    download_info['status'] = status
+                    previous = self._set_status(download_info, status)
                     if progress is not None:
                         download_info['progress'] = progress
                     if file_path:
@@ -1238,10 +1575,17 @@ class DownloadManager:
                     if status == 'completed':
                         download_info['completed_at'] = datetime.now()
 
-            # 更新数据库
+            # 更新数据库（进度等中间状态批量写入，终态等待落盘后再通知监听器）
             from ...core.database import get_database
             db = get_database()
-            db.update_download_status(download_id, status, progress, file_path, file_size, error_message)
+            committed = db.update_download_status(download_id, status, progress, file_path, file_size,
+                                                  error_message, wait=status in self.FINAL_STATUSES,
+                                                  outbox=outbox)
+            self._record_status_transition(download_id, previous, status)
+
+            if outbox and committed:
+                from ...core.outbox import get_outbox_dispatcher
+                get_outbox_dispatcher().notify()
 
             # 发送进度事件（但不为重试状态发送事件，避免干扰）
             if progress is not None and status != 'retrying':
@@ -1255,6 +1599,13 @@ class DownloadManager:
         except Exception as e:
             logger.error(f"❌ 更新下载状态失败: {e}")
     
+    @staticmethod
+    def _outbox_message(event: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """构造发件箱消息，每个任务的每种通知只投递一次"""
+        payload = {key: value for key, value in data.items() if key != 'options'}
+        payload['source'] = (data.get('options') or {}).get('source')
+        return {'event': event, 'key': f"{event}:{data['download_id']}", 'payload': payload}
+
     def _update_download_progress(self, download_id: str, progress: int):
         """更新下载进度"""
         self._update_download_status(download_id, 'downloading', progress)
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+分段下载器 - 多连接HTTP Range并行下载
+"""
+
+import os
+import time
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Any, Optional, Callable, List, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class SegmentError(Exception):
+    """分段下载错误"""
+
+
+class SegmentedDownloader:
+    """多连接分段下载器 - 适用于支持Range请求的直链文件"""
+
+    def __init__(self, connections: int = 4, chunk_size: int = 1024 * 1024,
+                 segment_retries: int = 3, timeout: int = 30,
+                 min_segment_size: int = 1024 * 1024, proxy: str = None):
+        self.connections = max(1, int(connections))
+        self.chunk_size = max(16 * 1024, int(chunk_size))
+        self.segment_retries = max(0, int(segment_retries))
+        self.timeout = timeout
+        self.min_segment_size = max(1, int(min_segment_size))
+        self.proxy = proxy
+
+    def _new_session(self, headers: Dict[str, str] = None, cookies=None) -> requests.Session:
+        """创建HTTP会话（每个分段独立一个连接）"""
+        session = requests.Session()
+        if headers:
+            session.headers.update(headers)
+        if cookies is not None:
+            session.cookies = cookies
+        if self.proxy:
+            session.proxies = {'http': self.proxy, 'https': self.proxy}
+        return session
+
+    def probe(self, url: str, headers: Dict[str, str] = None, cookies=None) -> Optional[Dict[str, Any]]:
+        """探测服务器是否支持Range请求以及文件大小"""
+        session = self._new_session(headers, cookies)
+        try:
+            response = session.head(url, timeout=self.timeout, allow_redirects=True)
+            size = int(response.headers.get('Content-Length') or 0)
+            accept_ranges = response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+
+            # 部分服务器不响应HEAD，改用 bytes=0-0 试探
+            if response.status_code >= 400 or not size or not accept_ranges:
+                response = session.get(url, headers={'Range': 'bytes=0-0'},
+                                       timeout=self.timeout, stream=True, allow_redirects=True)
+                response.close()
+                if response.status_code == 206:
+                    total = _parse_content_range_total(response.headers.get('Content-Range', ''))
+                    if total:
+                        size = total
+                        accept_ranges = True
+
+            return {
+                'url': response.url,
+                'size': size,
+                'accept_ranges': accept_ranges and size > 0,
+            }
+
+        except Exception as e:
+            logger.warning(f"⚠️ 探测Range支持失败: {e}")
+            return None
+        finally:
+            session.close()
+
+    def plan_segments(self, total_size: int) -> List[Tuple[int, int]]:
+        """按连接数切分字节区间（闭区间）"""
+        count = min(self.connections, max(1, total_size // self.min_segment_size))
+        segment_size = total_size // count
+        segments = []
+        for i in range(count):
+            start = i * segment_size
+            end = total_size - 1 if i == count - 1 else start + segment_size - 1
+            segments.append((start, end))
+        return segments
+
+    def download(self, url: str, dest_path: str, total_size: int = None,
+                 headers: Dict[str, str] = None, cookies=None,
+                 progress_callback: Callable[[int, int], None] = None) -> str:
+        """并行下载到预分配文件，完成后原子重命名"""
+        if not total_size:
+            info = self.probe(url, headers, cookies)
+            if not info or not info['accept_ranges']:
+                raise SegmentError('服务器不支持Range请求')
+            total_size = info['size']
+            url = info['url']
+
+        dest = Path(dest_path)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        part_path = dest.with_name(dest.name + '.part')
+
+        segments = self.plan_segments(total_size)
+        logger.info(f"🚀 分段下载: {dest.name} ({total_size} bytes, {len(segments)} 个连接)")
+
+        self._preallocate(part_path, total_size)
+
+        progress = {'downloaded': 0}
+        progress_lock = threading.Lock()
+
+        def on_bytes(count: int):
+            with progress_lock:
+                progress['downloaded'] += count
+                downloaded = progress['downloaded']
+            if progress_callback:
+                try:
+                    progress_callback(downloaded, total_size)
+                except Exception:
+                    pass
+
+        started = time.time()
+        # 任一分段失败后通知其他分段尽快停止，不再等它们下载完
+        cancel = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=len(segments), thread_name_prefix='Segment')
+        try:
+            futures = [
+                executor.submit(self._download_segment, url, part_path, start, end,
+                                headers, cookies, on_bytes, cancel)
+                for start, end in segments
+            ]
+            for future in as_completed(futures):
+                future.result()
+            executor.shutdown()
+
+            os.replace(part_path, dest)
+
+        except BaseException:
+            cancel.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+            try:
+                part_path.unlink()
+            except OSError:
+                pass
+            raise
+
+        elapsed = max(time.time() - started, 1e-6)
+        logger.info(f"✅ 分段下载完成: {dest.name} ({total_size / elapsed / 1024 / 1024:.1f} MB/s)")
+        return str(dest)
+
+    def _preallocate(self, path: Path, size: int):
+        """预分配目标文件空间"""
+        with open(path, 'wb') as f:
+            if hasattr(os, 'posix_fallocate'):
+                try:
+                    os.posix_fallocate(f.fileno(), 0, size)
+                    return
+                except OSError:
+                    pass
+            f.truncate(size)
+
+    def _download_segment(self, url: str, path: Path, start: int, end: int,
+                          headers: Dict[str, str], cookies, on_bytes: Callable[[int], None],
+                          cancel: threading.Event = None):
+        """下载单个分段 - 失败时从断点续传重试，cancel 被设置后尽快退出"""
+        cancel = cancel or threading.Event()
+        position = start
+        attempt = 0
+        session = self._new_session(headers, cookies)
+
+        try:
+            while position <= end:
+                if cancel.is_set():
+                    raise SegmentError(f'分段 {start}-{end} 已取消')
+                try:
+                    response = session.get(
+                        url,
+                        headers={'Range': f'bytes={position}-{end}'},
+                        timeout=self.timeout,
+                        stream=True,
+                    )
+                    try:
+                        if response.status_code != 206:
+                            raise SegmentError(f'服务器未返回206: HTTP {response.status_code}')
+
+                        range_start = _parse_content_range_start(response.headers.get('Content-Range', ''))
+                        if range_start != position:
+                            raise SegmentError(f'Content-Range不匹配: {response.headers.get("Content-Range")}')
+
+                        with open(path, 'r+b') as f:
+                            f.seek(position)
+                            for chunk in response.iter_content(chunk_size=self.chunk_size):
+                                if cancel.is_set():
+                                    break
+                                if not chunk:
+                                    continue
+                                chunk = chunk[:end - position + 1]
+                                f.write(chunk)
+                                position += len(chunk)
+                                on_bytes(len(chunk))
+                                if position > end:
+                                    break
+                    finally:
+                        response.close()
+
+                    if cancel.is_set():
+                        raise SegmentError(f'分段 {start}-{end} 已取消')
+                    if position <= end:
+                        raise SegmentError(f'分段提前结束: {position}/{end}')
+
+                except (requests.RequestException, SegmentError, OSError) as e:
+                    if cancel.is_set():
+                        raise SegmentError(f'分段 {start}-{end} 已取消')
+                    attempt += 1
+                    if attempt > self.segment_retries:
+                        raise SegmentError(f'分段 {start}-{end} 重试{self.segment_retries}次后失败: {e}')
+
+                    delay = min(2 ** (attempt - 1), 30)
+                    logger.warning(f"⚠️ 分段 {start}-{end} 失败，{delay}秒后从 {position} 续传 ({attempt}/{self.segment_retries}): {e}")
+                    cancel.wait(delay)
+        finally:
+            session.close()
+
+
+def _parse_content_range_start(value: str) -> Optional[int]:
+    """解析 Content-Range: bytes start-end/total 中的起始位置"""
+    try:
+        return int(value.split()[1].split('-')[0])
+    except (IndexError, ValueError):
+        return None
+
+
+def _parse_content_range_total(value: str) -> Optional[int]:
+    """解析 Content-Range 中的总大小"""
+    try:
+        total = value.rsplit('/', 1)[1]
+        return int(total) if total != '*' else None
+    except (IndexError, ValueError):
+        return None
+
+
+def create_segmented_downloader(proxy: str = None) -> SegmentedDownloader:
+    """根据配置创建分段下载器"""
+    from ...core.config import get_config
+
+    return SegmentedDownloader(
+        connections=get_config('downloader.segmented.connections', 4),
+        chunk_size=get_config('downloader.segmented.chunk_size', 1024 * 1024),
+        segment_retries=get_config('downloader.segmented.segment_retries', 3),
+        timeout=get_config('downloader.segmented.timeout', 30),
+        min_segment_size=get_config('downloader.segmented.min_segment_size', 1024 * 1024),
+        proxy=proxy,
+    )
@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+"""
+媒体信息目录 - 每个文件只探测一次，通知、文件列表与播放方式共用
+
+下载完成时（附带 yt-dlp 的信息）或首次在下载目录中发现文件时执行一次 ffprobe，
+结果写入 media_catalog 表，按 文件名 + 大小 + 修改时间 校验，文件变化后重新探测。
+读取只查内存缓存与数据库，不会在页面请求中启动子进程；多进程部署时后台探测
+只在协调进程中执行。
+"""
+
+import json
+import shutil
+import logging
+import mimetypes
+import subprocess
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 保存的 yt-dlp 信息字段
+INFO_FIELDS = ('id', 'title', 'uploader', 'channel', 'webpage_url', 'extractor_key', 'upload_date',
+               'duration', 'width', 'height', 'fps', 'vcodec', 'acodec', 'format_id', 'thumbnail')
+
+# 浏览器可以直接播放的类型与视频编码
+DIRECT_MIMETYPES = {'video/mp4', 'video/webm', 'audio/mp4', 'audio/webm', 'audio/mpeg', 'audio/ogg',
+                    'audio/flac', 'audio/wav', 'audio/aac'}
+DIRECT_VIDEO_CODECS = {'h264', 'vp8', 'vp9', 'av1'}
+
+MEMORY_CACHE_SIZE = 4096
+
+
+def _same_file(entry: Dict[str, Any], size: int, modified: float) -> bool:
+    """记录是否对应当前文件（修改时间按微秒比较，兼容浮点秒）"""
+    return entry['size'] == size and abs(entry['mtime_ns'] - modified * 1e9) < 1000
+
+
+def _mimetype(path: Path, container: str, has_video: bool) -> str:
+    """按实际容器与是否有视频流确定 MIME 类型"""
+    ext = path.suffix.lower()
+    formats = set((container or '').split(','))
+    if 'matroska' in formats:
+        if ext == '.webm':
+            return 'video/webm' if has_video else 'audio/webm'
+        return 'video/x-matroska' if has_video else 'audio/x-matroska'
+    if 'mp4' in formats or 'mov' in formats:
+        if ext == '.mov':
+            return 'video/quicktime'
+        return 'video/mp4' if has_video else 'audio/mp4'
+    if 'mpegts' in formats:
+        return 'video/mp2t'
+    return mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+
+
+def get_playback(entry: Optional[Dict[str, Any]]) -> Optional[str]:
+    """播放方式：direct 直接播放 / hls 在线封装 / None 只能下载（未探测时也为 None）"""
+    if not entry:
+        return None
+    from .hls import VIDEO_CODECS
+    video_codec = entry.get('video_codec')
+    if entry.get('mimetype') in DIRECT_MIMETYPES and (video_codec is None or video_codec in DIRECT_VIDEO_CODECS):
+        return 'direct'
+    if video_codec in VIDEO_CODECS:
+        return 'hls'
+    return None
+
+
+class MediaCatalog:
+    """媒体信息目录"""
+
+    def __init__(self):
+        self.executor = None
+        self.scan_thread = None
+        self.stop_event = threading.Event()
+        self.running = False
+        self._lock = threading.Lock()
+        self._cache: OrderedDict = OrderedDict()  # 文件名 -> 记录
+        self._pending = set()
+        self._failed = set()
+        self._index_version = None
+        self._stats = {'probed': 0, 'hits': 0, 'misses': 0, 'failed': 0}
+
+    def start(self):
+        """启动后台探测（下载目录中新发现的媒体文件）"""
+        if self.running:
+            return
+
+        try:
+            from ...core.config import get_config
+
+            if not get_config('files.catalog.enabled', True):
+                logger.info("📺 媒体信息目录已禁用")
+                return
+            if not shutil.which('ffprobe'):
+                logger.warning("⚠️ 未找到ffprobe，媒体信息只记录下载信息")
+
+            self.executor = ThreadPoolExecutor(
+                max_workers=get_config('files.catalog.workers', 1),
+                thread_name_prefix="MediaCatalog"
+            )
+            self.running = True
+            self.stop_event.clear()
+
+            self.scan_thread = threading.Thread(
+                target=self._scan_loop,
+                daemon=True,
+                name="MediaCatalogScanner"
+            )
+            self.scan_thread.start()
+
+            logger.info("✅ 媒体信息目录已启动")
+
+        except Exception as e:
+            logger.error(f"❌ 启动媒体信息目录失败: {e}")
+
+    def stop(self):
+        """停止后台探测"""
+        if not self.running:
+            return
+
+        self.running = False
+        self.stop_event.set()
+
+        if self.scan_thread and self.scan_thread.is_alive():
+            self.scan_thread.join(timeout=5)
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+        logger.info("✅ 媒体信息目录已停止")
+
+    def _scan_loop(self):
+        from ...core.config import get_config
+
+        while not self.stop_event.is_set():
+            try:
+                self.scan_library()
+            except Exception as e:
+                logger.error(f"❌ 媒体信息扫描失败: {e}")
+            self.stop_event.wait(get_config('files.catalog.scan_interval', 60))
+
+    def scan_library(self, db=None):
+        """下载目录变化后：清理已删除文件的记录，为未探测的媒体文件排队"""
+        from .index import get_library_index
+
+        if db is None:
+            from ...core.database import get_database
+            db = get_database()
+
+        index = get_library_index()
+        version = index.version
+        if version == self._index_version or not self._is_generator():
+            return
+        self._index_version = version
+
+        entries = index.list_files()
+        db.prune_media_entries([entry['name'] for entry in entries])
+        self.lookup_many([entry for entry in entries if entry['kind'] in ('video', 'audio')],
+                         root=index.root, db=db)
+
+    @staticmethod
+    def _is_generator() -> bool:
+        """多进程部署时只有协调进程执行后台探测"""
+        from ...core.coordinator import get_coordinator
+        coordinator = get_coordinator()
+        return coordinator.is_leader or not coordinator.running
+
+    def _remember(self, entry: Dict[str, Any]):
+        with self._lock:
+            self._cache[entry['name']] = entry
+            self._cache.move_to_end(entry['name'])
+            while len(self._cache) > MEMORY_CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+    def lookup_many(self, entries: List[Dict[str, Any]], root: Path, db=None) -> Dict[str, Dict[str, Any]]:
+        """批量读取索引条目对应的媒体信息（内存缓存 + 一次数据库查询），缺失的排队探测"""
+        found = {}
+        missing = []
+        with self._lock:
+            for entry in entries:
+                cached = self._cache.get(entry['name'])
+                if cached and _same_file(cached, entry['size'], entry['modified']):
+                    found[entry['name']] = cached
+                else:
+                    missing.append(entry)
+            self._stats['hits'] += len(found)
+
+        if missing:
+            if db is None:
+                from ...core.database import get_database
+                db = get_database()
+            rows = db.get_media_entries([entry['name'] for entry in missing])
+            for entry in missing:
+                row = rows.get(entry['name'])
+                if row and _same_file(row, entry['size'], entry['modified']):
+                    found[entry['name']] = row
+                    self._remember(row)
+                else:
+                    with self._lock:
+                        self._stats['misses'] += 1
+                    self._enqueue(root / entry['name'], entry['size'], entry['modified'])
+        return found
+
+    def lookup(self, path: Path) -> Optional[Dict[str, Any]]:
+        """读取单个文件的媒体信息（不探测，缺失时排队）"""
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        entry = {'name': path.name, 'size': stat.st_size, 'modified': stat.st_mtime}
+        return self.lookup_many([entry], root=path.parent).get(path.name)
+
+    def get(self, path: Path) -> Optional[Dict[str, Any]]:
+        """读取媒体信息，缺失时立即探测（每个文件只探测一次）"""
+        path = Path(path)
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        entry = {'name': path.name, 'size': stat.st_size, 'modified': stat.st_mtime}
+        with self._lock:
+            cached = self._cache.get(path.name)
+        if cached and _same_file(cached, stat.st_size, stat.st_mtime):
+            return cached
+
+        from ...core.database import get_database
+        row = get_database().get_media_entries([path.name]).get(path.name)
+        if row and _same_file(row, entry['size'], entry['modified']):
+            self._remember(row)
+            return row
+        return self.record(path)
+
+    def record(self, path, info: Dict[str, Any] = None) -> Optional[Dict[str, Any]]:
+        """探测文件并保存（下载完成时附带 yt-dlp 信息）"""
+        from ...core.database import get_database
+
+        path = Path(path)
+        try:
+            entry = self.probe(path)
+        except FileNotFoundError:
+            return None
+        if info:
+            entry['info'] = {key: info[key] for key in INFO_FIELDS if info.get(key) is not None}
+            for key in ('duration', 'width', 'height'):
+                if entry.get(key) is None and isinstance(info.get(key), (int, float)):
+                    entry[key] = info[key]
+        else:
+            # 保留此前记录的下载信息（文件被替换或修改后重新探测）
+            previous = get_database().get_media_entries([path.name]).get(path.name)
+            entry['info'] = previous['info'] if previous else {}
+
+        get_database().save_media_entry(entry)
+        self._remember(entry)
+        with self._lock:
+            self._stats['probed'] += 1
+        return entry
+
+    def probe(self, path: Path) -> Dict[str, Any]:
+        """执行 ffprobe（不可用或失败时只记录大小、修改时间与按扩展名判断的类型）"""
+        stat = path.stat()
+        entry = {
+            'name': path.name, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+            'mimetype': mimetypes.guess_type(path.name)[0], 'container': None, 'duration': None,
+            'width': None, 'height': None, 'video_codec': None, 'audio_codec': None, 'bit_rate': None,
+            'info': {},
+        }
+        if not shutil.which('ffprobe'):
+            return entry
+
+        result = subprocess.run(
+            ['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_format', '-show_streams', str(path)],
+            capture_output=True, text=True, timeout=30
+        )
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip()[-200:] or 'ffprobe失败')
+        data = json.loads(result.stdout or '{}')
+
+        fmt = data.get('format', {})
+        streams = data.get('streams', [])
+        # 音频文件的封面图也是视频流，不计入
+        video = next((s for s in streams if s.get('codec_type') == 'video'
+                      and not s.get('disposition', {}).get('attached_pic')), None)
+        audio = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+
+        entry.update({
+            'container': fmt.get('format_name'),
+            'duration': float(fmt['duration']) if fmt.get('duration') else None,
+            'bit_rate': int(fmt['bit_rate']) if str(fmt.get('bit_rate', '')).isdigit() else None,
+            'video_codec': video.get('codec_name') if video else None,
+            'audio_codec': audio.get('codec_name') if audio else None,
+            'width': video.get('width') if video else None,
+            'height': video.get('height') if video else None,
+        })
+        entry['mimetype'] = _mimetype(path, entry['container'], video is not None)
+        return entry
+
+    def _enqueue(self, path: Path, size: int, modified: float):
+        if not self.running or not self._is_generator():
+            return
+        memo_key = (path.name, size, modified)
+        with self._lock:
+            if memo_key in self._pending or memo_key in self._failed:
+                return
+            self._pending.add(memo_key)
+        self.executor.submit(self._process, path, memo_key)
+
+    def _process(self, path: Path, memo_key: tuple):
+        try:
+            self.record(path)
+        except Exception as e:
+            with self._lock:
+                self._failed.add(memo_key)
+                self._stats['failed'] += 1
+            logger.warning(f"⚠️ 探测媒体信息失败 {path.name}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(memo_key)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, 'cached': len(self._cache), 'pending': len(self._pending),
+                    'running': self.running}
+
+
+# 全局媒体信息目录实例
+_media_catalog = None
+
+def get_media_catalog() -> MediaCatalog:
+    """获取媒体信息目录实例"""
+    global _media_catalog
+    if _media_catalog is None:
+        _media_catalog = MediaCatalog()
+    return _media_catalog
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""
+下载目录去重 - 内容相同的文件改为共享数据（硬链接或 reflink）
+
+后台按两级哈希识别重复文件：
+- 部分哈希：文件大小 + 首尾各 64KB（与缩略图缓存键相同），新文件或变化过的文件计算一次；
+- 完整哈希：只对大小与部分哈希都相同、且不是同一 inode 的文件计算。
+两级哈希的读取都限速，有任务正在下载时暂停，不与下载争抢磁盘带宽。
+哈希记录保存在 file_hashes 表中，文件未变化（大小、修改时间、inode 一致）时不再读取。
+多进程部署时只在协调进程中运行。
+"""
+
+import os
+import time
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Any, List
+
+logger = logging.getLogger(__name__)
+
+FICLONE = 0x40049409
+TEMP_SUFFIXES = ('.part', '.ytdl', '.tmp', '.temp')
+
+
+class DedupService:
+    """下载目录去重服务"""
+
+    def __init__(self):
+        self.dedup_thread = None
+        self.stop_event = threading.Event()
+        self.wake_event = threading.Event()
+        self.running = False
+        self.last_result = None
+
+    def start(self):
+        """启动后台去重"""
+        if self.running:
+            return
+
+        try:
+            from ...core.config import get_config
+            from ...core.events import event_bus, Events
+
+            if not get_config('files.dedup.enabled', True):
+                logger.info("🧹 文件去重已禁用")
+                return
+
+            self.running = True
+            self.stop_event.clear()
+
+            event_bus.add_listener(Events.DOWNLOAD_COMPLETED, self._on_download_completed, group='files')
+
+            self.dedup_thread = threading.Thread(
+                target=self._dedup_loop,
+                daemon=True,
+                name="FileDedup"
+            )
+            self.dedup_thread.start()
+
+            logger.info("✅ 文件去重已启动")
+
+        except Exception as e:
+            logger.error(f"❌ 启动文件去重失败: {e}")
+
+    def stop(self):
+        """停止去重（进行中的哈希计算在下一个数据块后退出）"""
+        if not self.running:
+            return
+
+        self.running = False
+        self.stop_event.set()
+        self.wake_event.set()
+
+        try:
+            from ...core.events import event_bus, Events
+            event_bus.remove_listener(Events.DOWNLOAD_COMPLETED, self._on_download_completed)
+        except Exception as e:
+            logger.warning(f"⚠️ 移除文件去重监听器失败: {e}")
+
+        if self.dedup_thread and self.dedup_thread.is_alive():
+            self.dedup_thread.join(timeout=5)
+
+        logger.info("✅ 文件去重已停止")
+
+    def _on_download_completed(self, data: Dict[str, Any]):
+        self.wake_event.set()
+
+    def _dedup_loop(self):
+        """下载完成后或每个周期执行一次"""
+        from ...core.config import get_config
+
+        while not self.stop_event.is_set():
+            self.wake_event.wait(get_config('files.dedup.interval', 3600))
+            self.wake_event.clear()
+            if self.stop_event.is_set():
+                break
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"❌ 文件去重失败: {e}")
+
+    def run_once(self, db=None, index=None) -> Dict[str, Any]:
+        """哈希新文件并合并重复文件"""
+        from ...core.config import get_config
+        from .thumbnails import content_key, SAMPLE_BYTES
+
+        if db is None:
+            from ...core.database import get_database
+            db = get_database()
+        if index is None:
+            from .index import get_library_index
+            index = get_library_index()
+
+        min_size = get_config('files.dedup.min_size', 1024 * 1024)
+        settle = get_config('files.dedup.settle_seconds', 60)
+        result = {'hashed': 0, 'full_hashed': 0, 'linked': 0, 'reclaimed_bytes': 0, 'interrupted': False}
+
+        entries = [entry for entry in index.list_files()
+                   if entry['size'] >= min_size and not entry['name'].endswith(TEMP_SUFFIXES)]
+        rows = db.get_file_hashes()
+        names = {entry['name'] for entry in entries}
+        db.delete_file_hashes([name for name in rows if name not in names])
+        rows = {name: row for name, row in rows.items() if name in names}
+
+        try:
+            # 部分哈希：只处理新增或变化过的文件
+            now = time.time()
+            for entry in entries:
+                if self.stop_event.is_set():
+                    raise InterruptedError()
+                path = index.root / entry['name']
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                if now - stat.st_mtime < settle:
+                    continue  # 可能仍在写入
+                row = rows.get(entry['name'])
+                if row and self._unchanged(row, stat):
+                    continue
+                self._wait_for_downloads()
+                started = time.monotonic()
+                partial_hash = content_key(path, stat)
+                self._throttle(min(stat.st_size, SAMPLE_BYTES * 2), started)
+                row = {'name': entry['name'], 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                       'inode': stat.st_ino, 'partial_hash': partial_hash,
+                       'full_hash': None, 'linked_to': None}
+                self._save(db, row)
+                rows[entry['name']] = row
+                result['hashed'] += 1
+
+            # 完整哈希：只针对部分哈希相同的候选组
+            groups: Dict[tuple, List[Dict[str, Any]]] = {}
+            for row in rows.values():
+                groups.setdefault((row['size'], row['partial_hash']), []).append(row)
+
+            for members in groups.values():
+                if len({row['inode'] for row in members}) < 2:
+                    continue
+                for row in members:
+                    if row['full_hash'] is None:
+                        row['full_hash'] = self._full_hash(index.root / row['name'])
+                        self._save(db, row)
+                        result['full_hashed'] += 1
+
+                by_hash: Dict[str, List[Dict[str, Any]]] = {}
+                for row in members:
+                    by_hash.setdefault(row['full_hash'], []).append(row)
+                for same in by_hash.values():
+                    if len(same) > 1:
+                        self._merge(index, db, same, result)
+
+        except InterruptedError:
+            result['interrupted'] = True
+
+        if result['linked']:
+            stats = db.state_get('file_dedup', 'stats') or {}
+            db.state_set('file_dedup', 'stats', {
+                'linked_files': stats.get('linked_files', 0) + result['linked'],
+                'reclaimed_bytes': stats.get('reclaimed_bytes', 0) + result['reclaimed_bytes'],
+            })
+            logger.info(f"🧹 文件去重: 合并 {result['linked']} 个重复文件，"
+                        f"释放 {result['reclaimed_bytes'] / (1024 * 1024):.1f} MB")
+
+        self.last_result = {**result, 'finished_at': time.time()}
+        return result
+
+    @staticmethod
+    def _save(db, row: Dict[str, Any]):
+        db.save_file_hash(row['name'], row['size'], row['mtime_ns'], row['inode'],
+                          row['partial_hash'], row['full_hash'], row.get('linked_to'))
+
+    @staticmethod
+    def _unchanged(row: Dict[str, Any], stat: os.stat_result) -> bool:
+        return (row['size'] == stat.st_size and row['mtime_ns'] == stat.st_mtime_ns
+                and row['inode'] == stat.st_ino)
+
+    def _wait_for_downloads(self):
+        """有下载进行时暂停，停止时中断"""
+        while self._downloads_active():
+            if self.stop_event.wait(5):
+                raise InterruptedError()
+
+    def _throttle(self, nbytes: int, started: float):
+        """按读取字节数限速，停止时中断"""
+        from ...core.config import get_config
+
+        rate = get_config('files.dedup.max_bytes_per_sec', 20 * 1024 * 1024)
+        if rate and rate > 0:
+            delay = nbytes / rate - (time.monotonic() - started)
+            if delay > 0 and self.stop_event.wait(delay):
+                raise InterruptedError()
+        elif self.stop_event.is_set():
+            raise InterruptedError()
+
+    def _full_hash(self, path: Path) -> str:
+        """限速计算完整哈希，有下载进行时暂停"""
+        chunk_size = 1024 * 1024
+        digest = hashlib.blake2b(digest_size=32)
+        with open(path, 'rb') as f:
+            while True:
+                self._wait_for_downloads()
+                started = time.monotonic()
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                self._throttle(len(chunk), started)
+        return digest.hexdigest()
+
+    @staticmethod
+    def _downloads_active() -> bool:
+        from ...core.config import get_config
+        if not get_config('files.dedup.pause_during_downloads', True):
+            return False
+        from ...modules.downloader.manager import get_download_manager
+        return get_download_manager().get_status_counts().get('downloading', 0) > 0
+
+    def _merge(self, index, db, same: List[Dict[str, Any]], result: Dict[str, Any]):
+        """以最新的文件为数据源，其余改为共享其数据
+
+        硬链接共用一个 inode，修改时间取数据源的；以最新的文件为源，合并后不会有
+        文件的修改时间变早（否则刚下载的文件会被自动清理优先删除、在列表中排到后面）。
+        """
+        from ...core.config import get_config
+
+        mode = get_config('files.dedup.mode', 'auto')
+        same = sorted(same, key=lambda row: (-row['mtime_ns'], row['name']))
+        keep = same[0]
+        source = index.root / keep['name']
+        try:
+            source_stat = source.stat()
+        except FileNotFoundError:
+            return
+        if not self._unchanged(keep, source_stat):
+            return
+
+        for row in same[1:]:
+            if row['inode'] == keep['inode'] or row.get('linked_to') == keep['name']:
+                continue
+            target = index.root / row['name']
+            try:
+                stat = target.stat()
+                if not self._unchanged(row, stat) or stat.st_dev != source_stat.st_dev:
+                    continue
+                linked = self._replace(source, target, stat, mode)
+            except OSError as e:
+                logger.warning(f"⚠️ 合并重复文件失败 {row['name']}: {e}")
+                continue
+
+            new_stat = target.stat()
+            row.update(mtime_ns=new_stat.st_mtime_ns, inode=new_stat.st_ino, linked_to=keep['name'])
+            self._save(db, row)
+            index.refresh(target)
+            result['linked'] += 1
+            # 硬链接：原 inode 没有其他链接时空间才真正释放；reflink 的数据块总是共享
+            if linked == 'reflink' or stat.st_nlink == 1:
+                result['reclaimed_bytes'] += stat.st_size
+            logger.debug(f"🧹 {row['name']} 与 {keep['name']} 内容相同，已改为{linked}")
+
+    @staticmethod
+    def _replace(source: Path, target: Path, stat: os.stat_result, mode: str) -> str:
+        """用共享 source 数据的新文件原子替换 target，返回使用的方式"""
+        tmp = target.with_name(f'.{target.name}.dedup')
+        tmp.unlink(missing_ok=True)
+
+        if mode in ('auto', 'reflink'):
+            try:
+                import fcntl
+                with open(source, 'rb') as src, open(tmp, 'wb') as dst:
+                    fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                # reflink 是独立文件，保留原文件的权限与修改时间
+                os.chmod(tmp, stat.st_mode & 0o7777)
+                os.utime(tmp, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+                os.replace(tmp, target)
+                return 'reflink'
+            except (OSError, ImportError):
+                tmp.unlink(missing_ok=True)
+                if mode == 'reflink':
+                    raise
+
+        os.link(source, tmp)
+        os.replace(tmp, target)
+        return 'hardlink'
+
+    def get_stats(self) -> Dict[str, Any]:
+        """累计去重统计与最近一次结果"""
+        from ...core.database import get_database
+        stats = get_database().state_get('file_dedup', 'stats') or {}
+        return {
+            'running': self.running,
+            'linked_files': stats.get('linked_files', 0),
+            'reclaimed_bytes': stats.get('reclaimed_bytes', 0),
+            'last_run': self.last_result,
+        }
+
+
+# 全局去重服务实例
+_dedup_service = None
+
+def get_dedup_service() -> DedupService:
+    """获取文件去重服务实例"""
+    global _dedup_service
+    if _dedup_service is None:
+        _dedup_service = DedupService()
+    return _dedup_service
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+批量导出 - 多个文件边读边打包为 ZIP64（仅存储）或 TAR 流
+
+归档布局在发送前由文件名与大小完全确定：每个条目的头部、数据与尾部的偏移量
+都可以预先计算，所以响应能给出 Content-Length，并按 Range 从任意偏移续传；
+不写临时文件，内存占用与文件大小无关。
+
+ZIP 条目使用数据描述符记录 CRC32：完整发送时边读边计算；续传跳过了某个文件
+的开头时，再单独读取该文件计算（结果按 文件名+大小+修改时间 缓存）。
+"""
+
+import time
+import zlib
+import struct
+import hashlib
+import tarfile
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, List, Iterator
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    'zip': 'application/zip',
+    'tar': 'application/x-tar',
+}
+
+# ZIP 记录签名
+LOCAL_HEADER = 0x04034b50
+DATA_DESCRIPTOR = 0x08074b50
+CENTRAL_HEADER = 0x02014b50
+ZIP64_END = 0x06064b50
+ZIP64_LOCATOR = 0x07064b50
+END_OF_CENTRAL = 0x06054b50
+
+ZIP_VERSION = 45            # ZIP64
+ZIP_FLAGS = 0x0808          # 数据描述符 + UTF-8 文件名
+DESCRIPTOR_SIZE = 24
+ZIP64_END_SIZE = 56 + 20 + 22
+TAR_BLOCK = 512
+
+# 续传时补算的 CRC32：(路径, 大小, 修改时间) -> crc
+_crc_cache: OrderedDict = OrderedDict()
+_crc_lock = threading.Lock()
+CRC_CACHE_SIZE = 4096
+
+
+def _dos_datetime(timestamp: float) -> tuple:
+    """ZIP 使用的 DOS 日期时间（早于1980年的按1980年记录）"""
+    t = time.localtime(max(timestamp, 315532800))
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+
+def file_crc32(entry: Dict[str, Any], chunk_size: int = 1024 * 1024) -> int:
+    """计算（或从缓存读取）文件的 CRC32"""
+    memo_key = (str(entry['path']), entry['size'], entry['mtime_ns'])
+    with _crc_lock:
+        if memo_key in _crc_cache:
+            _crc_cache.move_to_end(memo_key)
+            return _crc_cache[memo_key]
+
+    crc = 0
+    with open(entry['path'], 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+    _remember_crc(entry, crc)
+    return crc
+
+
+def _remember_crc(entry: Dict[str, Any], crc: int):
+    with _crc_lock:
+        _crc_cache[(str(entry['path']), entry['size'], entry['mtime_ns'])] = crc
+        while len(_crc_cache) > CRC_CACHE_SIZE:
+            _crc_cache.popitem(last=False)
+
+
+class ArchiveStream:
+    """确定布局的归档流
+
+    布局是 (偏移, 长度, 类型, 内容) 的有序列表：
+    - bytes: 预先生成的头部、填充或结束记录
+    - file: 文件数据（内容为条目序号）
+    - descriptor: ZIP 数据描述符（依赖 CRC，发送时生成）
+    - central: ZIP 中央目录与结束记录（依赖所有 CRC，发送时生成）
+    """
+
+    def __init__(self, files: List[Path], fmt: str = 'zip'):
+        if fmt not in FORMATS:
+            raise ValueError(f'不支持的归档格式: {fmt}')
+        self.format = fmt
+        self.mimetype = FORMATS[fmt]
+        self.entries = []
+        for path in files:
+            stat = path.stat()
+            self.entries.append({
+                'path': path,
+                'name': path.name,
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'mtime_ns': stat.st_mtime_ns,
+            })
+
+        self.parts = []
+        self.size = 0
+        if fmt == 'zip':
+            self._layout_zip()
+        else:
+            self._layout_tar()
+
+        digest = hashlib.sha1(fmt.encode('ascii'))
+        for entry in self.entries:
+            digest.update(f"{entry['name']}\0{entry['size']}\0{entry['mtime_ns']}\0".encode('utf-8'))
+        self.etag = digest.hexdigest()[:32]
+        self.last_modified = int(max((entry['mtime'] for entry in self.entries), default=0))
+
+    def _add(self, kind: str, length: int, payload=None):
+        self.parts.append((self.size, length, kind, payload))
+        self.size += length
+
+    def _layout_zip(self):
+        self._offsets = []
+        for number, entry in enumerate(self.entries):
+            name = entry['name'].encode('utf-8')
+            mod_time, mod_date = _dos_datetime(entry['mtime'])
+            entry['dos'] = (mod_time, mod_date)
+            # 本地头：大小写在 ZIP64 扩展字段中，CRC 由随后的数据描述符给出
+            header = struct.pack('<IHHHHHIIIHH', LOCAL_HEADER, ZIP_VERSION, ZIP_FLAGS, 0,
+                                 mod_time, mod_date, 0, 0xFFFFFFFF, 0xFFFFFFFF, len(name), 20)
+            header += name + struct.pack('<HHQQ', 1, 16, entry['size'], entry['size'])
+            self._offsets.append(self.size)
+            self._add('bytes', len(header), header)
+            self._add('file', entry['size'], number)
+            self._add('descriptor', DESCRIPTOR_SIZE, number)
+
+        self._central_offset = self.size
+        central_size = sum(46 + len(entry['name'].encode('utf-8')) + 28 for entry in self.entries)
+        self._central_size = central_size
+        self._add('central', central_size + ZIP64_END_SIZE)
+
+    def _layout_tar(self):
+        for number, entry in enumerate(self.entries):
+            info = tarfile.TarInfo(entry['name'])
+            info.size = entry['size']
+            info.mtime = int(entry['mtime'])
+            info.mode = 0o644
+            header = info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+            self._add('bytes', len(header), header)
+            self._add('file', entry['size'], number)
+            padding = -entry['size'] % TAR_BLOCK
+            if padding:
+                self._add('bytes', padding, b'\0' * padding)
+        self._add('bytes', TAR_BLOCK * 2, b'\0' * (TAR_BLOCK * 2))
+
+    def _descriptor(self, number: int, crcs: Dict[int, int]) -> bytes:
+        entry = self.entries[number]
+        crc = crcs[number] if number in crcs else file_crc32(entry)
+        return struct.pack('<IIQQ', DATA_DESCRIPTOR, crc, entry['size'], entry['size'])
+
+    def _central(self, crcs: Dict[int, int]) -> bytes:
+        records = []
+        for number, entry in enumerate(self.entries):
+            name = entry['name'].encode('utf-8')
+            crc = crcs[number] if number in crcs else file_crc32(entry)
+            records.append(struct.pack('<IHHHHHHIIIHHHHHII', CENTRAL_HEADER, (3 << 8) | ZIP_VERSION,
+                                       ZIP_VERSION, ZIP_FLAGS, 0, *entry['dos'], crc,
+                                       0xFFFFFFFF, 0xFFFFFFFF, len(name), 28, 0, 0, 0,
+                                       0o100644 << 16, 0xFFFFFFFF))
+            records.append(name + struct.pack('<HHQQQ', 1, 24, entry['size'], entry['size'],
+                                              self._offsets[number]))
+        count = len(self.entries)
+        zip64_end_offset = self._central_offset + self._central_size
+        records.append(struct.pack('<IQHHIIQQQQ', ZIP64_END, 44, ZIP_VERSION, ZIP_VERSION, 0, 0,
+                                   count, count, self._central_size, self._central_offset))
+        records.append(struct.pack('<IIQI', ZIP64_LOCATOR, 0, zip64_end_offset, 1))
+        records.append(struct.pack('<IHHHHIIH', END_OF_CENTRAL, 0, 0, 0xFFFF, 0xFFFF,
+                                   0xFFFFFFFF, 0xFFFFFFFF, 0))
+        return b''.join(records)
+
+    def _read_file(self, number: int, offset: int, length: int, crcs: Dict[int, int],
+                   chunk_size: int) -> Iterator[bytes]:
+        """读取文件的一段；从头读到尾时顺便计算 CRC"""
+        entry = self.entries[number]
+        stat = entry['path'].stat()
+        if stat.st_size != entry['size'] or stat.st_mtime_ns != entry['mtime_ns']:
+            raise RuntimeError(f"打包期间文件已变化: {entry['name']}")
+
+        whole = offset == 0 and length == entry['size']
+        crc = 0
+        with open(entry['path'], 'rb') as f:
+            f.seek(offset)
+            remaining = length
+            while remaining:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    raise RuntimeError(f"打包期间文件被截断: {entry['name']}")
+                remaining -= len(chunk)
+                if whole:
+                    crc = zlib.crc32(chunk, crc)
+                yield chunk
+
+        if whole and self.format == 'zip':
+            crcs[number] = crc
+            _remember_crc(entry, crc)
+
+    def iter_range(self, start: int = 0, end: int = None, chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+        """生成 [start, end] 区间的归档字节"""
+        end = self.size - 1 if end is None else end
+        crcs: Dict[int, int] = {}
+        for offset, length, kind, payload in self.parts:
+            if offset + length <= start:
+                continue
+            if offset > end:
+                break
+            lo = max(start, offset) - offset
+            hi = min(end, offset + length - 1) - offset + 1
+
+            if kind == 'file':
+                yield from self._read_file(payload, lo, hi - lo, crcs, chunk_size)
+                continue
+            if kind == 'bytes':
+                data = payload
+            elif kind == 'descriptor':
+                data = self._descriptor(payload, crcs)
+            else:
+                data = self._central(crcs)
+            yield data[lo:hi]
+
+
+def send_archive(stream: ArchiveStream, download_name: str):
+    """发送归档（支持 HEAD、单区间 Range 与 If-Range 续传）"""
+    from flask import Response, request
+    from werkzeug.exceptions import RequestedRangeNotSatisfiable
+    from werkzeug.http import http_date
+    from ...core.config import get_config
+    from .streaming import STREAM_HEADERS, parse_ranges, _content_disposition, _range_applies
+
+    headers = dict(STREAM_HEADERS)
+    headers['Content-Disposition'] = _content_disposition(download_name)
+    headers['ETag'] = f'"{stream.etag}"'
+    headers['Last-Modified'] = http_date(stream.last_modified)
+    headers['Cache-Control'] = 'private, no-cache'
+
+    status = 200
+    start, end = 0, stream.size - 1
+    range_header = request.headers.get('Range')
+    if range_header and _range_applies(request, stream.etag, stream.last_modified):
+        try:
+            ranges = parse_ranges(range_header, stream.size)
+        except ValueError:
+            raise RequestedRangeNotSatisfiable(length=stream.size)
+        # 归档只按单区间续传，多区间时发送完整归档
+        if ranges and len(ranges) == 1:
+            start, end = ranges[0]
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{end}/{stream.size}'
+
+    headers['Content-Length'] = str(end - start + 1)
+    if request.method == 'HEAD':
+        return Response(status=status, mimetype=stream.mimetype, headers=headers)
+
+    window = get_config('files.streaming.window', 1024 * 1024)
+    return Response(stream.iter_range(start, end, window), status=status,
+                    mimetype=stream.mimetype, headers=headers)
@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+"""
+HLS 按需封装 - 浏览器无法直接播放的容器（MKV 等）转封装为 fMP4 分片
+
+播放列表按视频关键帧位置切分（首个分片较短以便快速起播），只在请求某个分片时
+用 ffmpeg 流复制（不重新编码视频）截取该区间，输出的分片 MP4 拆成公共初始化段
+（ftyp+moov）与 moof/mdat 片段写入缓存；缓存按内容键分目录，总大小超过上限时
+淘汰最久未访问的分片（所有进程共用同一上限）。
+
+多个进程可能同时生成同一分片：临时文件名带进程号与随机后缀，完成后原子
+替换到最终路径，后完成的一方覆盖内容相同的文件，不会互相写坏。
+"""
+
+import os
+import json
+import math
+import shutil
+import struct
+import logging
+import subprocess
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Any, List
+
+logger = logging.getLogger(__name__)
+
+# fMP4 可以直接承载的编码；视频不在列表中时无法免转码播放，音频不在列表中时只转码音频
+VIDEO_CODECS = {'h264', 'hevc', 'vp9', 'av1'}
+AUDIO_CODECS = {'aac', 'mp3', 'opus', 'flac', 'ac3', 'eac3', 'alac'}
+
+# 进程内缓存的索引与内容键条数上限
+MAX_MEMO_ENTRIES = 256
+
+
+class UnsupportedMediaError(Exception):
+    """媒体编码无法免转码封装为 fMP4"""
+
+
+def _temp_path(path: Path) -> Path:
+    """同目录下唯一的临时文件名（其他进程生成同一文件时不会冲突）"""
+    return path.with_name(f'.{path.name}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp')
+
+
+def split_fragmented_mp4(source: Path, init_path: Path, segment_path: Path):
+    """把分片 MP4 拆成初始化段（第一个 moof 之前的 box）与片段（其余部分）"""
+    with open(source, 'rb') as f:
+        header = b''
+        while True:
+            box = f.read(8)
+            if len(box) < 8:
+                raise ValueError('输出中没有找到moof')
+            size, box_type = struct.unpack('>I4s', box)
+            extra = b''
+            if size == 1:
+                extra = f.read(8)
+                size = struct.unpack('>Q', extra)[0]
+            if box_type == b'moof':
+                f.seek(-(8 + len(extra)), os.SEEK_CUR)
+                break
+            if size == 0:
+                raise ValueError('输出中没有找到moof')
+            header += box + extra + f.read(size - 8 - len(extra))
+
+        if not init_path.exists():
+            tmp = _temp_path(init_path)
+            tmp.write_bytes(header)
+            os.replace(tmp, init_path)
+
+        tmp = _temp_path(segment_path)
+        try:
+            with open(tmp, 'wb') as out:
+                shutil.copyfileobj(f, out, 1024 * 1024)
+            os.replace(tmp, segment_path)
+        finally:
+            tmp.unlink(missing_ok=True)
+
+
+def plan_segments(keyframes: List[float], duration: float, target: float, first_target: float) -> List[List[float]]:
+    """按关键帧切分分片，返回 [[起点, 时长], ...]"""
+    keyframes = sorted(k for k in keyframes if k < duration)
+    if not keyframes:
+        return [[0.0, duration]] if duration > 0 else []
+
+    starts = [keyframes[0]]
+    for keyframe in keyframes[1:]:
+        limit = first_target if len(starts) == 1 else target
+        if keyframe - starts[-1] >= limit:
+            starts.append(keyframe)
+
+    ends = starts[1:] + [duration]
+    return [[round(start, 6), round(end - start, 6)] for start, end in zip(starts, ends) if end > start]
+
+
+class SegmentCache:
+    """分片缓存的 LRU 淘汰
+
+    多个进程共用同一缓存目录：命中时更新分片的修改时间作为最近访问时间，
+    淘汰前重新扫描磁盘统计实际占用，按修改时间从旧到新删除，上限对所有进程
+    合计生效。某个内容键的分片全部淘汰后，初始化段与索引随目录一起删除。
+    """
+
+    # 本进程估算的占用未超限时，最长间隔多久重新扫描一次（计入其他进程写入的分片）
+    RESCAN_INTERVAL = 30
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._total = None   # 最近一次扫描的占用，加上之后本进程新增的分片
+        self._segments = 0
+        self._scanned_at = 0.0
+        self._lock = threading.Lock()
+
+    def _scan(self) -> List[tuple]:
+        """扫描磁盘上的分片，返回按修改时间从旧到新排列的 (mtime, 路径, 大小)"""
+        entries = []
+        for path in self.root.glob('*/*.m4s'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, str(path), stat.st_size))
+        entries.sort()
+        self._total = sum(size for _, _, size in entries)
+        self._segments = len(entries)
+        self._scanned_at = time.monotonic()
+        return entries
+
+    @staticmethod
+    def touch(path: Path) -> bool:
+        """记录一次访问；分片已被淘汰（包括其他进程淘汰）时返回False"""
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def add(self, path: Path):
+        """登记新生成的分片，超过上限时淘汰最久未访问的分片"""
+        size = path.stat().st_size
+        with self._lock:
+            entries = None
+            if self._total is None or time.monotonic() - self._scanned_at > self.RESCAN_INTERVAL:
+                entries = self._scan()
+            else:
+                self._total += size
+                self._segments += 1
+            if self._total <= self.max_bytes:
+                return
+            self._evict(self._scan() if entries is None else entries, keep=str(path))
+
+    def _evict(self, entries: List[tuple], keep: str):
+        for _, evicted, size in entries:
+            if self._total <= self.max_bytes:
+                break
+            if evicted == keep:
+                continue
+            try:
+                os.unlink(evicted)
+            except FileNotFoundError:
+                pass
+            self._total -= size
+            self._segments -= 1
+            directory = Path(evicted).parent
+            if not any(directory.glob('*.m4s')):
+                self._remove_directory(directory)
+
+    @staticmethod
+    def _remove_directory(directory: Path):
+        """删除已没有分片的内容目录（正在生成分片的目录中有临时文件，保留）"""
+        for name in ('init.mp4', 'index.json'):
+            (directory / name).unlink(missing_ok=True)
+        try:
+            directory.rmdir()
+        except OSError:
+            pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            if self._total is None:
+                self._scan()
+            return {'segments': self._segments, 'bytes': self._total, 'max_bytes': self.max_bytes}
+
+
+class HlsPackager:
+    """HLS 按需封装"""
+
+    def __init__(self, cache_dir: Path, max_bytes: int):
+        self.cache_dir = Path(cache_dir)
+        self.cache = SegmentCache(self.cache_dir, max_bytes)
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, list] = {}   # 名称 -> [锁, 等待/持有数]，无人使用时删除
+        self._keys: OrderedDict = OrderedDict()      # (文件名, 大小, mtime) -> 内容键
+        self._indexes: OrderedDict = OrderedDict()   # 内容键 -> 分片索引
+
+    @contextmanager
+    def _key_lock(self, name: str):
+        """进程内按名称加锁（同一分片只生成一次），释放后不再使用的锁随即删除"""
+        with self._lock:
+            entry = self._key_locks.setdefault(name, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._key_locks[name]
+
+    def _remember(self, memo: OrderedDict, key, value):
+        """写入进程内缓存，超过条数上限时丢弃最久未使用的条目（调用方需持有 self._lock）"""
+        memo[key] = value
+        memo.move_to_end(key)
+        while len(memo) > MAX_MEMO_ENTRIES:
+            memo.popitem(last=False)
+
+    def get_key(self, path: Path) -> str:
+        """文件内容键（与缩略图缓存相同）"""
+        from .thumbnails import content_key
+
+        stat = path.stat()
+        memo_key = (path.name, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            key = self._keys.get(memo_key)
+            if key is not None:
+                self._keys.move_to_end(memo_key)
+        if key is None:
+            key = content_key(path, stat)
+            with self._lock:
+                self._remember(self._keys, memo_key, key)
+        return key
+
+    def get_index(self, path: Path) -> Dict[str, Any]:
+        """关键帧分片索引（首次访问时探测，按内容键缓存到磁盘）"""
+        from ...core.config import get_config
+
+        key = self.get_key(path)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index:
+                self._indexes.move_to_end(key)
+        if index:
+            return index
+
+        with self._key_lock(f'{key}/index'):
+            directory = self.cache_dir / key
+            index_path = directory / 'index.json'
+            if index_path.exists():
+                index = json.loads(index_path.read_text(encoding='utf-8'))
+            else:
+                index = self._probe(path)
+                index['key'] = key
+                index['segments'] = plan_segments(
+                    index.pop('keyframes'), index['duration'],
+                    get_config('files.hls.segment_duration', 6),
+                    get_config('files.hls.first_segment_duration', 2))
+                directory.mkdir(parents=True, exist_ok=True)
+                tmp = _temp_path(index_path)
+                tmp.write_text(json.dumps(index), encoding='utf-8')
+                os.replace(tmp, index_path)
+
+        with self._lock:
+            self._remember(self._indexes, key, index)
+        return index
+
+    @staticmethod
+    def _probe(path: Path) -> Dict[str, Any]:
+        """探测编码与视频关键帧位置（只解封装，不解码）"""
+        if not shutil.which('ffprobe') or not shutil.which('ffmpeg'):
+            raise UnsupportedMediaError('未找到ffmpeg，无法在线封装')
+        from .catalog import get_media_catalog
+        try:
+            media = get_media_catalog().get(path) or {}
+        except Exception as e:
+            raise UnsupportedMediaError(f'无法读取媒体信息: {e}')
+        video, audio = media.get('video_codec'), media.get('audio_codec')
+        if video not in VIDEO_CODECS:
+            raise UnsupportedMediaError(f'视频编码 {video} 需要转码，无法直接封装')
+
+        result = subprocess.run(
+            ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+             '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', str(path)],
+            capture_output=True, text=True, timeout=300
+        )
+        keyframes = []
+        for line in result.stdout.splitlines():
+            pts, _, flags = line.partition(',')
+            if 'K' in flags and pts not in ('', 'N/A'):
+                keyframes.append(float(pts))
+
+        return {
+            'duration': float(media.get('duration') or 0),
+            'video_codec': video,
+            'audio_codec': audio,
+            'keyframes': keyframes,
+        }
+
+    def playlist(self, path: Path, segment_url: str, init_url: str) -> str:
+        """生成 VOD 媒体播放列表"""
+        index = self.get_index(path)
+        segments = index['segments']
+        target = max((math.ceil(duration) for _, duration in segments), default=1)
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:7',
+            f'#EXT-X-TARGETDURATION:{target}',
+            '#EXT-X-MEDIA-SEQUENCE:0',
+            '#EXT-X-PLAYLIST-TYPE:VOD',
+            '#EXT-X-INDEPENDENT-SEGMENTS',
+            f'#EXT-X-MAP:URI="{init_url}"',
+        ]
+        for number, (_, duration) in enumerate(segments):
+            lines.append(f'#EXTINF:{duration:.6f},')
+            lines.append(segment_url.format(number=number))
+        lines.append('#EXT-X-ENDLIST')
+        return '\n'.join(lines) + '\n'
+
+    def init_segment(self, path: Path) -> Path:
+        """初始化段（随第一个生成的分片产生）"""
+        index = self.get_index(path)
+        init_path = self.cache_dir / index['key'] / 'init.mp4'
+        if not init_path.exists():
+            self.segment(path, 0)
+            if not init_path.exists():
+                # 淘汰目录与读取分片并发：分片还在而初始化段已删除，重新生成首个分片
+                (init_path.parent / '0.m4s').unlink(missing_ok=True)
+                self.segment(path, 0)
+        return init_path
+
+    def segment(self, path: Path, number: int) -> Path:
+        """获取分片（缓存未命中或已被淘汰时流复制截取）"""
+        index = self.get_index(path)
+        if not 0 <= number < len(index['segments']):
+            raise IndexError(number)
+
+        directory = self.cache_dir / index['key']
+        segment_path = directory / f'{number}.m4s'
+        if self.cache.touch(segment_path):
+            return segment_path
+
+        with self._key_lock(f"{index['key']}/{number}"):
+            if not self.cache.touch(segment_path):
+                # 目录可能已随全部分片一起被淘汰
+                directory.mkdir(parents=True, exist_ok=True)
+                self._remux(path, index, number, directory, segment_path)
+                self.cache.add(segment_path)
+        return segment_path
+
+    def _remux(self, path: Path, index: Dict[str, Any], number: int, directory: Path, segment_path: Path):
+        from ...core.config import get_config
+
+        start, duration = index['segments'][number]
+        audio = ['-c:a', 'copy'] if index.get('audio_codec') in AUDIO_CODECS else ['-c:a', 'aac', '-b:a', '192k']
+        output = _temp_path(directory / f'{number}.mp4')
+        # -copyts + frag_discont：分片内保留源时间戳，各分片共用同一初始化段即可连续播放
+        cmd = [
+            'ffmpeg', '-v', 'error', '-y',
+            '-ss', f'{start:.6f}', '-i', str(path), '-t', f'{duration:.6f}',
+            '-map', '0:v:0', '-map', '0:a:0?', '-c:v', 'copy', *audio, '-sn', '-dn',
+            '-copyts', '-f', 'mp4',
+            '-movflags', 'frag_keyframe+empty_moov+default_base_moof+frag_discont',
+            str(output),
+        ]
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True,
+                                    timeout=get_config('files.hls.timeout', 120))
+            if result.returncode != 0:
+                raise RuntimeError(result.stderr.strip()[-200:] or 'ffmpeg失败')
+            split_fragmented_mp4(output, directory / 'init.mp4', segment_path)
+        finally:
+            output.unlink(missing_ok=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'indexes': len(self._indexes), **self.cache.get_stats()}
+
+
+# 全局封装器实例
+_hls_packager = None
+
+def get_hls_packager() -> HlsPackager:
+    """获取 HLS 封装器实例"""
+    global _hls_packager
+    if _hls_packager is None:
+        from ...core.config import get_config
+        cache_dir = get_config('files.hls.cache_dir')
+        if not cache_dir:
+            from ...core.database import get_database
+            cache_dir = get_database().db_path.parent / 'hls'
+        _hls_packager = HlsPackager(cache_dir, get_config('files.hls.cache_max_mb', 2048) * 1024 * 1024)
+    return _hls_packager
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""
+下载目录索引 - 文件列表、路径信息、自动清理与下载管理器共用的内存文件表
+
+索引首次使用时扫描一次下载目录，之后：
+- 每次读取前检查目录自身的 mtime，目录项有增删（新建、删除、重命名）时
+  只列出文件名并对新增文件执行 stat，已知文件沿用缓存的大小与修改时间；
+- 下载完成、文件删除时由调用方直接更新对应条目；
+- 后台定期完整核对一次，修正原地修改过的文件大小与修改时间。
+"""
+
+import os
+import json
+import time
+import base64
+import bisect
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 目录 mtime 与扫描时间相差不足该秒数时，无法排除扫描期间目录又被修改（mtime 精度），下次读取重新列出
+RACY_SECONDS = 2
+
+KIND_EXTENSIONS = {
+    'video': {'.mp4', '.mkv', '.webm', '.avi', '.mov', '.flv', '.m4v', '.wmv', '.3gp', '.ogv', '.ts', '.m2ts'},
+    'audio': {'.mp3', '.m4a', '.wav', '.aac', '.ogg', '.flac', '.opus'},
+    'subtitle': {'.vtt', '.srt', '.ass', '.ssa', '.sub', '.sbv', '.ttml'},
+}
+
+SORT_KEYS = ('modified', 'size', 'name')
+
+
+def get_file_kind(name: str) -> str:
+    """按扩展名判断文件类型：video / audio / subtitle / other"""
+    ext = os.path.splitext(name)[1].lower()
+    for kind, extensions in KIND_EXTENSIONS.items():
+        if ext in extensions:
+            return kind
+    return 'other'
+
+
+class LibraryIndex:
+    """下载目录索引"""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.RLock()
+        self._dir_mtime_ns = None
+        self._scanned_at = 0.0
+        self._last_reconcile = None
+        self._stats = {'rescans': 0, 'reconciles': 0, 'stats': 0}
+        self._version = 0  # 条目变化时递增，排序视图与汇总按版本缓存
+        self._views: Dict[str, tuple] = {}
+        self._summary = None
+        self.reconcile_thread = None
+        self.stop_event = threading.Event()
+        self.running = False
+
+    def start(self):
+        """启动定期完整核对，并在下载完成时更新条目"""
+        if self.running:
+            return
+
+        try:
+            from ...core.config import get_config
+            from ...core.events import event_bus, Events
+
+            self.running = True
+            self.stop_event.clear()
+
+            event_bus.add_listener(Events.DOWNLOAD_COMPLETED, self._on_download_completed, group='files')
+
+            interval = get_config('files.index.reconcile_interval', 300)
+            if interval and interval > 0:
+                self.reconcile_thread = threading.Thread(
+                    target=self._reconcile_loop,
+                    args=(interval,),
+                    daemon=True,
+                    name="LibraryIndex"
+                )
+                self.reconcile_thread.start()
+
+            logger.info("✅ 下载目录索引已启动")
+
+        except Exception as e:
+            logger.error(f"❌ 启动下载目录索引失败: {e}")
+
+    def stop(self):
+        """停止定期核对"""
+        if not self.running:
+            return
+
+        self.running = False
+        self.stop_event.set()
+
+        try:
+            from ...core.events import event_bus, Events
+            event_bus.remove_listener(Events.DOWNLOAD_COMPLETED, self._on_download_completed)
+        except Exception as e:
+            logger.warning(f"⚠️ 移除下载目录索引监听器失败: {e}")
+
+        if self.reconcile_thread and self.reconcile_thread.is_alive():
+            self.reconcile_thread.join(timeout=5)
+
+    def _reconcile_loop(self, interval: float):
+        while not self.stop_event.wait(interval):
+            try:
+                self.reconcile()
+            except Exception as e:
+                logger.error(f"❌ 下载目录核对失败: {e}")
+
+    def _on_download_completed(self, data: Dict[str, Any]):
+        file_path = (data or {}).get('file_path')
+        if file_path:
+            self.refresh(file_path)
+
+    def _sync(self):
+        """目录项有变化时增量重新列出（只对新增文件 stat）"""
+        try:
+            dir_stat = os.stat(self.root)
+        except FileNotFoundError:
+            with self._lock:
+                if self._entries:
+                    self._entries = {}
+                    self._version += 1
+                self._dir_mtime_ns = None
+            return
+
+        with self._lock:
+            if (dir_stat.st_mtime_ns == self._dir_mtime_ns
+                    and self._scanned_at - dir_stat.st_mtime > RACY_SECONDS):
+                return
+            self._scan(full=False)
+
+    def _scan(self, full: bool):
+        """扫描下载目录；full=False 时复用已知文件的缓存属性"""
+        with self._lock:
+            scanned_at = time.time()
+            dir_mtime_ns = os.stat(self.root).st_mtime_ns
+            entries = {}
+            stats = 0
+            with os.scandir(self.root) as it:
+                for entry in it:
+                    try:
+                        if not entry.is_file():
+                            continue
+                        known = None if full else self._entries.get(entry.name)
+                        if known is None:
+                            stat = entry.stat()
+                            stats += 1
+                            known = self._make_entry(entry.name, stat)
+                        entries[entry.name] = known
+                    except FileNotFoundError:
+                        continue
+
+            if entries != self._entries:
+                self._entries = entries
+                self._version += 1
+            self._dir_mtime_ns = dir_mtime_ns
+            self._scanned_at = scanned_at
+            self._stats['rescans'] += 1
+            self._stats['stats'] += stats
+
+    @staticmethod
+    def _make_entry(name: str, stat: os.stat_result) -> Dict[str, Any]:
+        return {
+            'name': name,
+            'size': stat.st_size,
+            'modified': stat.st_mtime,
+            'kind': get_file_kind(name),
+        }
+
+    def reconcile(self):
+        """完整核对：重新 stat 所有文件"""
+        if not self.root.exists():
+            return
+        self._scan(full=True)
+        with self._lock:
+            self._stats['reconciles'] += 1
+            self._last_reconcile = time.time()
+
+    def refresh(self, path):
+        """更新单个文件的条目（文件不存在时移除）"""
+        path = Path(path)
+        if path.parent.resolve() != self.root.resolve():
+            return
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            self.discard(path.name)
+            return
+
+        with self._lock:
+            if path.is_file():
+                self._entries[path.name] = self._make_entry(path.name, stat)
+                self._version += 1
+            self._stats['stats'] += 1
+
+    def discard(self, name: str):
+        """移除文件条目（文件已删除）"""
+        with self._lock:
+            if self._entries.pop(Path(name).name, None) is not None:
+                self._version += 1
+
+    def list_files(self) -> List[Dict[str, Any]]:
+        """所有文件条目（按修改时间倒序）"""
+        self._sync()
+        with self._lock:
+            entries, _ = self._view('modified')
+            return [dict(entry) for entry in reversed(entries)]
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        """获取单个文件条目"""
+        self._sync()
+        with self._lock:
+            entry = self._entries.get(name)
+            return dict(entry) if entry else None
+
+    def find(self, prefix: str = None, contains: str = None) -> List[Path]:
+        """按文件名前缀或子串查找文件（替代对下载目录的 glob）"""
+        self._sync()
+        with self._lock:
+            names = [name for name in self._entries
+                     if (prefix is None or name.startswith(prefix))
+                     and (contains is None or contains in name)]
+        return [self.root / name for name in sorted(names)]
+
+    @property
+    def version(self) -> int:
+        """条目版本号（目录内容有变化后递增）"""
+        self._sync()
+        return self._version
+
+    def _view(self, sort: str) -> tuple:
+        """按 (sort值, 文件名) 升序排列的条目与键（条目变化后首次访问时重建）"""
+        cached = self._views.get(sort)
+        if cached and cached[0] == self._version:
+            return cached[1], cached[2]
+        entries = sorted(self._entries.values(), key=lambda entry: (entry[sort], entry['name']))
+        keys = [(entry[sort], entry['name']) for entry in entries]
+        self._views[sort] = (self._version, entries, keys)
+        return entries, keys
+
+    def page(self, sort: str = 'modified', order: str = 'desc', cursor: str = None, limit: int = 50,
+             kinds: List[str] = None, extensions: List[str] = None, query: str = None,
+             modified_from: float = None, modified_to: float = None) -> Dict[str, Any]:
+        """按游标分页查询文件
+
+        排序视图随索引缓存，每页从游标位置二分定位后只读取 limit+1 条匹配项。
+        返回 {'items': [...], 'next_cursor': str|None, 'has_more': bool}
+        """
+        if sort not in SORT_KEYS:
+            raise ValueError(f'不支持的排序字段: {sort}')
+        descending = order != 'asc'
+
+        position = None
+        if cursor:
+            position = self.decode_cursor(cursor, sort)
+            if position is None:
+                raise ValueError('无效的分页游标')
+
+        kinds = set(kinds or [])
+        extensions = {ext.lower() if ext.startswith('.') else f'.{ext.lower()}' for ext in extensions or []}
+        query = query.lower() if query else None
+
+        def matches(entry):
+            if kinds and entry['kind'] not in kinds:
+                return False
+            if extensions and os.path.splitext(entry['name'])[1].lower() not in extensions:
+                return False
+            if modified_from is not None and entry['modified'] < modified_from:
+                return False
+            if modified_to is not None and entry['modified'] >= modified_to:
+                return False
+            return not query or query in entry['name'].lower()
+
+        self._sync()
+        with self._lock:
+            entries, keys = self._view(sort)
+            if descending:
+                index = (bisect.bisect_left(keys, position) if position else len(keys)) - 1
+                step = -1
+            else:
+                index = bisect.bisect_right(keys, position) if position else 0
+                step = 1
+
+            items = []
+            while 0 <= index < len(entries) and len(items) <= limit:
+                if matches(entries[index]):
+                    items.append(dict(entries[index]))
+                index += step
+
+        has_more = len(items) > limit
+        items = items[:limit]
+        next_cursor = self.encode_cursor(sort, items[-1][sort], items[-1]['name']) if has_more and items else None
+        return {'items': items, 'next_cursor': next_cursor, 'has_more': has_more}
+
+    @staticmethod
+    def encode_cursor(sort: str, value, name: str) -> str:
+        """编码文件分页游标（包含排序字段，换用其他排序时游标失效）"""
+        raw = json.dumps([sort, value, name], separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor: str, sort: str) -> Optional[tuple]:
+        """解码文件分页游标，无效或与排序字段不符时返回None"""
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            cursor_sort, value, name = json.loads(raw)
+            if cursor_sort != sort or not isinstance(name, str):
+                return None
+            # 值类型需与排序字段一致，否则二分比较会抛出TypeError
+            expected = str if sort == 'name' else (int, float)
+            if isinstance(value, bool) or not isinstance(value, expected):
+                return None
+            return value, name
+        except Exception:
+            return None
+
+    def get_summary(self) -> Dict[str, Any]:
+        """文件总数、总大小与各类型数量（按版本缓存）"""
+        self._sync()
+        with self._lock:
+            if self._summary is None or self._summary[0] != self._version:
+                by_kind = {}
+                for entry in self._entries.values():
+                    by_kind[entry['kind']] = by_kind.get(entry['kind'], 0) + 1
+                self._summary = (self._version, {
+                    'total': len(self._entries),
+                    'total_size': sum(entry['size'] for entry in self._entries.values()),
+                    'by_kind': by_kind,
+                })
+            return dict(self._summary[1])
+
+    def get_stats(self) -> Dict[str, Any]:
+        """索引统计"""
+        summary = self.get_summary()
+        with self._lock:
+            return {
+                'root': str(self.root),
+                'files': summary['total'],
+                'total_size': summary['total_size'],
+                'last_reconcile': self._last_reconcile,
+                **self._stats,
+            }
+
+
+# 全局索引实例
+_library_index = None
+_index_lock = threading.Lock()
+
+def get_library_index() -> LibraryIndex:
+    """获取下载目录索引（下载目录配置变化时重建）"""
+    global _library_index
+    from ...core.config import get_config
+
+    root = Path(get_config('downloader.output_dir', '/app/downloads'))
+    with _index_lock:
+        if _library_index is None or _library_index.root != root:
+            if _library_index is not None:
+                _library_index.stop()
+            _library_index = LibraryIndex(root)
+        return _library_index
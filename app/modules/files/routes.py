@@ -3,11 +3,12 @@
 文件管理路由 - 文件下载和管理
 """
 
-import os
 import logging
+import mimetypes
 from pathlib import Path
-from flask import Blueprint, send_file, jsonify, abort
-from ...core.auth import auth_required
+from flask import Blueprint, jsonify, abort
+from werkzeug.exceptions import HTTPException
+from ...core.auth import auth_required, signed_or_auth_required
 
 logger = logging.getLogger(__name__)
 
@@ -15,12 +16,13 @@ files_bp = Blueprint('files', __name__)
 
 
 @files_bp.route('/download/<filename>')
-@auth_required
+@signed_or_auth_required('file')
 def download_file(filename):
     """下载文件"""
     try:
         from ...core.config import get_config
         from flask import request
+        from .streaming import send_media
 
         # 获取下载目录
         download_dir = Path(get_config('downloader.output_dir', '/app/downloads'))
@@ -32,7 +34,7 @@ def download_file(filename):
             abort(403)
 
         # 检查文件是否存在
-        if not file_path.exists():
+        if not file_path.is_file():
             logger.warning(f"文件不存在: {filename}")
             abort(404)
 
@@ -42,25 +44,28 @@ def download_file(filename):
         if is_streaming and _is_video_file(filename):
             # 流媒体播放
             logger.info(f"流媒体播放: {filename}")
-            return send_file(file_path, as_attachment=False, mimetype=_get_video_mimetype(filename))
+            return send_media(file_path, _get_media_mimetype(file_path))
         else:
-            # 普通下载
+            # 普通下载（支持断点续传）
             logger.info(f"下载文件: {filename}")
-            return send_file(file_path, as_attachment=True)
+            mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            return send_media(file_path, mimetype, as_attachment=True)
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"文件访问失败: {e}")
         abort(500)
 
 
 @files_bp.route('/stream/<filename>')
-@auth_required
+@signed_or_auth_required('file')
 def stream_file(filename):
     """流媒体播放文件（支持Range请求）"""
     try:
         from ...core.config import get_config
-        from flask import request, Response
-        import os
+        from flask import request
+        from .streaming import send_media
 
         # 获取下载目录
         download_dir = Path(get_config('downloader.output_dir', '/app/downloads'))
@@ -71,7 +76,7 @@ def stream_file(filename):
             logger.warning(f"安全检查失败: {filename}")
             abort(403)
 
-        if not file_path.exists():
+        if not file_path.is_file():
             logger.warning(f"文件不存在: {filename}")
             abort(404)
 
@@ -80,38 +85,12 @@ def stream_file(filename):
             logger.warning(f"非视频文件: {filename}")
             abort(400)
 
-        logger.info(f"🎥 流媒体播放: {filename}")
-
-        # 获取文件信息
-        file_size = file_path.stat().st_size
-        mimetype = _get_video_mimetype(filename)
-
-        logger.info(f"文件大小: {file_size} bytes, MIME类型: {mimetype}")
-
-        # 检查是否为Range请求
-        range_header = request.headers.get('Range')
+        logger.debug(f"🎥 流媒体播放: {filename} Range={request.headers.get('Range')}")
 
-        if range_header:
-            # 处理Range请求（视频播放必需）
-            logger.info(f"处理Range请求: {range_header}")
-            return _handle_range_request(file_path, file_size, mimetype, range_header)
-        else:
-            # 普通请求
-            logger.info("处理普通请求")
-            response = Response(
-                _generate_file_chunks(file_path),
-                mimetype=mimetype,
-                headers={
-                    'Content-Length': str(file_size),
-                    'Accept-Ranges': 'bytes',
-                    'Cache-Control': 'no-cache',
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Methods': 'GET, HEAD, OPTIONS',
-                    'Access-Control-Allow-Headers': 'Range, Content-Range, Content-Length'
-                }
-            )
-            return response
+        return send_media(file_path, _get_media_mimetype(file_path))
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"❌ 流媒体播放失败: {e}")
         import traceback
@@ -127,44 +106,254 @@ def stream_file_options(filename):
     response = Response()
     response.headers['Access-Control-Allow-Origin'] = '*'
     response.headers['Access-Control-Allow-Methods'] = 'GET, HEAD, OPTIONS'
-    response.headers['Access-Control-Allow-Headers'] = 'Range, Content-Range, Content-Length, Authorization'
+    response.headers['Access-Control-Allow-Headers'] = ('Range, Content-Range, Content-Length, Authorization, '
+                                                        'If-Range, If-None-Match')
     response.headers['Access-Control-Max-Age'] = '86400'
     return response
 
 
+FILE_FIELDS = ('name', 'size', 'modified', 'kind', 'download_url', 'thumbnail', 'preview', 'media', 'playback')
+MEDIA_FIELDS = ('mimetype', 'duration', 'width', 'height', 'video_codec', 'audio_codec')
+
+
 @files_bp.route('/list')
 @auth_required
 def list_files():
-    """获取文件列表"""
+    """分页获取文件列表（游标分页，数据来自下载目录索引）
+
+    参数: limit, cursor, sort (modified/size/name), order (desc/asc),
+          type (video/audio/subtitle/other，逗号分隔), ext (逗号分隔), q (文件名关键词),
+          date_from, date_to (YYYY-MM-DD，按修改时间), fields (逗号分隔，只返回指定字段),
+          summary=1 时附带文件总数、总大小与各类型数量
+    """
     try:
-        from ...core.config import get_config
-        
-        download_dir = Path(get_config('downloader.output_dir', '/app/downloads'))
-        
-        if not download_dir.exists():
-            return jsonify({'files': []})
-        
+        from datetime import datetime, timedelta
+        from flask import request
+        from .index import get_library_index
+
+        try:
+            limit = min(max(int(request.args.get('limit', 50)), 1), 500)
+        except ValueError:
+            return jsonify({'error': 'limit参数无效'}), 400
+
+        fields = [f for f in (request.args.get('fields') or '').split(',') if f]
+        if any(f not in FILE_FIELDS for f in fields):
+            return jsonify({'error': f"fields只能包含: {', '.join(FILE_FIELDS)}"}), 400
+
+        dates = {}
+        for param in ('date_from', 'date_to'):
+            value = request.args.get(param)
+            if value:
+                try:
+                    dates[param] = datetime.strptime(value, '%Y-%m-%d')
+                except ValueError:
+                    return jsonify({'error': '日期格式应为YYYY-MM-DD'}), 400
+
+        from .thumbnails import get_thumbnail_service
+        thumbnails = get_thumbnail_service()
+
+        index = get_library_index()
+        try:
+            page = index.page(
+                sort=request.args.get('sort', 'modified'),
+                order='asc' if request.args.get('order') == 'asc' else 'desc',
+                cursor=request.args.get('cursor') or None,
+                limit=limit,
+                kinds=[k for k in (request.args.get('type') or '').split(',') if k and k != 'all'],
+                extensions=[e for e in (request.args.get('ext') or '').split(',') if e],
+                query=(request.args.get('q') or '').strip() or None,
+                modified_from=dates['date_from'].timestamp() if 'date_from' in dates else None,
+                # 包含结束日期当天
+                modified_to=(dates['date_to'] + timedelta(days=1)).timestamp() if 'date_to' in dates else None,
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        # 媒体信息：一页只查一次数据库，未探测的排队后台探测
+        media = {}
+        if not fields or 'media' in fields or 'playback' in fields:
+            from .catalog import get_media_catalog
+            media = get_media_catalog().lookup_many(
+                [entry for entry in page['items'] if entry['kind'] in ('video', 'audio')], root=index.root)
+
+        from .catalog import get_playback
         files = []
-        for file_path in download_dir.iterdir():
-            if file_path.is_file():
-                stat = file_path.stat()
-                files.append({
-                    'name': file_path.name,
-                    'size': stat.st_size,
-                    'modified': stat.st_mtime,
-                    'download_url': f'/files/download/{file_path.name}'
-                })
-        
-        # 按修改时间倒序排列
-        files.sort(key=lambda x: x['modified'], reverse=True)
-        
-        return jsonify({'files': files})
-        
+        for entry in page['items']:
+            catalog_entry = media.get(entry['name'])
+            item = {**entry, 'download_url': f"/files/download/{entry['name']}",
+                    'thumbnail': None, 'preview': None,
+                    'media': {f: catalog_entry.get(f) for f in MEDIA_FIELDS} if catalog_entry else None,
+                    'playback': get_playback(catalog_entry)}
+            if entry['kind'] == 'video' and (not fields or 'thumbnail' in fields or 'preview' in fields):
+                # 只读取已生成的缓存，未生成的排队后台生成
+                item.update(thumbnails.get_urls(index.root / entry['name'], entry['size'], entry['modified']) or {})
+            files.append({f: item[f] for f in fields} if fields else item)
+
+        response_data = {
+            'files': files,
+            'next_cursor': page['next_cursor'],
+            'has_more': page['has_more'],
+        }
+        if request.args.get('summary') == '1':
+            response_data['summary'] = index.get_summary()
+
+        return jsonify(response_data)
+
     except Exception as e:
         logger.error(f"获取文件列表失败: {e}")
         return jsonify({'error': '获取文件列表失败'}), 500
 
 
+@files_bp.route('/thumbs/<name>')
+@auth_required
+def thumbnail_file(name):
+    """缩略图与预览图（文件名由内容键决定，内容不变则地址不变，可长期缓存）"""
+    import re
+    from flask import send_from_directory
+    from .thumbnails import get_thumbnail_service
+
+    service = get_thumbnail_service()
+    if not service.cache_dir or not re.match(r'^[0-9a-f]{40}(_sprite)?\.jpg$', name):
+        abort(404)
+
+    response = send_from_directory(service.cache_dir, name, mimetype='image/jpeg', max_age=31536000)
+    response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
+
+
+def _get_hls_source(filename):
+    """HLS 源文件（安全检查与类型检查同流媒体播放）"""
+    from ...core.config import get_config
+
+    if not get_config('files.hls.enabled', True):
+        abort(404)
+
+    download_dir = Path(get_config('downloader.output_dir', '/app/downloads'))
+    file_path = download_dir / filename
+    if not str(file_path.resolve()).startswith(str(download_dir.resolve())):
+        abort(403)
+    if not file_path.is_file():
+        abort(404)
+    if not _is_video_file(filename):
+        abort(400)
+    return file_path
+
+
+@files_bp.route('/hls/<filename>/index.m3u8')
+@signed_or_auth_required('file')
+def hls_playlist(filename):
+    """HLS 播放列表（按关键帧切分，分片按需流复制生成）"""
+    try:
+        from flask import Response, request
+        from .hls import get_hls_packager, UnsupportedMediaError
+
+        file_path = _get_hls_source(filename)
+        packager = get_hls_packager()
+        # 分片地址带内容键，文件内容变化后浏览器缓存自然失效；通过签名地址访问时分片沿用同一签名
+        query = f'v={packager.get_key(file_path)[:12]}'
+        if getattr(request, 'signed_access', False):
+            query += f"&exp={request.args['exp']}&sig={request.args['sig']}"
+        try:
+            playlist = packager.playlist(file_path, f'{{number}}.m4s?{query}', f'init.mp4?{query}')
+        except UnsupportedMediaError as e:
+            return jsonify({'error': str(e)}), 415
+
+        return Response(playlist, mimetype='application/vnd.apple.mpegurl',
+                        headers={'Cache-Control': 'private, no-cache'})
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ 生成HLS播放列表失败: {e}")
+        abort(500)
+
+
+def _send_hls_file(resolve, mimetype: str):
+    """发送HLS缓存文件；返回路径后被其他进程淘汰时按未命中处理，重新生成一次"""
+    from .streaming import send_media
+
+    try:
+        return send_media(resolve(), mimetype, offload=False)
+    except FileNotFoundError:
+        return send_media(resolve(), mimetype, offload=False)
+
+
+@files_bp.route('/hls/<filename>/init.mp4')
+@signed_or_auth_required('file')
+def hls_init(filename):
+    """HLS 初始化段"""
+    try:
+        from .hls import get_hls_packager
+
+        file_path = _get_hls_source(filename)
+        return _send_hls_file(lambda: get_hls_packager().init_segment(file_path), 'video/mp4')
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ 生成HLS初始化段失败: {e}")
+        abort(500)
+
+
+@files_bp.route('/hls/<filename>/<int:number>.m4s')
+@signed_or_auth_required('file')
+def hls_segment(filename, number):
+    """HLS 分片"""
+    try:
+        from .hls import get_hls_packager
+
+        file_path = _get_hls_source(filename)
+        try:
+            return _send_hls_file(lambda: get_hls_packager().segment(file_path, number), 'video/iso.segment')
+        except IndexError:
+            abort(404)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ 生成HLS分片失败: {e}")
+        abort(500)
+
+
+@files_bp.route('/share/<filename>', methods=['POST'])
+@auth_required
+def share_file(filename):
+    """生成文件的签名分享地址（无需登录即可下载/播放，到期失效）
+
+    参数: ttl 有效期秒数（默认 auth.signed_url_ttl，最长 auth.signed_url_max_ttl）
+    """
+    try:
+        from flask import request
+        from ...core.auth import sign_params
+        from ...core.config import get_config
+        from urllib.parse import quote, urlencode
+
+        download_dir = Path(get_config('downloader.output_dir', '/app/downloads'))
+        file_path = download_dir / filename
+        if file_path.resolve().parent != download_dir.resolve() or not file_path.is_file():
+            return jsonify({'error': '文件不存在'}), 404
+
+        data = request.get_json(silent=True) or {}
+        try:
+            ttl = int(data.get('ttl') or get_config('auth.signed_url_ttl', 86400))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'ttl参数无效'}), 400
+        ttl = min(max(ttl, 60), get_config('auth.signed_url_max_ttl', 7 * 86400))
+
+        params = sign_params('file', filename, ttl)
+        query = urlencode(params)
+        urls = {'download_url': f'/files/download/{quote(filename)}?{query}'}
+        if _is_video_file(filename):
+            urls['stream_url'] = f'/files/stream/{quote(filename)}?{query}'
+            urls['hls_url'] = f'/files/hls/{quote(filename)}/index.m3u8?{query}'
+
+        return jsonify({'success': True, 'expires': params['exp'], **urls})
+
+    except Exception as e:
+        logger.error(f"❌ 生成分享地址失败: {e}")
+        return jsonify({'error': '生成分享地址失败'}), 500
+
+
 @files_bp.route('/delete/<filename>', methods=['DELETE'])
 @auth_required
 def delete_file(filename):
@@ -183,6 +372,8 @@ def delete_file(filename):
             abort(404)
         
         file_path.unlink()
+        from .index import get_library_index
+        get_library_index().discard(filename)
         logger.info(f"删除文件: {filename}")
         
         return jsonify({'success': True, 'message': '文件删除成功'})
@@ -192,6 +383,103 @@ def delete_file(filename):
         return jsonify({'error': '删除文件失败'}), 500
 
 
+def _resolve_export_files(names):
+    """校验导出选择，返回文件路径列表（出错时返回错误信息）"""
+    from ...core.config import get_config
+
+    if not names or not all(isinstance(name, str) for name in names):
+        return None, '请选择要导出的文件'
+    max_files = get_config('files.export.max_files', 1000)
+    if len(names) > max_files:
+        return None, f'单次最多导出 {max_files} 个文件'
+
+    download_dir = Path(get_config('downloader.output_dir', '/app/downloads'))
+    paths = []
+    for name in dict.fromkeys(names):
+        file_path = download_dir / name
+        if file_path.resolve().parent != download_dir.resolve() or not file_path.is_file():
+            return None, f'文件不存在: {name}'
+        paths.append(file_path)
+    return paths, None
+
+
+@files_bp.route('/export', methods=['POST'])
+@auth_required
+def create_export():
+    """创建批量导出：保存选择并返回导出地址（同一地址可以断点续传）"""
+    try:
+        import uuid
+        from flask import request
+        from ...core.config import get_config
+        from ...core.database import get_database
+        from .export import ArchiveStream, FORMATS
+
+        data = request.get_json() or {}
+        fmt = data.get('format', 'zip')
+        if fmt not in FORMATS:
+            return jsonify({'error': f"format只能是: {', '.join(FORMATS)}"}), 400
+
+        paths, error = _resolve_export_files(data.get('files'))
+        if error:
+            return jsonify({'error': error}), 400
+
+        export_id = uuid.uuid4().hex
+        names = [path.name for path in paths]
+        get_database().state_set('file_export', export_id, {'files': names, 'format': fmt},
+                                 ttl=get_config('files.export.ttl', 86400))
+
+        return jsonify({
+            'success': True,
+            'export_id': export_id,
+            'url': f'/files/export/{export_id}',
+            'count': len(names),
+            'size': ArchiveStream(paths, fmt).size,
+        })
+
+    except Exception as e:
+        logger.error(f"❌ 创建批量导出失败: {e}")
+        return jsonify({'error': '创建批量导出失败'}), 500
+
+
+@files_bp.route('/export', methods=['GET'])
+@files_bp.route('/export/<export_id>', methods=['GET'])
+@auth_required
+def download_export(export_id=None):
+    """流式下载批量导出（ZIP64 仅存储或 TAR，支持 Range 续传）
+
+    可以使用 POST /files/export 返回的导出 ID，也可以直接传 files（可重复）与 format 参数。
+    """
+    try:
+        from flask import request
+        from .export import ArchiveStream, FORMATS, send_archive
+
+        if export_id:
+            from ...core.database import get_database
+            selection = get_database().state_get('file_export', export_id)
+            if not selection:
+                return jsonify({'error': '导出不存在或已过期'}), 404
+            names, fmt = selection['files'], selection['format']
+            download_name = f'export-{export_id[:8]}.{fmt}'
+        else:
+            names, fmt = request.args.getlist('files'), request.args.get('format', 'zip')
+            if fmt not in FORMATS:
+                return jsonify({'error': f"format只能是: {', '.join(FORMATS)}"}), 400
+            download_name = f'export.{fmt}'
+
+        paths, error = _resolve_export_files(names)
+        if error:
+            return jsonify({'error': error}), 404 if export_id else 400
+
+        logger.info(f"📦 批量导出: {len(paths)} 个文件 ({fmt}) Range={request.headers.get('Range')}")
+        return send_archive(ArchiveStream(paths, fmt), download_name)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ 批量导出失败: {e}")
+        abort(500)
+
+
 def _is_video_file(filename):
     """检查是否为视频文件"""
     video_extensions = {
@@ -201,6 +489,21 @@ def _is_video_file(filename):
     return Path(filename).suffix.lower() in video_extensions
 
 
+def _is_media_file(filename):
+    """检查是否为音视频文件"""
+    from .index import get_file_kind
+    return get_file_kind(filename) in ('video', 'audio')
+
+
+def _get_media_mimetype(file_path):
+    """MIME类型：优先使用媒体信息目录中按实际容器确定的类型（只读缓存，不探测）"""
+    from .catalog import get_media_catalog
+    entry = get_media_catalog().lookup(file_path)
+    if entry and entry.get('mimetype'):
+        return entry['mimetype']
+    return _get_video_mimetype(file_path.name)
+
+
 def _get_video_mimetype(filename):
     """获取视频文件的MIME类型"""
     ext = Path(filename).suffix.lower()
@@ -221,72 +524,12 @@ def _get_video_mimetype(filename):
     return mime_types.get(ext, 'video/mp4')
 
 
-def _handle_range_request(file_path, file_size, mimetype, range_header):
-    """处理HTTP Range请求（视频播放必需）"""
-    from flask import Response
-    import re
-
-    # 解析Range头
-    range_match = re.search(r'bytes=(\d+)-(\d*)', range_header)
-    if not range_match:
-        abort(400)
-
-    start = int(range_match.group(1))
-    end = int(range_match.group(2)) if range_match.group(2) else file_size - 1
-
-    # 验证范围
-    if start >= file_size or end >= file_size or start > end:
-        abort(416)  # Range Not Satisfiable
-
-    content_length = end - start + 1
-
-    def generate_range_data():
-        with open(file_path, 'rb') as f:
-            f.seek(start)
-            remaining = content_length
-            while remaining:
-                chunk_size = min(8192, remaining)
-                chunk = f.read(chunk_size)
-                if not chunk:
-                    break
-                remaining -= len(chunk)
-                yield chunk
-
-    response = Response(
-        generate_range_data(),
-        206,  # Partial Content
-        headers={
-            'Content-Type': mimetype,
-            'Content-Length': str(content_length),
-            'Content-Range': f'bytes {start}-{end}/{file_size}',
-            'Accept-Ranges': 'bytes',
-            'Cache-Control': 'no-cache',
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'GET, HEAD, OPTIONS',
-            'Access-Control-Allow-Headers': 'Range, Content-Range, Content-Length'
-        }
-    )
-
-    return response
-
-
-def _generate_file_chunks(file_path, chunk_size=8192):
-    """生成文件数据块"""
-    with open(file_path, 'rb') as f:
-        while True:
-            chunk = f.read(chunk_size)
-            if not chunk:
-                break
-            yield chunk
-
-
 @files_bp.route('/debug/<filename>')
 @auth_required
 def debug_file(filename):
     """调试文件信息"""
     try:
         from ...core.config import get_config
-        import mimetypes
 
         download_dir = Path(get_config('downloader.output_dir', '/app/downloads'))
         file_path = download_dir / filename
@@ -296,6 +539,9 @@ def debug_file(filename):
 
         stat = file_path.stat()
 
+        from .catalog import get_media_catalog, get_playback
+        media = get_media_catalog().get(file_path) if _is_media_file(filename) else None
+
         debug_info = {
             'filename': filename,
             'path': str(file_path),
@@ -304,7 +550,9 @@ def debug_file(filename):
             'size_mb': round(stat.st_size / (1024 * 1024), 2),
             'modified': stat.st_mtime,
             'is_video': _is_video_file(filename),
-            'detected_mimetype': _get_video_mimetype(filename),
+            'detected_mimetype': _get_media_mimetype(file_path),
+            'media': media,
+            'playback': get_playback(media),
             'system_mimetype': mimetypes.guess_type(filename)[0],
             'extension': file_path.suffix.lower(),
             'stream_url': f'/files/stream/{filename}',
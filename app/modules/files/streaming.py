@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+文件流式发送 - 下载与在线播放共用
+
+完整文件与 Range 区间都交给 WSGI 服务器的 wsgi.file_wrapper 发送：gunicorn 等
+服务器会直接对文件描述符调用 sendfile（从当前偏移发送 Content-Length 字节），
+数据不经过 Python；不支持时按大块读取。部署在 nginx / Apache 之后时可以改为
+返回 X-Accel-Redirect / X-Sendfile 头，由前端服务器发送文件。
+
+响应带 ETag / Last-Modified 校验器，支持条件请求（304/412）、If-Range、HEAD、
+后缀区间与多区间（multipart/byteranges），拖动进度与重复观看可以命中浏览器缓存。
+"""
+
+import uuid
+import logging
+import unicodedata
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import quote
+
+logger = logging.getLogger(__name__)
+
+# 合并后区间数超过该值时忽略 Range，发送完整文件（防止大量小区间放大开销）
+MAX_RANGES = 16
+
+STREAM_HEADERS = {
+    'Accept-Ranges': 'bytes',
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, HEAD, OPTIONS',
+    'Access-Control-Allow-Headers': 'Range, Content-Range, Content-Length, If-Range, If-None-Match',
+    'Access-Control-Expose-Headers': 'Content-Range, Content-Length, ETag, Last-Modified',
+}
+
+
+class FileRange:
+    """文件的一个字节区间
+
+    文件描述符定位在区间起点，read() 不会越过区间终点；sendfile 从描述符的
+    当前偏移发送 Content-Length 字节，两种发送方式结果一致。
+    """
+
+    def __init__(self, path: Path, start: int, length: int):
+        self._file = open(path, 'rb')
+        self._file.seek(start)
+        self.remaining = length
+
+    def read(self, size: int = -1) -> bytes:
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self._file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self) -> int:
+        return self._file.fileno()
+
+    def close(self):
+        self._file.close()
+
+
+def parse_ranges(range_header: str, file_size: int) -> Optional[List[tuple]]:
+    """解析 Range 头（支持多区间与 bytes=-N 后缀区间），返回合并后的 [(start, end)]
+
+    语法无效时返回 None（按规范忽略 Range）；没有可满足的区间时抛出 ValueError。
+    """
+    unit, _, spec = range_header.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec.strip():
+        return None
+
+    ranges = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = (value.strip() for value in part.partition('-'))
+        if not sep:
+            return None
+        if not first:
+            # 后缀区间：最后 N 个字节
+            if not last.isdigit():
+                return None
+            if int(last) > 0 and file_size > 0:
+                ranges.append((max(0, file_size - int(last)), file_size - 1))
+            continue
+        if not first.isdigit() or (last and not last.isdigit()):
+            return None
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start < file_size:
+            ranges.append((start, min(int(last), file_size - 1) if last else file_size - 1))
+
+    if not ranges:
+        raise ValueError('Range Not Satisfiable')
+
+    # 合并重叠或相邻的区间
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def make_etag(stat) -> str:
+    """由大小与修改时间生成强校验 ETag"""
+    return f'{stat.st_size:x}-{stat.st_mtime_ns:x}'
+
+
+def _content_disposition(filename: str) -> str:
+    """附件下载头（非ASCII文件名按 RFC 5987 编码）"""
+    try:
+        filename.encode('ascii')
+        return 'attachment; filename="{}"'.format(filename.replace('"', '\\"'))
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+        return "attachment; filename=\"{}\"; filename*=UTF-8''{}".format(
+            simple.replace('"', '\\"'), quote(filename, safe="!#$&+^`|"))
+
+
+def _offload_response(file_path: Path, mimetype: str, headers: Dict[str, str]):
+    """交给前端服务器发送文件（Range 由前端服务器处理），未启用时返回 None"""
+    from flask import Response
+    from ...core.config import get_config
+
+    offload = get_config('files.streaming.offload', '')
+    if offload == 'nginx':
+        prefix = get_config('files.streaming.accel_prefix', '/internal-downloads/')
+        headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(file_path.name)
+    elif offload == 'sendfile':
+        headers['X-Sendfile'] = str(file_path.resolve())
+    else:
+        return None
+
+    headers.pop('Accept-Ranges', None)
+    return Response(status=200, mimetype=mimetype, headers=headers)
+
+
+def _is_not_modified(request, etag: str, last_modified: int) -> bool:
+    """If-None-Match 优先，其次 If-Modified-Since"""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since:
+        return last_modified <= int(request.if_modified_since.timestamp())
+    return False
+
+
+def _is_precondition_failed(request, etag: str, last_modified: int) -> bool:
+    """If-Match / If-Unmodified-Since 不满足"""
+    if request.if_match:
+        return not request.if_match.contains(etag)
+    if request.if_unmodified_since:
+        return last_modified > int(request.if_unmodified_since.timestamp())
+    return False
+
+
+def _range_applies(request, etag: str, last_modified: int) -> bool:
+    """If-Range 校验器与当前文件一致时才按 Range 发送（否则文件已变，发送完整文件）"""
+    if_range = request.if_range
+    if if_range.etag:
+        return if_range.etag == etag
+    if if_range.date:
+        return last_modified == int(if_range.date.timestamp())
+    return True
+
+
+def _multipart_body(file_path: Path, ranges: List[tuple], parts: List[bytes], closing: bytes, window: int):
+    with open(file_path, 'rb') as f:
+        for (start, end), part_header in zip(ranges, parts):
+            yield part_header
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining:
+                chunk = f.read(min(window, remaining))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                yield chunk
+            yield b'\r\n'
+    yield closing
+
+
+def send_media(file_path: Path, mimetype: str, as_attachment: bool = False, offload: bool = True):
+    """发送文件（处理条件请求、HEAD、单区间与多区间 Range）
+
+    offload=False 用于不在下载目录中的文件（前端服务器的内部地址只映射下载目录）。
+    """
+    from flask import Response, request
+    from werkzeug.exceptions import RequestedRangeNotSatisfiable, PreconditionFailed
+    from werkzeug.http import http_date
+    from werkzeug.wsgi import wrap_file
+    from ...core.config import get_config
+
+    headers = dict(STREAM_HEADERS)
+    if as_attachment:
+        headers['Content-Disposition'] = _content_disposition(file_path.name)
+
+    offloaded = _offload_response(file_path, mimetype, headers) if offload else None
+    if offloaded is not None:
+        return offloaded
+
+    stat = file_path.stat()
+    file_size = stat.st_size
+    last_modified = int(stat.st_mtime)
+    etag = make_etag(stat)
+
+    # 需要认证的内容默认只允许浏览器私有缓存，可信的前端代理可配置为 public；过期后凭 ETag 重新验证
+    max_age = get_config('files.streaming.cache_max_age', 3600)
+    scope = 'public' if get_config('files.streaming.cache_public', False) else 'private'
+    headers['Cache-Control'] = f'{scope}, max-age={max_age}' if max_age else f'{scope}, no-cache'
+    headers['ETag'] = f'"{etag}"'
+    headers['Last-Modified'] = http_date(last_modified)
+
+    if _is_precondition_failed(request, etag, last_modified):
+        raise PreconditionFailed()
+    if _is_not_modified(request, etag, last_modified):
+        for header in ('Content-Disposition', 'Accept-Ranges'):
+            headers.pop(header, None)
+        return Response(status=304, headers=headers)
+
+    ranges = None
+    range_header = request.headers.get('Range')
+    if range_header and _range_applies(request, etag, last_modified):
+        try:
+            ranges = parse_ranges(range_header, file_size)
+        except ValueError:
+            # 416 附带 Content-Range: bytes */文件大小
+            raise RequestedRangeNotSatisfiable(length=file_size)
+        if ranges and len(ranges) > MAX_RANGES:
+            ranges = None
+
+    window = get_config('files.streaming.window', 1024 * 1024)
+
+    if ranges and len(ranges) > 1:
+        boundary = uuid.uuid4().hex
+        parts = [(f'--{boundary}\r\nContent-Type: {mimetype}\r\n'
+                  f'Content-Range: bytes {start}-{end}/{file_size}\r\n\r\n').encode('ascii')
+                 for start, end in ranges]
+        closing = f'--{boundary}--\r\n'.encode('ascii')
+        length = sum(len(part) + end - start + 1 + 2 for part, (start, end) in zip(parts, ranges)) + len(closing)
+        headers['Content-Length'] = str(length)
+        body = () if request.method == 'HEAD' else _multipart_body(file_path, ranges, parts, closing, window)
+        return Response(body, status=206, headers=headers,
+                        content_type=f'multipart/byteranges; boundary={boundary}')
+
+    status = 200
+    start, length = 0, file_size
+    if ranges:
+        start, end = ranges[0]
+        length = end - start + 1
+        status = 206
+        headers['Content-Range'] = f'bytes {start}-{end}/{file_size}'
+
+    headers['Content-Length'] = str(length)
+    if request.method == 'HEAD':
+        return Response(status=status, mimetype=mimetype, headers=headers)
+
+    body = wrap_file(request.environ, FileRange(file_path, start, length), buffer_size=window)
+
+    # direct_passthrough：响应体原样交给服务器，file_wrapper 才能走 sendfile
+    return Response(body, status=status, mimetype=mimetype, headers=headers, direct_passthrough=True)
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""
+视频缩略图与拖动预览图 - 后台生成，按内容键缓存到磁盘
+
+下载完成或下载目录索引变化时，把缺少缓存的视频交给有界工作线程池，用 ffmpeg
+截取封面帧并拼接关键帧预览图（sprite）。缓存文件名由文件大小与首尾内容采样的
+哈希决定，文件内容不变时重命名也能复用；内容变化后自然生成新键，旧缓存失效。
+文件列表只读取内存中的就绪表，不触发任何 ffmpeg 调用；多进程部署时只有
+协调进程生成，其他进程从缓存目录加载。
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_BYTES = 64 * 1024
+
+
+def content_key(path: Path, stat: os.stat_result = None) -> str:
+    """按文件大小与首尾各 64KB 内容计算缓存键"""
+    stat = stat or path.stat()
+    digest = hashlib.sha1(str(stat.st_size).encode('ascii'))
+    with open(path, 'rb') as f:
+        digest.update(f.read(SAMPLE_BYTES))
+        if stat.st_size > SAMPLE_BYTES * 2:
+            f.seek(-SAMPLE_BYTES, os.SEEK_END)
+            digest.update(f.read(SAMPLE_BYTES))
+    return digest.hexdigest()
+
+
+class ThumbnailService:
+    """缩略图后台生成服务"""
+
+    def __init__(self):
+        self.cache_dir = None
+        self.executor = None
+        self.scan_thread = None
+        self.stop_event = threading.Event()
+        self.running = False
+        self._lock = threading.Lock()
+        self._keys: Dict[tuple, str] = {}           # (文件名, 大小, 修改时间) -> 内容键
+        self._ready: Dict[str, Dict[str, Any]] = {}  # 内容键 -> 预览图信息
+        self._pending = set()
+        self._failed = set()
+        self._index_version = None
+        self._stats = {'generated': 0, 'reused': 0, 'failed': 0}
+
+    def start(self):
+        """启动工作线程池与索引变化检查"""
+        if self.running:
+            return
+
+        try:
+            from ...core.config import get_config
+            from ...core.events import event_bus, Events
+
+            if not get_config('files.thumbnails.enabled', True):
+                logger.info("🖼️ 缩略图生成已禁用")
+                return
+            if not shutil.which('ffmpeg'):
+                logger.warning("⚠️ 未找到ffmpeg，缩略图生成不可用")
+                return
+
+            self.cache_dir = self._get_cache_dir()
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            self.executor = ThreadPoolExecutor(
+                max_workers=get_config('files.thumbnails.workers', 1),
+                thread_name_prefix="Thumbnail"
+            )
+            self.running = True
+            self.stop_event.clear()
+
+            event_bus.add_listener(Events.DOWNLOAD_COMPLETED, self._on_download_completed, group='files')
+
+            self.scan_thread = threading.Thread(
+                target=self._scan_loop,
+                daemon=True,
+                name="ThumbnailScanner"
+            )
+            self.scan_thread.start()
+
+            logger.info("✅ 缩略图后台生成已启动")
+
+        except Exception as e:
+            logger.error(f"❌ 启动缩略图生成失败: {e}")
+
+    def stop(self):
+        """停止生成（进行中的任务完成后退出）"""
+        if not self.running:
+            return
+
+        self.running = False
+        self.stop_event.set()
+
+        try:
+            from ...core.events import event_bus, Events
+            event_bus.remove_listener(Events.DOWNLOAD_COMPLETED, self._on_download_completed)
+        except Exception as e:
+            logger.warning(f"⚠️ 移除缩略图监听器失败: {e}")
+
+        if self.scan_thread and self.scan_thread.is_alive():
+            self.scan_thread.join(timeout=5)
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+        logger.info("✅ 缩略图后台生成已停止")
+
+    @staticmethod
+    def _get_cache_dir() -> Path:
+        from ...core.config import get_config
+        cache_dir = get_config('files.thumbnails.cache_dir')
+        if cache_dir:
+            return Path(cache_dir)
+        from ...core.database import get_database
+        return get_database().db_path.parent / 'thumbnails'
+
+    def _on_download_completed(self, data: Dict[str, Any]):
+        file_path = (data or {}).get('file_path')
+        if file_path:
+            self.enqueue(Path(file_path))
+
+    def _scan_loop(self):
+        """下载目录索引变化时，为缺少缓存的视频排队生成"""
+        from ...core.config import get_config
+
+        while not self.stop_event.is_set():
+            try:
+                self.scan_library()
+            except Exception as e:
+                logger.error(f"❌ 缩略图扫描失败: {e}")
+            self.stop_event.wait(get_config('files.thumbnails.scan_interval', 60))
+
+    def scan_library(self):
+        from .index import get_library_index
+
+        index = get_library_index()
+        version = index.version
+        if version == self._index_version:
+            return
+        self._index_version = version
+        for entry in index.list_files():
+            if entry['kind'] == 'video':
+                self.enqueue(index.root / entry['name'], entry['size'], entry['modified'])
+
+    def enqueue(self, path: Path, size: int = None, modified: float = None):
+        """排队生成（已就绪、排队中或失败过的文件跳过）"""
+        if not self.running:
+            return
+        if size is None:
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                return
+            size, modified = stat.st_size, stat.st_mtime
+        memo_key = (path.name, size, modified)
+
+        with self._lock:
+            key = self._keys.get(memo_key)
+            if memo_key in self._pending or memo_key in self._failed or (key and key in self._ready):
+                return
+            self._pending.add(memo_key)
+        self.executor.submit(self._process, path, memo_key)
+
+    def _process(self, path: Path, memo_key: tuple):
+        try:
+            with self._lock:
+                key = self._keys.get(memo_key)
+            if key is None:
+                key = content_key(path)
+                with self._lock:
+                    self._keys[memo_key] = key
+
+            info = self._load_cached(key)
+            generated = info is None
+            if generated:
+                if not self._is_generator():
+                    return  # 由协调进程生成，之后再次查询时从缓存加载
+                info = self.generate(path, key)
+
+            with self._lock:
+                self._ready[key] = info
+                self._stats['generated' if generated else 'reused'] += 1
+
+        except Exception as e:
+            with self._lock:
+                self._failed.add(memo_key)
+                self._stats['failed'] += 1
+            logger.warning(f"⚠️ 生成缩略图失败 {path.name}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(memo_key)
+
+    @staticmethod
+    def _is_generator() -> bool:
+        """多进程部署时只有协调进程调用 ffmpeg，其他进程只读取缓存"""
+        from ...core.coordinator import get_coordinator
+        coordinator = get_coordinator()
+        return coordinator.is_leader or not coordinator.running
+
+    def _load_cached(self, key: str) -> Optional[Dict[str, Any]]:
+        meta_path = self.cache_dir / f'{key}.json'
+        if not meta_path.exists() or not (self.cache_dir / f'{key}.jpg').exists():
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def generate(self, path: Path, key: str) -> Dict[str, Any]:
+        """截取封面帧并生成预览图，返回预览图信息（写入 {key}.json）"""
+        from ...core.config import get_config
+
+        timeout = get_config('files.thumbnails.timeout', 300)
+        width = get_config('files.thumbnails.width', 320)
+        tile_width = get_config('files.thumbnails.sprite_tile_width', 160)
+        columns = get_config('files.thumbnails.sprite_columns', 10)
+        rows = get_config('files.thumbnails.sprite_rows', 10)
+
+        duration = self._probe_duration(path)
+
+        # 封面：跳过片头，取 10% 处的帧
+        poster = self.cache_dir / f'{key}.jpg'
+        self._run_ffmpeg(['-ss', f'{duration * 0.1:.3f}', '-i', str(path), '-frames:v', '1',
+                          '-vf', f'scale={width}:-2', '-q:v', '4'], poster, timeout)
+
+        info = {'poster': poster.name, 'duration': duration, 'sprite': None}
+
+        # 预览图：只解码关键帧，按固定间隔取帧拼成网格
+        count = columns * rows
+        if duration > 0:
+            interval = max(duration / count, 1.0)
+            sprite = self.cache_dir / f'{key}_sprite.jpg'
+            self._run_ffmpeg(['-skip_frame', 'nokey', '-i', str(path), '-an', '-sn',
+                              '-vf', f'fps=1/{interval:.3f},scale={tile_width}:-2,tile={columns}x{rows}',
+                              '-frames:v', '1', '-q:v', '5'], sprite, timeout)
+            info['sprite'] = {
+                'file': sprite.name,
+                'interval': interval,
+                'columns': columns,
+                'rows': rows,
+                'count': min(count, int(duration // interval) + 1),
+                'tile_width': tile_width,
+            }
+
+        meta_tmp = self.cache_dir / f'{key}.json.tmp'
+        with open(meta_tmp, 'w', encoding='utf-8') as f:
+            json.dump(info, f)
+        os.replace(meta_tmp, self.cache_dir / f'{key}.json')
+        logger.debug(f"🖼️ 已生成缩略图: {path.name}")
+        return info
+
+    @staticmethod
+    def _probe_duration(path: Path) -> float:
+        """时长来自媒体信息目录（与文件列表、通知共用同一次探测）"""
+        from .catalog import get_media_catalog
+        try:
+            entry = get_media_catalog().get(path)
+        except Exception:
+            return 0.0
+        return float((entry or {}).get('duration') or 0)
+
+    @staticmethod
+    def _run_ffmpeg(args, output: Path, timeout: float):
+        """执行 ffmpeg，输出先写临时文件再原子替换"""
+        tmp = output.with_name(output.stem + '.tmp' + output.suffix)
+        result = subprocess.run(
+            ['ffmpeg', '-v', 'error', '-y', *args, str(tmp)],
+            capture_output=True, text=True, timeout=timeout
+        )
+        if result.returncode != 0 or not tmp.exists():
+            tmp.unlink(missing_ok=True)
+            raise RuntimeError(result.stderr.strip()[-200:] or 'ffmpeg失败')
+        os.replace(tmp, output)
+
+    def get_urls(self, path: Path, size: int, modified: float) -> Optional[Dict[str, Any]]:
+        """返回已就绪的缩略图与预览图地址（只查内存）；未就绪时排队生成并返回 None"""
+        with self._lock:
+            key = self._keys.get((path.name, size, modified))
+            info = self._ready.get(key) if key else None
+        if info is None:
+            self.enqueue(path, size, modified)
+            return None
+
+        urls = {'thumbnail': f"/files/thumbs/{info['poster']}", 'preview': None}
+        if info.get('sprite'):
+            urls['preview'] = {**info['sprite'], 'url': f"/files/thumbs/{info['sprite']['file']}"}
+            urls['preview'].pop('file')
+        return urls
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, 'ready': len(self._ready), 'pending': len(self._pending),
+                    'running': self.running}
+
+
+# 全局缩略图服务实例
+_thumbnail_service = None
+
+def get_thumbnail_service() -> ThumbnailService:
+    """获取缩略图服务实例"""
+    global _thumbnail_service
+    if _thumbnail_service is None:
+        _thumbnail_service = ThumbnailService()
+    return _thumbnail_service
@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+"""
+订阅模块 - 频道/播放列表增量订阅
+"""
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+订阅管理器 - 后台轮询频道/播放列表，只为新视频创建下载任务
+"""
+
+import json
+import logging
+import threading
+from typing import Dict, Any, List, Optional, Iterator, Tuple
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class SubscriptionManager:
+    """订阅管理器
+
+    使用扁平提取（extract_flat）逐页读取频道条目，遇到第一个已在下载存档中的
+    视频ID即停止翻页，因此每次检查通常只需请求一两页数据。
+    """
+
+    def __init__(self):
+        self.scheduler_thread = None
+        self.stop_event = threading.Event()
+        self.running = False
+        self.executor = None
+        self._checking = set()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """启动订阅调度器"""
+        if self.running:
+            return
+
+        try:
+            from ...core.config import get_config
+
+            if not get_config('subscriptions.enabled', True):
+                logger.info("📺 订阅调度器已禁用")
+                return
+
+            self.running = True
+            self.stop_event.clear()
+            self.executor = ThreadPoolExecutor(
+                max_workers=get_config('subscriptions.max_workers', 4),
+                thread_name_prefix='Subscription'
+            )
+
+            self.scheduler_thread = threading.Thread(
+                target=self._scheduler_loop,
+                daemon=True,
+                name="SubscriptionScheduler"
+            )
+            self.scheduler_thread.start()
+
+            logger.info("✅ 订阅调度器已启动")
+
+        except Exception as e:
+            logger.error(f"❌ 启动订阅调度器失败: {e}")
+
+    def stop(self):
+        """停止订阅调度器"""
+        if not self.running:
+            return
+
+        self.running = False
+        self.stop_event.set()
+
+        if self.scheduler_thread and self.scheduler_thread.is_alive():
+            self.scheduler_thread.join(timeout=5)
+        if self.executor:
+            self.executor.shutdown(wait=False)
+
+        logger.info("✅ 订阅调度器已停止")
+
+    def _scheduler_loop(self):
+        """调度循环 - 定期检查到期的订阅"""
+        while not self.stop_event.is_set():
+            try:
+                from ...core.config import get_config
+                from ...core.database import get_database
+
+                for subscription in get_database().get_due_subscriptions():
+                    self._submit_check(subscription)
+
+                self.stop_event.wait(get_config('subscriptions.poll_interval', 60))
+
+            except Exception as e:
+                logger.error(f"❌ 订阅调度循环出错: {e}")
+                self.stop_event.wait(300)
+
+    def _submit_check(self, subscription: Dict[str, Any]):
+        """提交订阅检查任务（同一订阅不会并发检查）"""
+        with self._lock:
+            if subscription['id'] in self._checking:
+                return
+            self._checking.add(subscription['id'])
+
+        def run():
+            try:
+                self.check_subscription(subscription)
+            finally:
+                with self._lock:
+                    self._checking.discard(subscription['id'])
+
+        if self.executor:
+            self.executor.submit(run)
+        else:
+            threading.Thread(target=run, daemon=True).start()
+
+    def check_now(self, subscription_id: int) -> bool:
+        """立即在后台检查订阅（正在检查时不重复提交），订阅不存在时返回False"""
+        from ...core.database import get_database
+
+        subscription = get_database().get_subscription(subscription_id)
+        if not subscription:
+            return False
+        self._submit_check(subscription)
+        return True
+
+    def add_subscription(self, url: str, options: Dict[str, Any] = None,
+                         check_interval: int = None) -> Dict[str, Any]:
+        """添加订阅并在后台完成首次检查"""
+        try:
+            from ...core.config import get_config
+            from ...core.database import get_database
+
+            url = self._normalize_url(url.strip())
+            check_interval = int(check_interval or get_config('subscriptions.default_interval', 3600))
+            check_interval = max(check_interval, get_config('subscriptions.min_interval', 300))
+
+            db = get_database()
+            subscription_id = db.add_subscription(
+                url,
+                check_interval=check_interval,
+                options=json.dumps(options or {}, ensure_ascii=False)
+            )
+            if not subscription_id:
+                return {'success': False, 'error': '订阅已存在或保存失败'}
+
+            subscription = db.get_subscription(subscription_id)
+            self._submit_check(subscription)
+
+            logger.info(f"📺 添加订阅: {url}")
+            return {'success': True, 'subscription': subscription}
+
+        except Exception as e:
+            logger.error(f"❌ 添加订阅失败: {e}")
+            return {'success': False, 'error': str(e)}
+
+    def check_subscription(self, subscription: Dict[str, Any]) -> Dict[str, Any]:
+        """检查订阅并为新视频创建下载任务"""
+        from ...core.config import get_config
+        from ...core.database import get_database
+        from ..downloader.archive import get_download_archive
+
+        db = get_database()
+        archive = get_download_archive()
+        subscription_id = subscription['id']
+        # 首次检查失败不算完成，下一次检查仍只记录现有视频
+        is_first_check = not subscription.get('seeded_at')
+
+        try:
+            options = json.loads(subscription.get('options') or '{}')
+        except ValueError:
+            options = {}
+
+        try:
+            # 首次检查只记录现有视频（可选回填最近N个），之后才增量下载
+            if is_first_check:
+                max_entries = get_config('subscriptions.initial_items', 30)
+            else:
+                max_entries = get_config('subscriptions.max_entries_per_check', 50)
+
+            title, new_entries, scanned = self._fetch_new_entries(subscription['url'], max_entries)
+
+            if is_first_check:
+                backfill = max(0, int(options.get('backfill', 0)))
+                to_download = new_entries[:backfill]
+                to_archive = new_entries[backfill:]
+            else:
+                to_download = new_entries
+                to_archive = []
+
+            source = f"subscription:{subscription_id}"
+            archive.add_many(((ie_key, video_id) for ie_key, video_id, _ in to_archive), source)
+
+            # 下载完成后才写入存档（见下载管理器），失败的视频在之后的检查中重试；
+            # 已在队列中的跳过，失败次数达到上限的不再重试
+            max_failures = get_config('subscriptions.max_failed_attempts', 3)
+            states = db.get_download_states([entry_url for _, _, entry_url in to_download])
+
+            # 按发布顺序（旧→新）入队
+            enqueued = 0
+            for ie_key, video_id, entry_url in reversed(to_download):
+                state = states.get(entry_url, {})
+                if state.get('active') or state.get('failed', 0) >= max_failures:
+                    continue
+                if self._enqueue(entry_url, options, subscription_id):
+                    enqueued += 1
+
+            latest_id = new_entries[0][1] if new_entries else None
+            db.update_subscription_check(subscription_id, title=title, last_video_id=latest_id, seeded=True)
+
+            logger.info(f"📺 订阅检查完成: {subscription['url']} - 扫描 {scanned} 条，新视频 {len(new_entries)} 个，入队 {enqueued} 个")
+            return {'success': True, 'scanned': scanned, 'new': len(new_entries), 'enqueued': enqueued}
+
+        except Exception as e:
+            logger.error(f"❌ 订阅检查失败 {subscription['url']}: {e}")
+            db.update_subscription_check(subscription_id, last_error=str(e)[:500])
+            return {'success': False, 'error': str(e)}
+
+    def _fetch_new_entries(self, url: str, max_entries: int) -> Tuple[Optional[str], List[tuple], int]:
+        """扁平提取订阅条目，遇到已存档的视频即停止
+
+        返回 (标题, [(extractor, video_id, url), ...] 新→旧, 扫描条数)
+        """
+        from yt_dlp import YoutubeDL
+        from ..downloader.archive import get_download_archive
+
+        archive = get_download_archive()
+        new_entries = []
+        scanned = 0
+
+        with YoutubeDL(self._build_ydl_opts(url)) as ydl:
+            result = ydl.extract_info(url, download=False, process=False)
+
+            # 跟随重定向类结果（如频道首页 -> 视频标签页）
+            for _ in range(3):
+                if not result or result.get('_type') not in ('url', 'url_transparent'):
+                    break
+                result = ydl.extract_info(result['url'], download=False, process=False,
+                                          ie_key=result.get('ie_key'))
+
+            if not result:
+                raise Exception("无法获取订阅内容")
+
+            title = result.get('title')
+            default_ie = result.get('extractor_key') or result.get('ie_key')
+
+            if result.get('_type') not in ('playlist', 'multi_video'):
+                raise Exception("该链接不是频道或播放列表")
+
+            for entry in self._iter_entries(result.get('entries') or []):
+                if scanned >= max_entries:
+                    break
+                scanned += 1
+
+                if not entry or not entry.get('id'):
+                    continue
+
+                ie_key = entry.get('ie_key') or default_ie
+                video_id = entry['id']
+                if archive.contains(ie_key, video_id):
+                    # 频道按时间倒序排列，遇到已见过的视频即可停止翻页
+                    break
+
+                entry_url = entry.get('webpage_url') or entry.get('url')
+                if entry_url:
+                    new_entries.append((ie_key, video_id, entry_url))
+
+        return title, new_entries, scanned
+
+    def _iter_entries(self, entries, page_size: int = 50) -> Iterator[Dict[str, Any]]:
+        """惰性遍历条目 - 只在需要时请求下一页"""
+        if hasattr(entries, 'getslice'):
+            start = 0
+            while True:
+                page = entries.getslice(start, start + page_size)
+                if not page:
+                    return
+                yield from page
+                start += len(page)
+        else:
+            yield from entries
+
+    def _build_ydl_opts(self, url: str) -> Dict[str, Any]:
+        """构建扁平提取选项"""
+        from ...core.config import get_config
+
+        opts = {
+            'quiet': True,
+            'no_warnings': True,
+            'no_color': True,
+            'extract_flat': 'in_playlist',  # 只读取列表条目，不解析每个视频
+            'lazy_playlist': True,
+            'socket_timeout': 30,
+            'extractor_retries': 2,
+        }
+
+        proxy = get_config('downloader.proxy', None)
+        if proxy:
+            opts['proxy'] = proxy
+
+        try:
+            from ..cookies.manager import get_cookies_manager
+            cookies_file = get_cookies_manager().get_cookies_for_ytdlp(url)
+            if cookies_file:
+                opts['cookiefile'] = cookies_file
+        except Exception as e:
+            logger.warning(f"⚠️ 获取Cookies失败: {e}")
+
+        return opts
+
+    def _enqueue(self, url: str, options: Dict[str, Any], subscription_id: int) -> bool:
+        """为新视频创建下载任务"""
+        from ..downloader.api import get_unified_download_api
+
+        download_options = {
+            'source': 'subscription',
+            'quality': options.get('quality', 'medium'),
+            'audio_only': options.get('audio_only', False),
+            'telegram_push': options.get('telegram_push', False),
+            'subscription_id': subscription_id,
+        }
+        result = get_unified_download_api().create_download(url, download_options)
+        return result['success']
+
+    def _normalize_url(self, url: str) -> str:
+        """YouTube频道首页默认订阅视频标签页"""
+        import re
+
+        match = re.match(r'^(https?://(?:www\.|m\.)?youtube\.com/(?:@[^/?#]+|channel/[^/?#]+|c/[^/?#]+|user/[^/?#]+))/?$', url)
+        if match:
+            return f"{match.group(1)}/videos"
+        return url
+
+
+# 全局订阅管理器实例
+_subscription_manager = None
+
+def get_subscription_manager() -> SubscriptionManager:
+    """获取订阅管理器实例"""
+    global _subscription_manager
+    if _subscription_manager is None:
+        _subscription_manager = SubscriptionManager()
+    return _subscription_manager
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+订阅路由 - 频道/播放列表订阅管理接口
+"""
+
+import json
+import logging
+from flask import Blueprint, request, jsonify
+from ...core.auth import auth_required
+
+logger = logging.getLogger(__name__)
+
+subscriptions_bp = Blueprint('subscriptions', __name__)
+
+
+def _format_subscription(subscription):
+    """格式化订阅记录"""
+    try:
+        options = json.loads(subscription.get('options') or '{}')
+    except ValueError:
+        options = {}
+
+    return {
+        'id': subscription['id'],
+        'url': subscription['url'],
+        'title': subscription.get('title'),
+        'enabled': bool(subscription.get('enabled')),
+        'check_interval': subscription.get('check_interval'),
+        'options': options,
+        'last_checked_at': subscription.get('last_checked_at'),
+        'last_video_id': subscription.get('last_video_id'),
+        'last_error': subscription.get('last_error'),
+        'seeded_at': subscription.get('seeded_at'),
+        'created_at': subscription.get('created_at'),
+    }
+
+
+@subscriptions_bp.route('/list')
+@auth_required
+def list_subscriptions():
+    """获取订阅列表"""
+    try:
+        from ...core.database import get_database
+        subscriptions = get_database().get_subscriptions()
+
+        return jsonify({
+            'success': True,
+            'subscriptions': [_format_subscription(s) for s in subscriptions],
+            'total': len(subscriptions)
+        })
+
+    except Exception as e:
+        logger.error(f"❌ 获取订阅列表失败: {e}")
+        return jsonify({'error': '获取订阅列表失败'}), 500
+
+
+@subscriptions_bp.route('/add', methods=['POST'])
+@auth_required
+def add_subscription():
+    """添加订阅"""
+    try:
+        data = request.get_json()
+        if not data or not data.get('url', '').strip():
+            return jsonify({'error': '需要提供频道或播放列表URL'}), 400
+
+        from ..downloader.routes import _validate_url
+        url = data['url'].strip()
+        if not _validate_url(url):
+            return jsonify({'error': 'URL格式无效'}), 400
+
+        try:
+            backfill = int(data.get('backfill', 0) or 0)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'backfill必须是整数'}), 400
+        if backfill < 0:
+            return jsonify({'error': 'backfill不能为负数'}), 400
+
+        options = {
+            'quality': data.get('quality', 'medium'),
+            'audio_only': bool(data.get('audio_only', False)),
+            'telegram_push': bool(data.get('telegram_push', False)),
+            'backfill': backfill,
+        }
+
+        from .manager import get_subscription_manager
+        result = get_subscription_manager().add_subscription(url, options, data.get('check_interval'))
+
+        if not result['success']:
+            return jsonify({'error': result['error']}), 400
+
+        return jsonify({
+            'success': True,
+            'message': '订阅已添加',
+            'subscription': _format_subscription(result['subscription'])
+        })
+
+    except Exception as e:
+        logger.error(f"❌ 添加订阅失败: {e}")
+        return jsonify({'error': '添加订阅失败'}), 500
+
+
+@subscriptions_bp.route('/toggle/<int:subscription_id>', methods=['POST'])
+@auth_required
+def toggle_subscription(subscription_id):
+    """启用/停用订阅"""
+    try:
+        from ...core.database import get_database
+        db = get_database()
+
+        subscription = db.get_subscription(subscription_id)
+        if not subscription:
+            return jsonify({'error': '订阅不存在'}), 404
+
+        enabled = not bool(subscription.get('enabled'))
+        db.set_subscription_enabled(subscription_id, enabled)
+
+        return jsonify({'success': True, 'enabled': enabled})
+
+    except Exception as e:
+        logger.error(f"❌ 切换订阅状态失败: {e}")
+        return jsonify({'error': '操作失败'}), 500
+
+
+@subscriptions_bp.route('/check/<int:subscription_id>', methods=['POST'])
+@auth_required
+def check_subscription(subscription_id):
+    """立即检查订阅（后台执行，同一订阅正在检查时不重复提交）"""
+    try:
+        from .manager import get_subscription_manager
+        if not get_subscription_manager().check_now(subscription_id):
+            return jsonify({'error': '订阅不存在'}), 404
+
+        return jsonify({'success': True, 'message': '已开始检查，结果见订阅列表'}), 202
+
+    except Exception as e:
+        logger.error(f"❌ 检查订阅失败: {e}")
+        return jsonify({'error': '检查订阅失败'}), 500
+
+
+@subscriptions_bp.route('/delete/<int:subscription_id>', methods=['DELETE'])
+@auth_required
+def delete_subscription(subscription_id):
+    """删除订阅"""
+    try:
+        from ...core.database import get_database
+        db = get_database()
+
+        if not db.get_subscription(subscription_id):
+            return jsonify({'error': '订阅不存在'}), 404
+
+        db.delete_subscription(subscription_id)
+        return jsonify({'success': True, 'message': '订阅已删除'})
+
+    except Exception as e:
+        logger.error(f"❌ 删除订阅失败: {e}")
+        return jsonify({'error': '删除订阅失败'}), 500
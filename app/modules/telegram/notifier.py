@@ -20,7 +20,6 @@ class TelegramNotifier:
         self.config = None
         self.pyrogram_client = None
         self._lock = threading.RLock()
-        self._processed_downloads = set()  # 防重复推送
         self._load_config()
     
     def _load_config(self):
@@ -571,34 +570,23 @@ class TelegramNotifier:
         return file_path.suffix.lower() in video_extensions
 
     def _get_video_resolution(self, file_path: str) -> tuple:
-        """获取视频分辨率"""
+        """获取视频分辨率（来自媒体信息目录，每个文件只探测一次）"""
         try:
-            import subprocess
-            import json
-
-            # 使用ffprobe获取视频信息
-            cmd = [
-                'ffprobe', '-v', 'quiet', '-print_format', 'json',
-                '-show_streams', '-select_streams', 'v:0', file_path
-            ]
-
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
-            if result.returncode == 0:
-                data = json.loads(result.stdout)
-                if 'streams' in data and len(data['streams']) > 0:
-                    stream = data['streams'][0]
-                    width = stream.get('width', 1280)
-                    height = stream.get('height', 720)
-
-                    # 限制最大分辨率以适应Telegram
-                    if width > 1920:
-                        # 按比例缩放到1920p
-                        ratio = 1920 / width
-                        width = 1920
-                        height = int(height * ratio)
-
-                    logger.info(f"📐 检测到视频分辨率: {width}x{height}")
-                    return width, height
+            from ..files.catalog import get_media_catalog
+
+            entry = get_media_catalog().get(Path(file_path))
+            if entry and entry.get('width') and entry.get('height'):
+                width, height = entry['width'], entry['height']
+
+                # 限制最大分辨率以适应Telegram
+                if width > 1920:
+                    # 按比例缩放到1920p
+                    ratio = 1920 / width
+                    width = 1920
+                    height = int(height * ratio)
+
+                logger.info(f"📐 检测到视频分辨率: {width}x{height}")
+                return width, height
 
             # 如果获取失败，返回默认值
             logger.warning(f"⚠️ 无法获取视频分辨率，使用默认值: {file_path}")
@@ -679,10 +667,6 @@ class TelegramNotifier:
                 self.pyrogram_client = None
                 logger.info("✅ Pyrogram客户端已清理")
 
-            # 清理已处理下载记录
-            if hasattr(self, '_processed_downloads'):
-                self._processed_downloads.clear()
-
             logger.info("✅ Telegram通知器清理完成")
 
         except Exception as e:
@@ -700,106 +684,117 @@ def get_telegram_notifier() -> TelegramNotifier:
     return _telegram_notifier
 
 
-# 事件监听器 - 自动注册下载完成推送
-from ...core.events import on, Events
+# 发件箱投递处理器 - 下载完成/失败通知（至少一次投递，失败时由分发器重试）
+from ...core.events import Events
+from ...core.outbox import get_outbox_dispatcher
 
-@on(Events.DOWNLOAD_COMPLETED)
-def handle_download_completed(data):
-    """处理下载完成事件"""
-    try:
-        notifier = get_telegram_notifier()
-        if not notifier.is_enabled():
-            return
+outbox = get_outbox_dispatcher()
 
-        download_id = data.get('download_id')
-        title = data.get('title', 'Unknown')
-        file_size_mb = data.get('file_size', 0) / (1024 * 1024) if data.get('file_size') else 0
-        file_path = data.get('file_path')
 
-        # 防重复推送检查
-        if download_id in notifier._processed_downloads:
-            logger.debug(f"📤 跳过重复推送: {download_id} - {title}")
-            return
+def _already_delivered(idempotency_key) -> bool:
+    """此前的投递已成功（发送后、标记已投递前崩溃的消息会被重新领取）"""
+    if not idempotency_key:
+        return False
+    from ...core.database import get_database
+    return get_database().state_get('outbox_delivered', idempotency_key) is not None
 
-        notifier._processed_downloads.add(download_id)
 
-        # 获取配置
-        push_mode = notifier.config.get('push_mode', 'file')
-        file_size_limit = notifier.config.get('file_size_limit', 50)
+def _mark_delivered(idempotency_key):
+    """记录已成功发送的幂等键（与已投递消息保留同样天数）"""
+    if not idempotency_key:
+        return
+    from ...core.config import get_config
+    from ...core.database import get_database
+    ttl = get_config('outbox.retention_days', 7) * 86400
+    get_database().state_add('outbox_delivered', idempotency_key, ttl=ttl)
 
-        logger.info(f"📤 处理Telegram推送: {title} ({file_size_mb:.1f}MB)")
 
-        # 根据文件大小和配置决定推送方式
-        if push_mode == 'notification':
-            # 只发送通知，不发送文件
+@outbox.handler(Events.DOWNLOAD_COMPLETED)
+def handle_download_completed(data, idempotency_key=None):
+    """处理下载完成通知，返回 False 表示需要重试"""
+    notifier = get_telegram_notifier()
+    if not notifier.is_enabled():
+        return True
+    if _already_delivered(idempotency_key):
+        logger.info(f"📤 已推送过，跳过重复投递: {idempotency_key}")
+        return True
+
+    title = data.get('title', 'Unknown')
+    file_size_mb = data.get('file_size', 0) / (1024 * 1024) if data.get('file_size') else 0
+    file_path = data.get('file_path')
+
+    # 获取配置
+    push_mode = notifier.config.get('push_mode', 'file')
+    file_size_limit = notifier.config.get('file_size_limit', 50)
+
+    logger.info(f"📤 处理Telegram推送: {title} ({file_size_mb:.1f}MB) [{idempotency_key}]")
+
+    # 根据文件大小和配置决定推送方式
+    if push_mode == 'notification':
+        # 只发送通知，不发送文件
+        message = f"✅ **下载完成**\n\n📹 **标题**: {title}\n📁 **大小**: {file_size_mb:.1f}MB"
+        success = notifier.send_message(message)
+        logger.info(f"📤 发送通知消息: {title}")
+
+    elif file_size_mb <= file_size_limit:
+        # 小文件：直接发送文件（使用Bot API）
+        if file_path and push_mode in ['file', 'both']:
+            caption = f"📹 {title} ({file_size_mb:.1f}MB)"
+            success = notifier.send_file(file_path, caption)
+            if success:
+                logger.info(f"📤 发送小文件成功: {title}")
+            else:
+                # 文件发送失败，发送通知消息
+                message = f"✅ **下载完成**\n\n📹 **标题**: {title}\n📁 **大小**: {file_size_mb:.1f}MB\n\n⚠️ 文件发送失败，请手动下载"
+                success = notifier.send_message(message)
+                logger.warning(f"📤 文件发送失败，改为通知: {title}")
+        else:
+            # 配置为只发通知
             message = f"✅ **下载完成**\n\n📹 **标题**: {title}\n📁 **大小**: {file_size_mb:.1f}MB"
-            notifier.send_message(message)
+            success = notifier.send_message(message)
             logger.info(f"📤 发送通知消息: {title}")
 
-        elif file_size_mb <= file_size_limit:
-            # 小文件：直接发送文件（使用Bot API）
-            if file_path and push_mode in ['file', 'both']:
-                caption = f"📹 {title} ({file_size_mb:.1f}MB)"
-                success = notifier.send_file(file_path, caption)
-                if success:
-                    logger.info(f"📤 发送小文件成功: {title}")
-                else:
-                    # 文件发送失败，发送通知消息
-                    message = f"✅ **下载完成**\n\n📹 **标题**: {title}\n📁 **大小**: {file_size_mb:.1f}MB\n\n⚠️ 文件发送失败，请手动下载"
-                    notifier.send_message(message)
-                    logger.warning(f"📤 文件发送失败，改为通知: {title}")
+    else:
+        # 大文件：尝试使用Pyrogram发送，失败则发送通知
+        if file_path and push_mode in ['file', 'both'] and notifier.config.get('api_id') and notifier.config.get('api_hash'):
+            caption = f"📹 {title} ({file_size_mb:.1f}MB)"
+            success = notifier.send_file(file_path, caption)
+            if success:
+                logger.info(f"📤 发送大文件成功: {title}")
             else:
-                # 配置为只发通知
-                message = f"✅ **下载完成**\n\n📹 **标题**: {title}\n📁 **大小**: {file_size_mb:.1f}MB"
-                notifier.send_message(message)
-                logger.info(f"📤 发送通知消息: {title}")
-
+                # Pyrogram发送失败，发送通知消息
+                message = f"✅ **下载完成**\n\n📹 **标题**: {title}\n📁 **大小**: {file_size_mb:.1f}MB\n\n⚠️ 文件过大且Pyrogram配置有误，请手动下载"
+                success = notifier.send_message(message)
+                logger.warning(f"📤 大文件发送失败，改为通知: {title}")
         else:
-            # 大文件：尝试使用Pyrogram发送，失败则发送通知
-            if file_path and push_mode in ['file', 'both'] and notifier.config.get('api_id') and notifier.config.get('api_hash'):
-                caption = f"📹 {title} ({file_size_mb:.1f}MB)"
-                success = notifier.send_file(file_path, caption)
-                if success:
-                    logger.info(f"📤 发送大文件成功: {title}")
-                else:
-                    # Pyrogram发送失败，发送通知消息
-                    message = f"✅ **下载完成**\n\n📹 **标题**: {title}\n📁 **大小**: {file_size_mb:.1f}MB\n\n⚠️ 文件过大且Pyrogram配置有误，请手动下载"
-                    notifier.send_message(message)
-                    logger.warning(f"📤 大文件发送失败，改为通知: {title}")
-            else:
-                # 大文件但没有Pyrogram配置，只发送通知
-                message = f"✅ **下载完成**\n\n📹 **标题**: {title}\n📁 **大小**: {file_size_mb:.1f}MB\n\n💡 文件过大({file_size_mb:.1f}MB > {file_size_limit}MB)，请手动下载"
-                notifier.send_message(message)
-                logger.info(f"📤 大文件通知: {title}")
+            # 大文件但没有Pyrogram配置，只发送通知
+            message = f"✅ **下载完成**\n\n📹 **标题**: {title}\n📁 **大小**: {file_size_mb:.1f}MB\n\n💡 文件过大({file_size_mb:.1f}MB > {file_size_limit}MB)，请手动下载"
+            success = notifier.send_message(message)
+            logger.info(f"📤 大文件通知: {title}")
 
+    if success:
+        _mark_delivered(idempotency_key)
         logger.info(f"📤 Telegram推送完成: {title}")
+    return success
 
-        # 清理旧的下载ID（保留最近100个）
-        if len(notifier._processed_downloads) > 100:
-            # 转换为列表，保留最新的100个
-            recent_downloads = list(notifier._processed_downloads)[-100:]
-            notifier._processed_downloads = set(recent_downloads)
-            logger.debug(f"📤 清理旧下载ID，保留最近100个")
 
-    except Exception as e:
-        logger.error(f"❌ Telegram推送失败: {e}")
+@outbox.handler(Events.DOWNLOAD_FAILED)
+def handle_download_failed(data, idempotency_key=None):
+    """处理下载失败通知，返回 False 表示需要重试"""
+    notifier = get_telegram_notifier()
+    if not notifier.is_enabled():
+        return True
+    if _already_delivered(idempotency_key):
+        logger.info(f"📤 已推送过，跳过重复投递: {idempotency_key}")
+        return True
+
+    url = data.get('url', 'Unknown')
+    error = data.get('error', 'Unknown error')
 
+    message = f"❌ **下载失败**\n\n🔗 **链接**: {url}\n⚠️ **错误**: {error}"
+    success = notifier.send_message(message)
 
-@on(Events.DOWNLOAD_FAILED)
-def handle_download_failed(data):
-    """处理下载失败事件"""
-    try:
-        notifier = get_telegram_notifier()
-        if not notifier.is_enabled():
-            return
-        
-        url = data.get('url', 'Unknown')
-        error = data.get('error', 'Unknown error')
-        
-        message = f"❌ **下载失败**\n\n🔗 **链接**: {url}\n⚠️ **错误**: {error}"
-        notifier.send_message(message)
-        
+    if success:
+        _mark_delivered(idempotency_key)
         logger.info(f"📤 Telegram错误通知发送: {url}")
-        
-    except Exception as e:
-        logger.error(f"❌ Telegram错误通知失败: {e}")
+    return success
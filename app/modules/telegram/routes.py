@@ -38,6 +38,12 @@ def telegram_webhook():
             logger.error("无效的消息格式")
             return jsonify({'error': '无效的消息格式'}), 400
 
+        # Telegram 会重发未确认的更新（多进程部署时可能落到其他进程），按 update_id 去重
+        update_id = update.get('update_id')
+        if update_id is not None and not db.state_add('telegram_update', update_id, ttl=86400):
+            logger.info(f"跳过重复的Telegram更新: {update_id}")
+            return jsonify({'success': True, 'result': {'action': 'duplicate'}})
+
         # 处理消息
         result = _process_telegram_message(update, config)
         logger.info(f"消息处理结果: {result}")
@@ -168,8 +174,10 @@ def _handle_command(command, config):
 
                     if download_dir.exists():
                         try:
-                            download_disk_usage = sum(f.stat().st_size for f in download_dir.rglob('*') if f.is_file())
-                            download_file_count = len([f for f in download_dir.iterdir() if f.is_file()])
+                            from ..files.index import get_library_index
+                            index_stats = get_library_index().get_stats()
+                            download_disk_usage = index_stats['total_size']
+                            download_file_count = index_stats['files']
                         except:
                             pass
 
@@ -273,18 +281,10 @@ def _handle_command(command, config):
                 files_text = "📁 **文件列表**\n\n下载文件夹不存在"
             else:
                 try:
-                    files = []
-                    for file_path in download_dir.iterdir():
-                        if file_path.is_file():
-                            stat = file_path.stat()
-                            files.append({
-                                'name': file_path.name,
-                                'size': stat.st_size,
-                                'modified': stat.st_mtime
-                            })
+                    from ..files.index import get_library_index
+                    files = get_library_index().list_files()
 
                     # 按修改时间倒序排列，取最近5个
-                    files.sort(key=lambda x: x['modified'], reverse=True)
                     recent_files = files[:5]
 
                     if not recent_files:
@@ -565,20 +565,18 @@ def _analyze_available_qualities(formats):
 
 
 def _store_selection_state(chat_id, url, video_info, quality_options):
-    """存储选择状态（简单实现）"""
+    """存储选择状态（共享状态表，多进程部署时任意进程都能读取）"""
     try:
-        # 这里应该存储到数据库或缓存中
-        # 简单实现：存储到全局变量（实际项目中应该用Redis或数据库）
-        global _selection_states
-        if '_selection_states' not in globals():
-            _selection_states = {}
+        from ...core.config import get_config
+        from ...core.database import get_database
 
-        _selection_states[str(chat_id)] = {
+        get_database().state_set('telegram_selection', str(chat_id), {
             'url': url,
-            'video_info': video_info,
+            # 只保留后续用到的字段，避免存储完整的格式列表
+            'video_info': {key: video_info.get(key) for key in ('title', 'duration', 'uploader')},
             'quality_options': quality_options,
             'timestamp': __import__('time').time()
-        }
+        }, ttl=get_config('telegram.selection_timeout', 600))
 
     except Exception as e:
         logger.error(f"存储选择状态失败: {e}")
@@ -591,11 +589,10 @@ def _handle_quality_selection(selection, config, chat_id):
         notifier = get_telegram_notifier()
 
         # 获取存储的选择状态
-        global _selection_states
-        if '_selection_states' not in globals():
-            _selection_states = {}
+        from ...core.database import get_database
+        db = get_database()
 
-        state = _selection_states.get(str(chat_id))
+        state = db.state_get('telegram_selection', str(chat_id))
         if not state:
             notifier.send_message("❌ 选择已过期，请重新发送视频链接")
             return {'action': 'selection_expired'}
@@ -611,8 +608,9 @@ def _handle_quality_selection(selection, config, chat_id):
         url = state['url']
         video_info = state['video_info']
 
-        # 清除选择状态
-        del _selection_states[str(chat_id)]
+        # 清除选择状态（原子取出，重复投递的同一条选择消息只会触发一次下载）
+        if db.state_pop('telegram_selection', str(chat_id)) is None:
+            return {'action': 'selection_expired'}
 
         # 发送确认消息
         notifier.send_message(f"✅ 已选择: {selected_option['display']}\n⏳ 开始下载...")
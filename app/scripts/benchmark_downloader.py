@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+下载器基准测试 - 对比分段下载器与yt-dlp默认下载器
+
+用法: python -m app.scripts.benchmark_downloader --size-mb 64 --rate-kb 2048 --connections 8
+本地服务器对每个连接单独限速，用于模拟按连接限速的源站。
+"""
+
+import os
+import re
+import sys
+import time
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root))
+
+from app.modules.downloader.segmented import SegmentedDownloader
+
+
+class ThrottledRangeHandler(BaseHTTPRequestHandler):
+    """按连接限速的Range文件服务"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self._serve(head=True)
+
+    def do_GET(self):
+        self._serve(head=False)
+
+    def _serve(self, head: bool):
+        content = self.server.content
+        total = len(content)
+        start, end = 0, total - 1
+
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else total - 1
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{total}')
+        else:
+            self.send_response(200)
+
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        if head:
+            return
+
+        # 每个连接按固定速率发送
+        block = 64 * 1024
+        interval = block / self.server.rate
+        position = start
+        while position <= end:
+            chunk = content[position:min(position + block, end + 1)]
+            try:
+                self.wfile.write(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                return
+            position += len(chunk)
+            time.sleep(interval)
+
+
+def _start_server(size: int, rate: int) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ThrottledRangeHandler)
+    server.daemon_threads = True
+    server.content = os.urandom(size)
+    server.rate = rate
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _bench_segmented(url: str, workdir: Path, connections: int) -> float:
+    downloader = SegmentedDownloader(connections=connections, min_segment_size=256 * 1024)
+    started = time.time()
+    downloader.download(url, str(workdir / 'segmented.mp4'))
+    return time.time() - started
+
+
+def _bench_ytdlp(url: str, workdir: Path) -> float:
+    from yt_dlp import YoutubeDL
+
+    opts = {
+        'outtmpl': str(workdir / 'ytdlp.%(ext)s'),
+        'quiet': True,
+        'no_warnings': True,
+        'noprogress': True,
+    }
+    started = time.time()
+    with YoutubeDL(opts) as ydl:
+        ydl.download([url])
+    return time.time() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='分段下载器基准测试')
+    parser.add_argument('--size-mb', type=int, default=32, help='测试文件大小(MB)')
+    parser.add_argument('--rate-kb', type=int, default=2048, help='单连接限速(KB/s)')
+    parser.add_argument('--connections', type=int, default=8, help='分段下载连接数')
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    server = _start_server(size, args.rate_kb * 1024)
+    url = f'http://127.0.0.1:{server.server_address[1]}/bench.mp4'
+
+    print(f"📦 测试文件: {args.size_mb}MB, 单连接限速: {args.rate_kb}KB/s")
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            workdir = Path(tmp)
+            results = {}
+
+            try:
+                results['yt-dlp (单连接)'] = _bench_ytdlp(url, workdir)
+            except ImportError:
+                print("⚠️ 未安装yt-dlp，使用单连接分段下载器作为基线")
+                results['单连接基线'] = _bench_segmented(url, workdir, 1)
+
+            results[f'分段下载 ({args.connections}连接)'] = _bench_segmented(url, workdir, args.connections)
+
+            for name, elapsed in results.items():
+                speed = size / elapsed / 1024 / 1024
+                print(f"⏱️ {name}: {elapsed:.2f}s ({speed:.1f} MB/s)")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -47,6 +47,69 @@ class TestAPI:
         response = client.get("/api/download/list", headers=headers)
         assert response.status_code == 401
 
+    def test_events_refused_on_sync_workers(self, client):
+        """测试单线程预派生 worker 下拒绝SSE长连接，前端回退为轮询"""
+        from app.core.auth import auth_manager
+        from app.core.config import get_config, set_config
+
+        headers = {"Authorization": f"Bearer {auth_manager.generate_token({'id': 1, 'username': 'admin'})}"}
+        sync_worker = {'wsgi.multithread': False, 'wsgi.multiprocess': True}
+        response = client.get("/api/download/events", headers=headers, environ_overrides=sync_worker)
+        assert response.status_code == 503
+        assert response.get_json()['fallback'] == 'polling'
+
+        previous = get_config('live_updates.sse', 'auto')
+        set_config('live_updates.sse', False)
+        try:
+            response = client.get("/api/download/events", headers=headers,
+                                  environ_overrides={'wsgi.multithread': True})
+            assert response.status_code == 503
+        finally:
+            set_config('live_updates.sse', previous)
+
+
+class TestSignedUrls:
+    """签名地址测试"""
+
+    @pytest.fixture
+    def video(self, app, tmp_path):
+        from app.core.config import get_config, set_config
+        previous = get_config('downloader.output_dir')
+        set_config('downloader.output_dir', str(tmp_path))
+        path = tmp_path / 'clip.mp4'
+        path.write_bytes(b'0123456789' * 100)
+        yield path
+        set_config('downloader.output_dir', previous)
+
+    def test_signature_binds_scope_subject_and_expiry(self, app):
+        """测试签名只对同一作用域、对象且未过期时有效"""
+        from app.core.auth import sign_params, verify_signature
+
+        params = sign_params('file', 'clip.mp4', ttl=60)
+        assert verify_signature('file', 'clip.mp4', params['exp'], params['sig'])
+        assert not verify_signature('status', 'clip.mp4', params['exp'], params['sig'])
+        assert not verify_signature('file', 'other.mp4', params['exp'], params['sig'])
+        assert not verify_signature('file', 'clip.mp4', params['exp'] + 1, params['sig'])
+
+        expired = sign_params('file', 'clip.mp4', ttl=-1)
+        assert not verify_signature('file', 'clip.mp4', expired['exp'], expired['sig'])
+
+    def test_signed_file_access(self, client, video):
+        """测试文件地址凭签名访问（支持 Range），无签名或签名不符时拒绝"""
+        from app.core.auth import sign_url
+
+        assert client.get('/api/shortcuts/file/clip.mp4').status_code in (302, 401)
+
+        url = sign_url('/api/shortcuts/file/clip.mp4', 'file', 'clip.mp4')
+        response = client.get(url, headers={'Range': 'bytes=0-9'})
+        assert response.status_code == 206
+        assert response.data == b'0123456789'
+
+        other = sign_url('/files/stream/clip.mp4', 'file', 'other.mp4')
+        assert client.get(other).status_code == 403
+        assert client.get(sign_url('/files/stream/clip.mp4', 'file', 'clip.mp4')).status_code == 200
+        assert client.get(sign_url('/files/stream/clip.mp4', 'status', 'clip.mp4')).status_code == 403
+
 
 class TestPages:
     """页面测试"""
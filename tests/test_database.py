@@ -0,0 +1,845 @@
+# -*- coding: utf-8 -*-
+"""
+数据库测试 - 连接池与PRAGMA调优
+"""
+
+import threading
+
+import pytest
+
+from app.core.database import Database
+
+
+@pytest.fixture
+def db(tmp_path):
+    """临时数据库"""
+    database = Database(str(tmp_path / 'test.db'), pool_size=2)
+    yield database
+    database.close()
+
+
+class TestConnectionPool:
+    """连接池测试"""
+
+    def test_wal_and_pragmas(self, db):
+        """测试WAL模式与连接PRAGMA"""
+        with db.get_connection() as conn:
+            assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+            assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1  # NORMAL
+            assert conn.execute('PRAGMA temp_store').fetchone()[0] == 2  # MEMORY
+
+    def test_connection_reused(self, db):
+        """测试连接在调用之间复用"""
+        with db.get_connection() as first:
+            pass
+        with db.get_connection() as second:
+            pass
+        assert first is second
+
+    def test_nested_calls_share_connection(self, db):
+        """测试同一线程嵌套调用共享连接"""
+        with db.get_connection() as outer:
+            with db.get_connection() as inner:
+                assert inner is outer
+
+    def test_uncommitted_changes_rolled_back(self, db):
+        """测试未提交的修改在归还时回滚"""
+        with db.get_connection() as conn:
+            conn.execute("INSERT INTO settings (key, value) VALUES ('pending', '1')")
+
+        assert db.get_setting('pending') is None
+
+    def test_threads_use_separate_connections(self, db):
+        """测试并发线程各自持有连接"""
+        barrier = threading.Barrier(2)
+        seen = []
+
+        def worker():
+            with db.get_connection() as conn:
+                seen.append(id(conn))
+                barrier.wait(timeout=5)
+
+        threads = [threading.Thread(target=worker) for _ in range(2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert len(set(seen)) == 2
+
+
+class TestWriteBehindQueue:
+    """写后队列测试"""
+
+    def test_writes_grouped_into_batches(self, tmp_path):
+        """测试多次写入合并为少量批次提交"""
+        db = Database(str(tmp_path / 'test.db'), write_flush_interval=0.2)
+        try:
+            for i in range(50):
+                db.save_download_record(f'id-{i}', f'https://example.com/{i}')
+            assert db.flush_writes(timeout=5)
+
+            rows = db.execute_query('SELECT COUNT(*) AS total FROM downloads')
+            assert rows[0]['total'] == 50
+            stats = db.get_write_stats()
+            assert stats['committed'] == 50
+            assert stats['batches'] < 10
+        finally:
+            db.close()
+
+    def test_wait_returns_after_commit(self, db):
+        """测试等待写入时返回前已落盘，且保持提交顺序"""
+        db.save_download_record('abc', 'https://example.com/v')
+        db.update_download_status('abc', 'downloading', 40)
+        assert db.update_download_status('abc', 'completed', 100, '/tmp/v.mp4', 123, wait=True)
+
+        row = db.execute_query("SELECT * FROM downloads WHERE id = 'abc'")[0]
+        assert row['status'] == 'completed'
+        assert row['file_size'] == 123
+
+    def test_bad_write_does_not_drop_batch(self, db):
+        """测试单条失败语句不影响同批其他写入"""
+        db.submit_write('INSERT INTO missing_table VALUES (1)')
+        assert db.save_download_record('ok', 'https://example.com/ok', wait=True)
+        assert db.get_write_stats()['failed'] == 1
+
+    def test_disabled_writes_synchronously(self, tmp_path):
+        """测试禁用写后队列时同步写入"""
+        db = Database(str(tmp_path / 'test.db'), write_behind=False)
+        db.save_download_record('sync', 'https://example.com/s')
+        assert db.execute_query("SELECT id FROM downloads WHERE id = 'sync'")
+        assert db.get_write_stats() == {'enabled': False}
+        db.close()
+
+
+class TestMigrations:
+    """数据库迁移测试"""
+
+    def test_fresh_database_at_latest_version(self, db):
+        """测试新库执行全部迁移并建立索引"""
+        from app.core.migrations import MIGRATIONS
+
+        rows = db.execute_query('SELECT MAX(version) AS version FROM schema_version')
+        assert rows[0]['version'] == MIGRATIONS[-1][0]
+
+        indexes = {row['name'] for row in db.execute_query("PRAGMA index_list('downloads')")}
+        assert {'idx_downloads_status', 'idx_downloads_created_at',
+                'idx_downloads_file_path', 'idx_downloads_video'} <= indexes
+
+        plan = db.execute_query("EXPLAIN QUERY PLAN SELECT id FROM downloads WHERE status = 'pending'")
+        assert 'idx_downloads_status' in plan[0]['detail']
+
+    def test_upgrade_legacy_database(self, tmp_path):
+        """测试迁移框架引入前创建的旧库可以升级"""
+        import sqlite3
+
+        path = tmp_path / 'legacy.db'
+        conn = sqlite3.connect(path)
+        conn.execute('CREATE TABLE telegram_config (id INTEGER PRIMARY KEY, bot_token TEXT)')
+        conn.execute('CREATE TABLE downloads (id TEXT PRIMARY KEY, url TEXT NOT NULL, title TEXT, '
+                     'status TEXT, progress INTEGER, file_path TEXT, file_size INTEGER, '
+                     'error_message TEXT, created_at TIMESTAMP, completed_at TIMESTAMP)')
+        conn.execute("INSERT INTO downloads (id, url, status) VALUES ('old', 'https://example.com', 'completed')")
+        conn.commit()
+        conn.close()
+
+        db = Database(str(path))
+        try:
+            columns = {row['name'] for row in db.execute_query("PRAGMA table_info('telegram_config')")}
+            assert 'webhook_url' in columns
+
+            db.update_download_metadata('old', 'Title', extractor='Youtube', video_id='abc')
+            db.flush_writes()
+            row = db.execute_query("SELECT * FROM downloads WHERE id = 'old'")[0]
+            assert (row['title'], row['extractor'], row['video_id']) == ('Title', 'youtube', 'abc')
+        finally:
+            db.close()
+
+    def test_migrations_not_reapplied(self, db):
+        """测试重复打开数据库不会重复执行迁移"""
+        reopened = Database(str(db.db_path))
+        rows = reopened.execute_query('SELECT COUNT(*) AS total FROM schema_version')
+        reopened.close()
+
+        from app.core.migrations import MIGRATIONS
+        assert rows[0]['total'] == len(MIGRATIONS)
+
+    def test_concurrent_processes_on_fresh_database(self, tmp_path):
+        """测试多个进程同时打开新库时迁移只执行一次且都能启动"""
+        import subprocess
+        import sys
+        from pathlib import Path
+        from app.core.migrations import MIGRATIONS
+
+        root = Path(__file__).resolve().parent.parent
+        script = 'import sys; from app.core.database import Database; Database(sys.argv[1]).close()'
+        for attempt in range(3):
+            path = tmp_path / f'fresh-{attempt}.db'
+            procs = [subprocess.Popen([sys.executable, '-c', script, str(path)], cwd=root,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+                     for _ in range(4)]
+            for proc in procs:
+                _, stderr = proc.communicate(timeout=60)
+                assert proc.returncode == 0, stderr.decode(errors='replace')[-500:]
+
+            db = Database(str(path))
+            rows = db.execute_query('SELECT COUNT(*) AS total FROM schema_version')
+            users = db.execute_query('SELECT COUNT(*) AS total FROM users')
+            db.close()
+            assert rows[0]['total'] == len(MIGRATIONS)
+            assert users[0]['total'] == 1
+
+
+class TestDownloadHistory:
+    """下载历史分页测试"""
+
+    def _seed(self, db, count=25):
+        for i in range(count):
+            source = 'api' if i % 2 else 'web_interface'
+            host = 'https://www.youtube.com/watch?v=' if i % 3 else 'https://vimeo.com/'
+            db.save_download_record(f'id-{i:02d}', f'{host}{i}', source=source)
+            # 同一秒内创建的记录依靠id打破平局
+            db.submit_write('UPDATE downloads SET created_at = ? WHERE id = ?',
+                            (f'2024-01-{1 + i // 5:02d} 00:00:00', f'id-{i:02d}'))
+        db.flush_writes()
+
+    def test_keyset_pagination_covers_all(self, db):
+        """测试游标分页不重复、不遗漏"""
+        self._seed(db)
+        seen = []
+        cursor = None
+        while True:
+            page = db.get_download_history(limit=7, cursor=cursor)
+            seen.extend(item['id'] for item in page['items'])
+            if not page['has_more']:
+                break
+            cursor = page['next_cursor']
+
+        assert len(seen) == 25
+        assert len(set(seen)) == 25
+        assert seen[0] == 'id-24'
+        assert seen[-1] == 'id-00'
+
+    def test_filters(self, db):
+        """测试状态/来源/站点/日期过滤"""
+        self._seed(db)
+        db.update_download_status('id-03', 'completed', 100, '/tmp/a.mp4', 1, wait=True)
+
+        assert [i['id'] for i in db.get_download_history(statuses=['completed'])['items']] == ['id-03']
+        assert all(i['source'] == 'api' for i in db.get_download_history(source='api', limit=50)['items'])
+        assert all(i['host'] == 'vimeo.com' for i in db.get_download_history(host='vimeo.com', limit=50)['items'])
+
+        items = db.get_download_history(date_from='2024-01-02', date_to='2024-01-02', limit=50)['items']
+        assert sorted(i['id'] for i in items) == [f'id-{i:02d}' for i in range(5, 10)]
+
+    def test_invalid_cursor(self, db):
+        """测试无效游标"""
+        with pytest.raises(ValueError):
+            db.get_download_history(cursor='not-a-cursor')
+
+
+class TestDownloadSearch:
+    """全文搜索测试"""
+
+    def _add(self, db, download_id, url, title, uploader=None, tags=None):
+        db.save_download_record(download_id, url)
+        db.update_download_metadata(download_id, title, extractor='Youtube',
+                                    video_id=download_id, uploader=uploader, tags=tags)
+
+    def test_search_ranks_and_highlights(self, db):
+        """测试搜索排序与高亮片段"""
+        self._add(db, 'a', 'https://youtube.com/watch?v=a', 'Lofi beats to relax', tags=['music'])
+        self._add(db, 'b', 'https://youtube.com/watch?v=b', 'Cooking pasta', uploader='Lofi Kitchen')
+        self._add(db, 'c', 'https://vimeo.com/c', 'Unrelated')
+        db.flush_writes()
+
+        result = db.search_downloads('lofi')
+        ids = [item['id'] for item in result['items']]
+        assert ids == ['a', 'b']  # 标题命中权重高于上传者
+        assert '<mark>Lofi</mark>' in result['items'][0]['snippet']
+
+        assert [i['id'] for i in db.search_downloads('relax mus')['items']] == ['a']  # 前缀匹配
+
+    def test_search_cjk_fragment(self, db):
+        """测试中文片段搜索"""
+        self._add(db, 'zh', 'https://bilibili.com/video/1', '周末一起学做家常菜')
+        db.flush_writes()
+
+        result = db.search_downloads('家常')
+        assert [i['id'] for i in result['items']] == ['zh']
+        assert '<mark>家常</mark>' in result['items'][0]['snippet']
+        assert not db.search_downloads('常家')['items']
+
+    def test_index_follows_updates_and_deletes(self, db):
+        """测试索引随记录更新与删除同步"""
+        self._add(db, 'x', 'https://youtube.com/watch?v=x', 'Old title')
+        db.update_download_status('x', 'downloading', 50)
+        db.update_download_metadata('x', 'New title')
+        db.flush_writes()
+
+        assert not db.search_downloads('old')['items']
+        assert db.search_downloads('new')['items']
+
+        db.execute_update("DELETE FROM downloads WHERE id = 'x'")
+        assert not db.search_downloads('new')['items']
+
+    def test_search_escapes_html(self, db):
+        """测试片段中的HTML被转义"""
+        self._add(db, 'h', 'https://youtube.com/watch?v=h', '<script>alert(1)</script> clip')
+        db.flush_writes()
+
+        snippet = db.search_downloads('clip')['items'][0]['snippet']
+        assert '<script>' not in snippet
+        assert '&lt;script&gt;' in snippet
+
+    def test_external_writer_without_udf(self, db):
+        """测试未注册 fts_segment() 的写入方（如sqlite3命令行）也能写入，应用写入仍按中文分词"""
+        import sqlite3
+
+        conn = sqlite3.connect(db.db_path)
+        conn.execute("INSERT INTO downloads (id, url, title) VALUES ('ext', 'https://example.com/e', 'External clip')")
+        conn.execute("UPDATE downloads SET title = 'External movie' WHERE id = 'ext'")
+        conn.commit()
+        conn.close()
+        assert [i['id'] for i in db.search_downloads('movie')['items']] == ['ext']
+
+        self._add(db, 'zh', 'https://bilibili.com/video/2', '周末一起学做家常菜')
+        db.flush_writes()
+        assert [i['id'] for i in db.search_downloads('家常')['items']] == ['zh']
+
+    def test_search_without_fts_falls_back_to_like(self, db):
+        """测试缺少全文索引表时回退为LIKE搜索"""
+        with db.get_connection() as conn:
+            for trigger in ('downloads_fts_insert', 'downloads_fts_update', 'downloads_fts_delete'):
+                conn.execute(f'DROP TRIGGER {trigger}')
+            conn.execute('DROP TABLE downloads_fts')
+            conn.commit()
+        self._add(db, 'a', 'https://youtube.com/watch?v=a', 'Lofi <beats> 100%')
+        self._add(db, 'b', 'https://youtube.com/watch?v=b', 'Cooking', uploader='lofi kitchen')
+        self._add(db, 'c', 'https://vimeo.com/c', '周末家常菜')
+        db.flush_writes()
+
+        assert {i['id'] for i in db.search_downloads('LOFI')['items']} == {'a', 'b'}
+        assert [i['id'] for i in db.search_downloads('lofi beats')['items']] == ['a']
+        assert [i['id'] for i in db.search_downloads('家常')['items']] == ['c']
+        assert not db.search_downloads('0%0')['items']  # 通配符按字面匹配
+        snippet = db.search_downloads('beats')['items'][0]['snippet']
+        assert snippet == 'Lofi &lt;<mark>beats</mark>&gt; 100%'
+        assert db.search_downloads('cooking')['items'][0]['rank'] == 0.0
+
+
+class TestDownloadStats:
+    """统计汇总测试"""
+
+    def test_rollups_and_undo(self, db):
+        """测试汇总累加与撤销"""
+        from datetime import datetime
+
+        at = datetime(2024, 5, 1, 10, 30)
+        db.record_download_outcome('completed', host='youtube.com', source='api',
+                                   file_size=1000, duration=10, finished_at=at)
+        db.record_download_outcome('completed', host='youtube.com', source='web_interface',
+                                   file_size=500, duration=20, finished_at=at)
+        db.record_download_outcome('failed', host='youtube.com', source='api', finished_at=at)
+        db.record_download_outcome('failed', host='vimeo.com', source='api', finished_at=at)
+        db.record_download_outcome('failed', host='vimeo.com', source='api', finished_at=at, delta=-1)
+        db.flush_writes()
+
+        stats = db.get_download_stats('hourly')
+        assert [(r['key'], r['total']) for r in stats['series']] == [('2024-05-01 10:00', 3)]
+
+        hosts = {r['key']: r for r in stats['by_host']}
+        assert hosts['youtube.com']['bytes'] == 1500
+        assert hosts['youtube.com']['success_rate'] == round(2 / 3, 4)
+        assert hosts['youtube.com']['avg_duration'] == 15
+        assert hosts['vimeo.com']['total'] == 0
+
+        counts = db.get_download_status_counts()
+        assert (counts['completed'], counts['failed']) == (2, 1)
+
+    def test_status_counts_include_active(self, db):
+        """测试状态统计包含进行中的记录"""
+        db.save_download_record('p1', 'https://example.com/1')
+        db.save_download_record('p2', 'https://example.com/2')
+        db.record_download_outcome('completed', host='example.com')
+        db.flush_writes()
+
+        counts = db.get_download_status_counts()
+        assert counts['pending'] == 2
+        assert counts['completed'] == 1
+
+    def test_migration_backfills_rollups(self, tmp_path):
+        """测试迁移用已有记录回填汇总"""
+        import sqlite3
+        from app.core.migrations import MIGRATIONS, apply_migrations
+        from app.core.search import segment_text
+
+        conn = sqlite3.connect(tmp_path / 'old.db')
+        conn.create_function('fts_segment', 1, segment_text, deterministic=True)
+        apply_migrations(conn, [m for m in MIGRATIONS if m[0] < 7])
+        conn.execute("""INSERT INTO downloads (id, url, status, host, file_size, created_at, completed_at)
+                        VALUES ('a', 'u', 'completed', 'youtube.com', 42,
+                                '2024-01-01 00:00:00', '2024-01-01 00:01:00')""")
+        conn.commit()
+        apply_migrations(conn)
+        row = conn.execute('SELECT bucket, count, bytes, duration FROM download_stats_daily').fetchone()
+        conn.close()
+
+        assert row[0] == '2024-01-01'
+        assert row[1:3] == (1, 42)
+        assert abs(row[3] - 60) < 0.01
+
+
+class TestStatusCounters:
+    """下载管理器增量计数测试"""
+
+    def test_transitions_update_counts_and_rollups(self, db, monkeypatch):
+        """测试状态变化维护计数，失败后重试成功不重复统计"""
+        import threading
+        from datetime import datetime
+        from app.core import database as database_module
+        from app.modules.downloader.manager import DownloadManager
+
+        monkeypatch.setattr(database_module, '_db_instance', db)
+        manager = DownloadManager.__new__(DownloadManager)
+        manager.downloads = {}
+        manager.lock = threading.RLock()
+        manager._outcomes = {}
+        manager._coordinating = True
+        manager.downloads['d1'] = {
+            'id': 'd1', 'url': 'https://www.youtube.com/watch?v=1', 'status': 'pending',
+            'progress': 0, 'created_at': datetime.now(), 'options': {'source': 'api'},
+        }
+
+        manager._update_download_status('d1', 'downloading', 10)
+        manager._update_download_status('d1', 'failed', error_message='boom')
+        db.flush_writes()
+        assert manager.get_status_counts()['failed'] == 1
+
+        manager._update_download_status('d1', 'retrying')
+        manager._update_download_status('d1', 'completed', 100, '/tmp/x.mp4', 2048)
+        db.flush_writes()
+
+        counts = manager.get_status_counts()
+        assert counts['completed'] == 1
+        assert counts['failed'] == 0
+        assert counts['total'] == 1
+
+        hosts = {r['key']: r for r in db.get_download_stats()['by_host']}
+        assert hosts['youtube.com']['completed'] == 1
+        assert hosts['youtube.com']['failed'] == 0
+        assert hosts['youtube.com']['bytes'] == 2048
+
+    def test_demoted_or_reclaimed_jobs_not_executed(self, db, monkeypatch):
+        """测试失去协调者身份后、或任务已被新协调进程处理时，排队中的任务不再执行"""
+        import threading
+        from datetime import datetime
+        from app.core import database as database_module
+        from app.modules.downloader.manager import DownloadManager
+
+        monkeypatch.setattr(database_module, '_db_instance', db)
+        manager = DownloadManager.__new__(DownloadManager)
+        manager.downloads = {}
+        manager.lock = threading.RLock()
+        manager._outcomes = {}
+        manager._coordinating = True
+        extracted = []
+        monkeypatch.setattr(manager, '_extract_video_info', lambda url: extracted.append(url))
+        monkeypatch.setattr(manager, '_handle_download_failure', lambda *args: None)
+        for download_id in ('d1', 'd2', 'd3'):
+            db.save_download_record(download_id, f'https://example.com/{download_id}', options={})
+            manager.downloads[download_id] = {
+                'id': download_id, 'url': f'https://example.com/{download_id}', 'status': 'pending',
+                'progress': 0, 'created_at': datetime.now(), 'options': {},
+            }
+
+        # 新的协调进程已把 d1 标记为失败：条件领取失败
+        db.update_download_status('d1', 'failed', wait=True)
+        manager._execute_download('d1')
+        assert extracted == [] and 'd1' not in manager.downloads
+
+        manager._execute_download('d2')
+        assert extracted == ['https://example.com/d2']
+        assert db.get_download_record('d2')['status'] == 'downloading'
+        assert not db.claim_download('d2')
+
+        # 失去协调者身份：线程池中剩余的任务直接放弃
+        manager._coordinating = False
+        manager._execute_download('d3')
+        assert extracted == ['https://example.com/d2'] and 'd3' not in manager.downloads
+        assert db.get_download_record('d3')['status'] == 'pending'
+
+
+class TestSettingsCache:
+    """设置缓存与API密钥测试"""
+
+    def test_settings_cached_and_invalidated(self, db):
+        """测试设置只加载一次（检查间隔内不查询数据库），写入后立即可见"""
+        db.set_setting('a', '1')
+        assert db.get_setting('a') == '1'
+        db.get_telegram_config()
+
+        queries = []
+        db_execute_query = db.execute_query
+        db.execute_query = lambda *args: queries.append(args[0]) or db_execute_query(*args)
+        for _ in range(5):
+            db.get_setting('a')
+            db.verify_api_key('missing-key-0123456789')
+            db.get_telegram_config()
+        assert queries == []
+
+        db.set_setting('a', '2')
+        assert db.get_setting('a') == '2'
+        db.delete_setting('a')
+        assert db.get_setting('a', 'gone') == 'gone'
+
+    def test_telegram_config_cache(self, db):
+        """测试Telegram配置缓存在保存后失效"""
+        assert db.get_telegram_config() is None
+        db.save_telegram_config({'bot_token': 't1', 'chat_id': '1'})
+        assert db.get_telegram_config()['bot_token'] == 't1'
+
+        config = db.get_telegram_config()
+        config['bot_token'] = 'mutated'
+        assert db.get_telegram_config()['bot_token'] == 't1'
+
+        db.save_telegram_config({'bot_token': 't2', 'chat_id': '1'})
+        assert db.get_telegram_config()['bot_token'] == 't2'
+
+    def test_changes_from_other_process_visible(self, db):
+        """测试其他进程（另一个数据库实例）修改设置后，检查间隔结束时缓存失效"""
+        db.add_api_key('shared-key-0123456789')
+        db.save_telegram_config({'bot_token': 't1', 'chat_id': '1'})
+        other = Database(str(db.db_path), pool_size=1, settings_check_interval=60)
+        try:
+            assert other.verify_api_key('shared-key-0123456789')
+            assert other.get_telegram_config()['bot_token'] == 't1'
+
+            assert db.delete_api_key()
+            db.save_telegram_config({'bot_token': 't2', 'chat_id': '1'})
+            assert other.verify_api_key('shared-key-0123456789')  # 间隔内仍使用缓存
+
+            other._settings_checked_at -= 60
+            assert not other.verify_api_key('shared-key-0123456789')
+            assert other.get_telegram_config()['bot_token'] == 't2'
+        finally:
+            other.close()
+
+    def test_multiple_hashed_api_keys(self, db):
+        """测试多个API密钥哈希存储与吊销"""
+        first = db.add_api_key('first-key-0123456789')
+        db.add_api_key('second-key-0123456789', name='iPhone')
+
+        assert db.verify_api_key('first-key-0123456789')
+        assert db.verify_api_key('second-key-0123456789')
+        assert not db.verify_api_key('first-key-012345678')
+        assert 'first-key' not in db.get_setting('api_keys')
+
+        assert db.delete_api_key(first['id'])
+        assert not db.verify_api_key('first-key-0123456789')
+        assert db.verify_api_key('second-key-0123456789')
+
+        db.add_api_key('third-key-0123456789', replace=True)
+        assert [k['prefix'] for k in db.get_api_keys()] == ['third-']
+
+    def test_legacy_plaintext_key_migrated(self, tmp_path):
+        """测试旧版明文API密钥迁移为哈希"""
+        import sqlite3
+
+        path = tmp_path / 'legacy.db'
+        conn = sqlite3.connect(path)
+        conn.execute('CREATE TABLE settings (key TEXT PRIMARY KEY, value TEXT, updated_at TIMESTAMP)')
+        conn.execute("INSERT INTO settings (key, value) VALUES ('api_key', 'legacy-plaintext-key')")
+        conn.commit()
+        conn.close()
+
+        db = Database(str(path))
+        try:
+            assert db.get_setting('api_key') is None
+            assert db.verify_api_key('legacy-plaintext-key')
+        finally:
+            db.close()
+
+
+class TestHistoryMaintenance:
+    """下载历史归档与空闲整理测试"""
+
+    def _seed(self, db):
+        for i in range(6):
+            db.save_download_record(f'old-{i}', f'https://example.com/{i}', title=f'old video {i}')
+            db.submit_write("UPDATE downloads SET status = ?, error_message = ?, created_at = '2020-01-01 00:00:00' "
+                            "WHERE id = ?", ('failed' if i % 2 else 'completed', 'x' * 1000, f'old-{i}'))
+        db.save_download_record('old-active', 'https://example.com/active')
+        db.submit_write("UPDATE downloads SET created_at = '2020-01-01 00:00:00' WHERE id = 'old-active'")
+        db.save_download_record('new-0', 'https://example.com/new', title='new video')
+        db.flush_writes()
+
+    def test_archive_to_table(self, db):
+        """测试过期已结束记录移入归档表，进行中的记录保留"""
+        self._seed(db)
+        assert db.archive_old_downloads('2021-01-01 00:00:00', batch_size=4) == 6
+
+        remaining = {row['id'] for row in db.execute_query('SELECT id FROM downloads')}
+        assert remaining == {'old-active', 'new-0'}
+
+        archived = db.execute_query('SELECT * FROM downloads_archive ORDER BY id')
+        assert len(archived) == 6
+        assert all(len(row['error_message']) == 200 for row in archived)
+        assert db.search_downloads('old')['items'] == []
+
+    def test_archive_to_ndjson(self, db, tmp_path):
+        """测试导出为压缩NDJSON文件"""
+        import gzip
+        import json
+        from app.modules.downloader.maintenance import NdjsonArchiveExporter
+
+        self._seed(db)
+        path = tmp_path / 'archive' / 'downloads.ndjson.gz'
+        assert db.archive_old_downloads('2021-01-01 00:00:00', batch_size=4,
+                                        exporter=NdjsonArchiveExporter(path)) == 6
+
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f]
+        assert sorted(row['id'] for row in rows) == [f'old-{i}' for i in range(6)]
+        assert db.execute_query('SELECT COUNT(*) AS n FROM downloads_archive')[0]['n'] == 0
+
+    def test_idle_maintenance(self, tmp_path):
+        """测试空闲维护不做完整VACUUM，显式切换为增量回收后回收空闲页"""
+        import sqlite3
+
+        path = tmp_path / 'legacy.db'
+        sqlite3.connect(path).close()
+
+        db = Database(str(path))
+        try:
+            with db.get_connection() as conn:
+                conn.execute('PRAGMA auto_vacuum=NONE')
+                conn.execute('VACUUM')
+            assert db.run_idle_maintenance()['incremental'] is False
+            with db.get_connection() as conn:
+                assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 0
+
+            assert db.enable_incremental_vacuum() is True
+            assert db.enable_incremental_vacuum() is False
+
+            db.execute_update('CREATE TABLE filler (data BLOB)')
+            for _ in range(50):
+                db.execute_update('INSERT INTO filler VALUES (?)', (b'x' * 4096,))
+            db.execute_update('DELETE FROM filler')
+
+            result = db.run_idle_maintenance(vacuum_pages=1000)
+            assert result['incremental'] is True
+            assert result['freed_pages'] > 0
+        finally:
+            db.close()
+
+
+class TestOutbox:
+    """事务性发件箱测试"""
+
+    def _complete(self, db, download_id='dl-1'):
+        db.save_download_record(download_id, 'https://example.com/v', wait=True)
+        return db.update_download_status(download_id, 'completed', 100, '/tmp/v.mp4', 10, wait=True, outbox={
+            'event': 'download.completed',
+            'key': f'download.completed:{download_id}',
+            'payload': {'download_id': download_id, 'title': 'video'},
+        })
+
+    def test_written_with_status_and_deduplicated(self, db):
+        """测试发件箱消息与状态同事务写入，幂等键去重"""
+        assert self._complete(db)
+        assert self._complete(db)
+
+        rows = db.execute_query('SELECT * FROM outbox')
+        assert len(rows) == 1
+        assert rows[0]['status'] == 'pending'
+        assert db.execute_query("SELECT status FROM downloads WHERE id = 'dl-1'")[0]['status'] == 'completed'
+
+    def test_failed_statement_rolls_back_outbox(self, db):
+        """测试原子单元中任一语句失败时整体回滚"""
+        assert not db.submit_write([
+            ("INSERT INTO outbox (event, idempotency_key, payload) VALUES ('e', 'k', '{}')", ()),
+            ('INSERT INTO missing_table VALUES (1)', ()),
+        ], wait=True)
+        assert db.execute_query('SELECT * FROM outbox') == []
+
+    def test_dispatch_retry_and_deliver(self, db):
+        """测试投递失败后退避重试，成功后标记已投递"""
+        from app.core.outbox import OutboxDispatcher
+
+        self._complete(db)
+        calls = []
+
+        def failing(payload, key):
+            calls.append(key)
+            return False
+
+        dispatcher = OutboxDispatcher()
+        dispatcher.register_handler('download.completed', failing)
+
+        assert dispatcher.run_once(db) == 1
+        row = db.execute_query('SELECT * FROM outbox')[0]
+        assert row['status'] == 'pending'
+        assert row['attempts'] == 1
+        assert row['last_error']
+        assert dispatcher.run_once(db) == 0  # 退避期间不会再次领取
+
+        db.execute_update("UPDATE outbox SET next_attempt_at = datetime('now', '-1 seconds')")
+        dispatcher._handlers['download.completed'] = [lambda payload, key: calls.append(key)]
+        assert dispatcher.run_once(db) == 1
+
+        assert calls == ['download.completed:dl-1', 'download.completed:dl-1']
+        assert db.get_outbox_stats() == {'delivered': 1}
+
+    def test_expired_lease_is_reclaimed(self, db):
+        """测试投递中崩溃（租约过期）的消息会被重新领取"""
+        self._complete(db)
+        assert len(db.claim_outbox_messages(['download.completed'], lease_seconds=600)) == 1
+        assert db.claim_outbox_messages(['download.completed']) == []
+
+        db.execute_update("UPDATE outbox SET locked_until = datetime('now', '-1 seconds')")
+        reclaimed = db.claim_outbox_messages(['download.completed'])
+        assert len(reclaimed) == 1
+        assert reclaimed[0]['attempts'] == 2
+
+    def test_claims_one_message_at_a_time(self, db):
+        """测试消息逐条领取，投递中续租的消息不会被重新领取"""
+        from app.core.outbox import OutboxDispatcher
+
+        self._complete(db, 'dl-1')
+        self._complete(db, 'dl-2')
+        seen = []
+
+        dispatcher = OutboxDispatcher()
+        dispatcher.register_handler('download.completed', lambda payload, key: seen.append(db.get_outbox_stats()))
+        assert dispatcher.run_once(db) == 2
+        assert seen == [{'processing': 1, 'pending': 1}, {'processing': 1, 'delivered': 1}]
+
+        self._complete(db, 'dl-3')
+        message = db.claim_outbox_messages(['download.completed'], lease_seconds=1)[0]
+        db.execute_update("UPDATE outbox SET locked_until = datetime('now', '-1 seconds')")
+        assert db.renew_outbox_lease(message['id'], 600)
+        assert db.claim_outbox_messages(['download.completed']) == []
+
+
+class TestSharedState:
+    """多进程共享状态与协调租约测试"""
+
+    def test_state_roundtrip_and_pop_once(self, db):
+        """测试共享状态读写，取出后其他进程无法再次取出"""
+        db.state_set('telegram_selection', 42, {'url': 'https://example.com/v'}, ttl=600)
+        assert db.state_get('telegram_selection', '42') == {'url': 'https://example.com/v'}
+
+        assert db.state_pop('telegram_selection', 42) == {'url': 'https://example.com/v'}
+        assert db.state_pop('telegram_selection', 42) is None
+        assert db.state_get('telegram_selection', 42, 'missing') == 'missing'
+
+    def test_dedupe_set_and_expiry(self, db):
+        """测试去重集合只接受首次加入，过期后可重新加入并被清理"""
+        assert db.state_add('telegram_update', 1001, ttl=60)
+        assert not db.state_add('telegram_update', 1001, ttl=60)
+        assert db.state_keys('telegram_update') == ['1001']
+
+        db.execute_update("UPDATE shared_state SET expires_at = datetime('now', '-1 seconds')")
+        assert db.state_keys('telegram_update') == []
+        assert db.state_add('telegram_update', 1001, ttl=60)
+
+        db.execute_update("UPDATE shared_state SET expires_at = datetime('now', '-1 seconds')")
+        db.purge_expired_state()
+        assert db.execute_query('SELECT * FROM shared_state') == []
+
+    def test_lease_exclusive_until_expired(self, db):
+        """测试租约同一时间只有一个持有者，过期或释放后可被接管"""
+        assert db.acquire_lease('coordinator', 'worker-a', 15)
+        assert not db.acquire_lease('coordinator', 'worker-b', 15)
+        assert db.acquire_lease('coordinator', 'worker-a', 15)  # 续期
+        assert db.get_lease('coordinator')['owner'] == 'worker-a'
+
+        db.execute_update("UPDATE leases SET expires_at = datetime('now', '-1 seconds')")
+        assert db.get_lease('coordinator') is None
+        assert db.acquire_lease('coordinator', 'worker-b', 15)
+
+        db.release_lease('coordinator', 'worker-a')  # 非持有者释放无效
+        assert db.get_lease('coordinator')['owner'] == 'worker-b'
+        assert db.release_lease('coordinator', 'worker-b')
+        assert db.acquire_lease('coordinator', 'worker-a', 15)
+
+    def test_leader_survives_transient_renewal_error(self, db, monkeypatch):
+        """测试续期偶发出错时租约仍有效则保持协调者身份，接近过期才放弃"""
+        import sqlite3
+        from app.core import database as database_module
+        from app.core.coordinator import Coordinator
+
+        monkeypatch.setattr(database_module, '_db_instance', db)
+        coordinator = Coordinator()
+        demoted = []
+        coordinator.add_listener(on_demoted=lambda: demoted.append(True))
+        assert coordinator._campaign()
+        assert coordinator.is_leader
+
+        def locked(*args):
+            raise sqlite3.OperationalError('database is locked')
+
+        monkeypatch.setattr(db, 'acquire_lease', locked)
+        assert not coordinator._campaign()
+        assert coordinator.is_leader and demoted == []
+
+        coordinator._renewed_at -= 13  # 距上次成功续期超过 lease_seconds - safety_margin
+        assert not coordinator._campaign()
+        assert not coordinator.is_leader and demoted == [True]
+
+    def test_follower_queues_and_coordinator_adopts(self, db, monkeypatch):
+        """测试非协调进程只写入排队任务，协调进程领取执行"""
+        from app.core import database as database_module
+        from app.modules.downloader.manager import DownloadManager
+
+        monkeypatch.setattr(database_module, '_db_instance', db)
+
+        class Executor:
+            def __init__(self):
+                self.submitted = []
+
+            def submit(self, fn, *args):
+                self.submitted.append(args)
+
+        def make_manager(coordinating):
+            manager = DownloadManager.__new__(DownloadManager)
+            manager.downloads = {}
+            manager.lock = threading.RLock()
+            manager._outcomes = {}
+            manager._coordinating = coordinating
+            manager.executor = Executor()
+            return manager
+
+        follower = make_manager(False)
+        download_id = follower.create_download('https://example.com/v', {'source': 'api', 'quality': '720'})
+        assert follower.downloads == {}
+        assert follower.executor.submitted == []
+        assert follower.get_download(download_id)['status'] == 'pending'
+
+        leader = make_manager(True)
+        leader._adopt_queued_downloads()
+        assert leader.executor.submitted == [(download_id,)]
+        assert leader.downloads[download_id]['options'] == {'source': 'api', 'quality': '720'}
+        assert leader.get_status_counts()['pending'] == 1
+        assert leader.get_status_counts() == follower.get_status_counts()
+
+        assert follower.cancel_download(download_id)
+        assert db.state_keys('download_cancel') == [download_id]
+
+        # 历史页合并实时状态只读内存，非协调进程不逐条回查数据库
+        queries = []
+        db_execute_query = db.execute_query
+        db.execute_query = lambda *args: queries.append(args[0]) or db_execute_query(*args)
+        assert follower.get_live_downloads([download_id, 'missing']) == {}
+        assert list(leader.get_live_downloads([download_id, 'missing'])) == [download_id]
+        assert queries == []
+        del db.execute_query
+
+        # 状态统计不随处理请求的进程变化
+        leader._update_download_status(download_id, 'downloading', 10)
+        leader._update_download_status(download_id, 'completed', 100, '/tmp/v.mp4', 1024)
+        db.flush_writes()
+        counts = leader.get_status_counts()
+        assert counts == follower.get_status_counts()
+        assert (counts['completed'], counts['total']) == (1, 1)
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+事件总线测试
+"""
+
+import threading
+import time
+
+import pytest
+
+from app.core.events import event_bus
+
+
+@pytest.fixture
+def bus():
+    """测试结束后恢复全局事件总线的监听器与分组"""
+    listeners = {name: list(callbacks) for name, callbacks in event_bus._listeners.items()}
+    listener_groups = dict(event_bus._listener_groups)
+    groups = dict(event_bus._groups)
+    yield event_bus
+    for name, group in list(event_bus._groups.items()):
+        if groups.get(name) is not group:
+            group.stop()
+    event_bus._listeners = listeners
+    event_bus._listener_groups = listener_groups
+    event_bus._groups = groups
+
+
+class TestEventBus:
+    """异步分发与背压测试"""
+
+    def test_slow_listener_does_not_block_emitter(self, bus):
+        """测试慢速监听器不阻塞发送方，也不影响其他分组"""
+        release = threading.Event()
+        fast_done = threading.Event()
+
+        bus.configure_group('test-slow', workers=1)
+        bus.add_listener('test.event', lambda data: release.wait(5), group='test-slow')
+        bus.add_listener('test.event', lambda data: fast_done.set(), group='test-fast')
+
+        started = time.monotonic()
+        bus.emit('test.event', {'n': 1})
+        assert time.monotonic() - started < 0.5
+        assert fast_done.wait(2)
+
+        release.set()
+        assert bus.flush(5)
+
+    def test_overflow_drop_newest(self, bus):
+        """测试队列满时丢弃新事件并计数"""
+        release = threading.Event()
+        received = []
+
+        def listener(data):
+            release.wait(5)
+            received.append(data)
+
+        bus.configure_group('test-drop', workers=1, queue_size=2, overflow='drop_newest')
+        bus.add_listener('test.drop', listener, group='test-drop')
+
+        for i in range(10):
+            bus.emit('test.drop', i)
+        release.set()
+        assert bus.flush(5)
+
+        stats = bus.get_stats()['groups']['test-drop']
+        assert stats['dropped'] == 10 - len(received)
+        assert 0 < len(received) <= 3
+        assert received[0] == 0
+
+    def test_overflow_caller_runs(self, bus):
+        """测试 caller_runs 策略在发送方线程执行"""
+        release = threading.Event()
+        threads = []
+
+        def listener(data):
+            threads.append(threading.current_thread())
+            if data == 0:
+                release.wait(5)
+
+        bus.configure_group('test-caller', workers=1, queue_size=1, overflow='caller_runs')
+        bus.add_listener('test.caller', listener, group='test-caller')
+
+        bus.emit('test.caller', 0)   # 工作线程处理中
+        time.sleep(0.1)
+        bus.emit('test.caller', 1)   # 入队
+        bus.emit('test.caller', 2)   # 队列已满，在当前线程执行
+        release.set()
+        assert bus.flush(5)
+
+        assert threading.current_thread() in threads
+        assert bus.get_stats()['groups']['test-caller']['caller_runs'] == 1
+
+    def test_listener_metrics(self, bus):
+        """测试监听器耗时与错误统计"""
+        def failing(data):
+            raise RuntimeError('boom')
+
+        bus.add_listener('test.metrics', failing, group='test-metrics')
+        bus.emit('test.metrics', {})
+        bus.emit('test.metrics', {})
+        assert bus.flush(5)
+
+        metrics = bus.get_stats()['listeners']['test.metrics->failing']
+        assert metrics['calls'] == 2
+        assert metrics['errors'] == 2
+        assert metrics['max_ms'] >= metrics['avg_ms'] >= 0
+
+    def test_coalescing_latest_value_wins(self, bus):
+        """测试合并主题：监听器落后时每个键只收到最新事件"""
+        release = threading.Event()
+        received = []
+
+        def listener(data):
+            if data['download_id'] == 'blocker':
+                release.wait(5)
+            received.append((data['download_id'], data['progress']))
+
+        bus.set_coalescing('test.progress', 'download_id')
+        bus.configure_group('test-progress', workers=1)
+        bus.add_listener('test.progress', listener, group='test-progress')
+
+        bus.emit('test.progress', {'download_id': 'blocker', 'progress': 0})
+        time.sleep(0.1)
+        for progress in range(100):
+            bus.emit('test.progress', {'download_id': 'a', 'progress': progress})
+            bus.emit('test.progress', {'download_id': 'b', 'progress': progress * 2})
+        release.set()
+        assert bus.flush(5)
+        bus.set_coalescing('test.progress', None)
+
+        assert received == [('blocker', 0), ('a', 99), ('b', 198)]
+        assert bus.get_stats()['groups']['test-progress']['coalesced'] == 198
+        assert bus.get_stats()['events']['test.progress'] == {'emitted': 201, 'coalesced': 198}
+
+
+class TestDownloadEventStream:
+    """下载实时推送测试"""
+
+    def _stream(self, buffer_size=10):
+        from app.modules.downloader.live import DownloadEventStream
+        stream = DownloadEventStream(buffer_size)
+        stream._started = True  # 不注册到全局事件总线
+        return stream
+
+    def _read(self, stream, last_event_id=None):
+        chunks = list(stream.stream(last_event_id, heartbeat=0.01, max_duration=0.05))
+        return [chunk for chunk in chunks if chunk.startswith('id:')]
+
+    def test_resume_with_last_event_id(self):
+        """测试携带 Last-Event-ID 续传错过的增量"""
+        stream = self._stream()
+        first = stream.publish({'id': 'a', 'progress': 10})
+        stream.publish({'id': 'a', 'progress': 20})
+        stream.publish({'id': 'a', 'progress': 30})
+
+        events = self._read(stream, first)
+        assert len(events) == 2
+        assert '"progress": 20' in events[0]
+        assert events[1].startswith(f'id: {stream.epoch}-3\nevent: download\n')
+
+    def test_new_connection_only_gets_new_events(self):
+        """测试新连接不重放历史增量"""
+        stream = self._stream()
+        stream.publish({'id': 'a', 'progress': 10})
+        assert self._read(stream) == []
+
+    def test_reset_when_resume_impossible(self):
+        """测试缓冲区已覆盖或服务重启后发送 reset"""
+        stream = self._stream(buffer_size=2)
+        first = stream.publish({'id': 'a', 'progress': 1})
+        for progress in range(2, 6):
+            stream.publish({'id': 'a', 'progress': progress})
+
+        assert 'event: reset' in self._read(stream, first)[0]
+        assert 'event: reset' in self._read(stream, 'stale-epoch-1')[0]
@@ -0,0 +1,683 @@
+# -*- coding: utf-8 -*-
+"""
+文件管理测试
+"""
+
+import os
+
+import pytest
+
+from app.modules.files.index import LibraryIndex
+
+
+def _touch(path, size=1, mtime=None):
+    path.write_bytes(b'x' * size)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return path
+
+
+class TestLibraryIndex:
+    """下载目录索引测试"""
+
+    def test_list_sorted_with_kind(self, tmp_path):
+        """测试文件列表按修改时间倒序并标注类型，忽略子目录"""
+        _touch(tmp_path / 'old.mp4', 10, mtime=1000)
+        _touch(tmp_path / 'new.srt', 20, mtime=2000)
+        (tmp_path / 'subdir').mkdir()
+
+        files = LibraryIndex(tmp_path).list_files()
+        assert [(f['name'], f['size'], f['kind']) for f in files] == [
+            ('new.srt', 20, 'subtitle'), ('old.mp4', 10, 'video')]
+
+    def test_incremental_rescan_only_stats_new_files(self, tmp_path):
+        """测试目录项变化时只对新增文件 stat，已删除的文件被移除"""
+        _touch(tmp_path / 'a.mp4')
+        _touch(tmp_path / 'b.mp4')
+        index = LibraryIndex(tmp_path)
+        assert len(index.list_files()) == 2
+        assert index.get_stats()['stats'] == 2
+
+        (tmp_path / 'a.mp4').unlink()
+        _touch(tmp_path / 'c.mp3')
+        assert sorted(f['name'] for f in index.list_files()) == ['b.mp4', 'c.mp3']
+        assert index.get_stats()['stats'] == 3
+
+    def test_unchanged_directory_skips_rescan(self, tmp_path):
+        """测试目录未变化（且不在 mtime 精度窗口内）时不重新列出"""
+        _touch(tmp_path / 'a.mp4')
+        os.utime(tmp_path, (1000, 1000))
+        index = LibraryIndex(tmp_path)
+        index.list_files()
+        index.list_files()
+        index.get('a.mp4')
+        assert index.get_stats()['rescans'] == 1
+
+    def test_find_refresh_and_reconcile(self, tmp_path):
+        """测试按前缀/子串查找，单文件更新与完整核对修正大小"""
+        _touch(tmp_path / 'temp_abc_Video Title.mp4', 5)
+        _touch(tmp_path / 'temp_abc_Video Title.en.vtt', 1)
+        _touch(tmp_path / 'Other.mp4', 1)
+        index = LibraryIndex(tmp_path)
+
+        assert [p.name for p in index.find(prefix='temp_abc_')] == [
+            'temp_abc_Video Title.en.vtt', 'temp_abc_Video Title.mp4']
+        assert [p.name for p in index.find(contains='Other')] == ['Other.mp4']
+
+        _touch(tmp_path / 'Other.mp4', 50)   # 原地修改不改变目录 mtime
+        os.utime(tmp_path, (1000, 1000))
+        index.reconcile()
+        assert index.get('Other.mp4')['size'] == 50
+
+        _touch(tmp_path / 'Other.mp4', 70)
+        index.refresh(tmp_path / 'Other.mp4')
+        assert index.get('Other.mp4')['size'] == 70
+
+        index.discard('Other.mp4')
+        assert index.get('Other.mp4') is None
+
+    def test_cursor_pagination_and_filters(self, tmp_path):
+        """测试游标分页遍历全部文件且不重复，过滤与排序方向生效"""
+        for i in range(25):
+            _touch(tmp_path / f'v{i:02d}.mp4', i + 1, mtime=1000 + i // 2)  # 修改时间有重复
+        for i in range(5):
+            _touch(tmp_path / f'a{i}.mp3', 100, mtime=5000 + i)
+        index = LibraryIndex(tmp_path)
+
+        names, cursor = [], None
+        while True:
+            page = index.page(sort='modified', cursor=cursor, limit=7, kinds=['video'])
+            names.extend(item['name'] for item in page['items'])
+            if not page['has_more']:
+                break
+            cursor = page['next_cursor']
+        assert len(names) == 25 and len(set(names)) == 25
+        assert names[0] == 'v24.mp4' and names[-1] == 'v00.mp4'
+
+        page = index.page(sort='name', order='asc', limit=3, extensions=['MP3'])
+        assert [item['name'] for item in page['items']] == ['a0.mp3', 'a1.mp3', 'a2.mp3']
+        page = index.page(sort='name', order='asc', cursor=page['next_cursor'], limit=3, extensions=['mp3'])
+        assert [item['name'] for item in page['items']] == ['a3.mp3', 'a4.mp3']
+        assert page['next_cursor'] is None
+
+        page = index.page(sort='size', limit=2, query='V1', modified_from=1005)
+        assert [item['name'] for item in page['items']] == ['v19.mp4', 'v18.mp4']
+
+        assert index.get_summary() == {'total': 30, 'total_size': 825, 'by_kind': {'video': 25, 'audio': 5}}
+
+    def test_invalid_cursor_and_sort(self, tmp_path):
+        """测试无效游标与排序字段"""
+        index = LibraryIndex(tmp_path)
+        with pytest.raises(ValueError):
+            index.page(cursor='not-a-cursor')
+        with pytest.raises(ValueError):
+            index.page(sort='owner')
+
+    def test_cursor_rejected_for_other_sort(self, tmp_path):
+        """测试换用其他排序字段时拒绝旧游标"""
+        for i in range(3):
+            (tmp_path / f'{i}.mp4').write_bytes(b'x' * (i + 1))
+        index = LibraryIndex(tmp_path)
+
+        cursor = index.page(sort='modified', limit=1)['next_cursor']
+        assert index.page(sort='modified', cursor=cursor, limit=1)['items']
+        for sort in ('name', 'size'):
+            with pytest.raises(ValueError):
+                index.page(sort=sort, cursor=cursor)
+        with pytest.raises(ValueError):
+            index.page(sort='name', cursor=LibraryIndex.encode_cursor('name', 1.5, '0.mp4'))
+
+
+class TestStreaming:
+    """文件流式发送测试"""
+
+    @pytest.fixture
+    def video(self, tmp_path):
+        path = tmp_path / '视频.mp4'
+        path.write_bytes(bytes(range(256)) * 40)
+        return path
+
+    def _send(self, path, headers=None, method='GET', **kwargs):
+        from flask import Flask
+        from app.modules.files.streaming import send_media
+
+        app = Flask(__name__)
+        with app.test_request_context(headers=headers or {}, method=method):
+            response = send_media(path, 'video/mp4', **kwargs)
+            body = b''.join(response.response)
+            response.close()
+            return response, body
+
+    def test_range_is_bounded(self, video):
+        """测试 Range 区间只发送区间内的字节，结尾越界时截断到文件末尾"""
+        response, body = self._send(video, {'Range': 'bytes=100-299'})
+        assert response.status_code == 206
+        assert response.headers['Content-Range'] == 'bytes 100-299/10240'
+        assert response.headers['Content-Length'] == '200'
+        assert body == video.read_bytes()[100:300]
+
+        response, body = self._send(video, {'Range': 'bytes=10000-20000'})
+        assert response.headers['Content-Range'] == 'bytes 10000-10239/10240'
+        assert body == video.read_bytes()[10000:]
+
+    def test_full_file_as_attachment(self, video):
+        """测试完整下载与非ASCII文件名的附件头"""
+        response, body = self._send(video, as_attachment=True)
+        assert response.status_code == 200
+        assert body == video.read_bytes()
+        assert "filename*=UTF-8''%E8%A7%86%E9%A2%91.mp4" in response.headers['Content-Disposition']
+
+    def test_unsatisfiable_range(self, video):
+        """测试没有可满足区间时返回 416 并附带 Content-Range"""
+        from werkzeug.exceptions import RequestedRangeNotSatisfiable
+        with pytest.raises(RequestedRangeNotSatisfiable) as excinfo:
+            self._send(video, {'Range': 'bytes=20000-'})
+        assert ('Content-Range', 'bytes */10240') in excinfo.value.get_headers()
+
+    def test_suffix_and_multi_range(self, video):
+        """测试后缀区间与多区间（重叠区间合并）"""
+        data = video.read_bytes()
+        response, body = self._send(video, {'Range': 'bytes=-500'})
+        assert response.headers['Content-Range'] == 'bytes 9740-10239/10240'
+        assert body == data[-500:]
+
+        response, body = self._send(video, {'Range': 'bytes=0-9, 5-19, 100-109'})
+        assert response.status_code == 206
+        boundary = response.content_type.split('boundary=')[1]
+        assert response.mimetype == 'multipart/byteranges'
+        assert int(response.headers['Content-Length']) == len(body)
+        parts = body.split(f'--{boundary}'.encode())
+        assert len(parts) == 4 and parts[-1] == b'--\r\n'
+        assert b'Content-Range: bytes 0-19/10240\r\n\r\n' + data[0:20] + b'\r\n' in parts[1]
+        assert parts[2].endswith(b'Content-Range: bytes 100-109/10240\r\n\r\n' + data[100:110] + b'\r\n')
+
+        response, body = self._send(video, {'Range': 'items=0-9'})  # 无效语法忽略 Range
+        assert response.status_code == 200 and body == data
+
+    def test_conditional_requests(self, video):
+        """测试 ETag/Last-Modified 条件请求与 If-Range"""
+        response, _ = self._send(video)
+        etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+        assert response.headers['Cache-Control'].startswith('private, max-age=')
+
+        response, body = self._send(video, {'If-None-Match': etag})
+        assert response.status_code == 304 and body == b''
+        response, _ = self._send(video, {'If-Modified-Since': last_modified})
+        assert response.status_code == 304
+
+        response, _ = self._send(video, {'Range': 'bytes=0-9', 'If-Range': etag})
+        assert response.status_code == 206
+        response, body = self._send(video, {'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+        assert response.status_code == 200 and len(body) == 10240
+
+        from werkzeug.exceptions import PreconditionFailed
+        with pytest.raises(PreconditionFailed):
+            self._send(video, {'If-Match': '"stale"'})
+
+    def test_head_has_headers_only(self, video):
+        """测试 HEAD 只返回头部"""
+        response, body = self._send(video, {'Range': 'bytes=0-99'}, method='HEAD')
+        assert response.status_code == 206
+        assert response.headers['Content-Length'] == '100'
+        assert body == b''
+
+    def test_nginx_offload(self, video, monkeypatch):
+        """测试 nginx 卸载时只返回 X-Accel-Redirect 头"""
+        from app.core import config as config_module
+        options = {'files.streaming.offload': 'nginx', 'files.streaming.accel_prefix': '/protected/'}
+        monkeypatch.setattr(config_module, 'get_config', lambda key, default=None: options.get(key, default))
+
+        response, body = self._send(video, {'Range': 'bytes=0-1'})
+        assert response.headers['X-Accel-Redirect'] == '/protected/%E8%A7%86%E9%A2%91.mp4'
+        assert body == b''
+
+
+class TestThumbnails:
+    """缩略图缓存测试"""
+
+    class _InlineExecutor:
+        def submit(self, fn, *args):
+            fn(*args)
+
+    def _service(self, cache_dir):
+        from app.modules.files.thumbnails import ThumbnailService
+        service = ThumbnailService()
+        service.cache_dir = cache_dir
+        service.executor = self._InlineExecutor()
+        service.running = True
+        return service
+
+    def test_content_key_follows_content(self, tmp_path):
+        """测试缓存键与文件名无关，内容变化后改变"""
+        from app.modules.files.thumbnails import content_key
+        video = tmp_path / 'a.mp4'
+        video.write_bytes(b'a' * 300000)
+        key = content_key(video)
+
+        video.rename(tmp_path / 'b.mp4')
+        assert content_key(tmp_path / 'b.mp4') == key
+        (tmp_path / 'b.mp4').write_bytes(b'a' * 299999 + b'b')
+        assert content_key(tmp_path / 'b.mp4') != key
+
+    def test_cached_preview_is_reused(self, tmp_path, monkeypatch):
+        """测试已有缓存直接加载，列表查询只读内存"""
+        import json
+        from app.modules.files.thumbnails import ThumbnailService, content_key
+
+        video = tmp_path / 'v.mp4'
+        video.write_bytes(b'v' * 1000)
+        cache_dir = tmp_path / 'thumbs'
+        cache_dir.mkdir()
+        key = content_key(video)
+        (cache_dir / f'{key}.jpg').write_bytes(b'jpg')
+        (cache_dir / f'{key}.json').write_text(json.dumps({
+            'poster': f'{key}.jpg', 'duration': 60.0,
+            'sprite': {'file': f'{key}_sprite.jpg', 'interval': 1.0, 'columns': 10, 'rows': 10,
+                       'count': 60, 'tile_width': 160},
+        }))
+
+        def fail(*args):
+            raise AssertionError('不应调用 ffmpeg')
+
+        monkeypatch.setattr(ThumbnailService, 'generate', fail)
+        service = self._service(cache_dir)
+        stat = video.stat()
+
+        assert service.get_urls(video, stat.st_size, stat.st_mtime) is None  # 首次查询排队加载
+        urls = service.get_urls(video, stat.st_size, stat.st_mtime)
+        assert urls['thumbnail'] == f'/files/thumbs/{key}.jpg'
+        assert urls['preview']['url'] == f'/files/thumbs/{key}_sprite.jpg'
+        assert urls['preview']['count'] == 60
+        assert service.get_stats()['reused'] == 1
+
+    def test_failed_generation_not_retried(self, tmp_path, monkeypatch):
+        """测试生成失败的文件不会反复排队"""
+        from app.modules.files.thumbnails import ThumbnailService
+
+        video = tmp_path / 'broken.mp4'
+        video.write_bytes(b'x' * 10)
+        calls = []
+
+        def fail(self, path, key):
+            calls.append(path)
+            raise RuntimeError('invalid data')
+
+        monkeypatch.setattr(ThumbnailService, 'generate', fail)
+        service = self._service(tmp_path / 'thumbs')
+        service.enqueue(video)
+        service.enqueue(video)
+        assert len(calls) == 1
+        assert service.get_stats()['failed'] == 1
+
+
+def _box(box_type, payload=b''):
+    import struct
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+class TestHls:
+    """HLS 按需封装测试"""
+
+    def test_plan_segments_on_keyframes(self):
+        """测试按关键帧切分分片，首个分片较短"""
+        from app.modules.files.hls import plan_segments
+
+        keyframes = [0.0, 1.0, 2.0, 4.0, 8.0, 10.0, 14.0, 16.0]
+        segments = plan_segments(keyframes, 18.0, target=6, first_target=2)
+        assert segments == [[0.0, 2.0], [2.0, 6.0], [8.0, 6.0], [14.0, 4.0]]
+        assert plan_segments([], 5.0, 6, 2) == [[0.0, 5.0]]
+
+    def test_split_fragmented_mp4(self, tmp_path):
+        """测试分片 MP4 拆分为初始化段与片段，已有初始化段不覆盖"""
+        from app.modules.files.hls import split_fragmented_mp4
+
+        init = _box(b'ftyp', b'iso6') + _box(b'moov', b'\x00' * 16)
+        fragments = _box(b'moof', b'\x01' * 8) + _box(b'mdat', b'\x02' * 32)
+        source = tmp_path / 'out.mp4'
+        source.write_bytes(init + fragments)
+
+        split_fragmented_mp4(source, tmp_path / 'init.mp4', tmp_path / '0.m4s')
+        assert (tmp_path / 'init.mp4').read_bytes() == init
+        assert (tmp_path / '0.m4s').read_bytes() == fragments
+        assert list(tmp_path.glob('*.tmp')) == []
+
+        source.write_bytes(_box(b'ftyp', b'isoX') + _box(b'moov') + fragments)
+        split_fragmented_mp4(source, tmp_path / 'init.mp4', tmp_path / '1.m4s')
+        assert (tmp_path / 'init.mp4').read_bytes() == init
+
+        source.write_bytes(init)
+        with pytest.raises(ValueError):
+            split_fragmented_mp4(source, tmp_path / 'init.mp4', tmp_path / '2.m4s')
+
+    def test_temp_names_unique(self, tmp_path):
+        """测试临时文件名互不相同（多进程同时生成同一分片时不写同一文件）"""
+        from app.modules.files.hls import _temp_path
+
+        names = {_temp_path(tmp_path / '3.mp4') for _ in range(20)}
+        assert len(names) == 20
+        assert all(name.parent == tmp_path and str(os.getpid()) in name.name for name in names)
+
+    def test_playlist_and_lru_eviction(self, tmp_path, monkeypatch):
+        """测试播放列表来自缓存索引，分片缓存超过上限时淘汰最久未访问的分片"""
+        from app.modules.files.hls import HlsPackager
+
+        video = tmp_path / 'movie.mkv'
+        video.write_bytes(b'x' * 100)
+        packager = HlsPackager(tmp_path / 'hls', max_bytes=25)
+        key = packager.get_key(video)
+        packager._indexes[key] = {'key': key, 'duration': 8.5, 'audio_codec': 'opus',
+                                  'segments': [[0.0, 2.0], [2.0, 6.5]]}
+
+        playlist = packager.playlist(video, '{number}.m4s?v=1', 'init.mp4?v=1')
+        assert '#EXT-X-TARGETDURATION:7' in playlist
+        assert '#EXT-X-MAP:URI="init.mp4?v=1"' in playlist
+        assert playlist.splitlines()[-3:] == ['#EXTINF:6.500000,', '1.m4s?v=1', '#EXT-X-ENDLIST']
+
+        calls = []
+
+        def remux(self, path, index, number, directory, segment_path):
+            calls.append(number)
+            directory.mkdir(parents=True, exist_ok=True)
+            segment_path.write_bytes(b's' * 10)
+
+        monkeypatch.setattr(HlsPackager, '_remux', remux)
+        first = packager.segment(video, 0)
+        packager.segment(video, 0)
+        assert calls == [0]
+        assert packager._key_locks == {}  # 生成完成后不保留分片锁
+
+        packager.cache.max_bytes = 15
+        second = packager.segment(video, 1)
+        assert not first.exists() and second.exists()
+        with pytest.raises(IndexError):
+            packager.segment(video, 2)
+
+    def test_cache_limit_shared_between_processes(self, tmp_path, monkeypatch):
+        """测试多个进程共用缓存上限：淘汰前重新扫描磁盘，分片全部淘汰后删除目录，被淘汰的分片重新生成"""
+        from app.modules.files import hls
+        from app.modules.files.hls import HlsPackager
+
+        def remux(self, path, index, number, directory, segment_path):
+            (directory / 'init.mp4').write_bytes(b'i')
+            segment_path.write_bytes(b's' * 10)
+
+        monkeypatch.setattr(HlsPackager, '_remux', remux)
+        packagers, videos = [], []
+        for name in ('a.mkv', 'b.mkv'):
+            video = tmp_path / name
+            video.write_bytes(name.encode() * 10)
+            packager = HlsPackager(tmp_path / 'hls', max_bytes=25)  # 模拟两个工作进程
+            key = packager.get_key(video)
+            packager._indexes[key] = {'key': key, 'duration': 4.0, 'segments': [[0.0, 2.0], [2.0, 2.0]]}
+            packagers.append(packager)
+            videos.append(video)
+
+        for packager, video in zip(packagers, videos):
+            for number in (0, 1):
+                path = packager.segment(video, number)
+                os.utime(path, (1000 + len(list((tmp_path / 'hls').glob('*/*.m4s'))),) * 2)
+        total = sum(p.stat().st_size for p in (tmp_path / 'hls').glob('*/*.m4s'))
+        assert total <= 25
+        first_dir = tmp_path / 'hls' / packagers[0].get_key(videos[0])
+        assert not first_dir.exists()  # 分片全部淘汰，初始化段一起删除
+
+        assert packagers[0].segment(videos[0], 0).exists()
+        assert (first_dir / 'init.mp4').exists()
+
+        monkeypatch.setattr(hls, 'MAX_MEMO_ENTRIES', 2)
+        for i in range(5):
+            packagers[0]._remember(packagers[0]._indexes, f'k{i}', {})
+        assert list(packagers[0]._indexes) == ['k3', 'k4']
+
+    def test_evicted_file_resent_after_regeneration(self, tmp_path):
+        """测试返回路径后文件被其他进程淘汰时，重新生成并正常发送"""
+        from flask import Flask
+        from app.modules.files.routes import _send_hls_file
+
+        path = tmp_path / '0.m4s'
+        calls = []
+
+        def resolve():
+            calls.append(path.exists())
+            if len(calls) == 2:
+                path.write_bytes(b'segment')
+            return path
+
+        app = Flask(__name__)
+        with app.test_request_context():
+            response = _send_hls_file(resolve, 'video/iso.segment')
+            body = b''.join(response.response)
+        assert response.status_code == 200 and body == b'segment'
+        assert calls == [False, False]
+
+
+class TestExport:
+    """批量导出测试"""
+
+    @pytest.fixture
+    def files(self, tmp_path):
+        paths = []
+        for name, size in (('a.mp4', 1000), ('视频 二.mkv', 70000), ('empty.srt', 0)):
+            path = tmp_path / name
+            path.write_bytes(os.urandom(size))
+            paths.append(path)
+        return paths
+
+    @pytest.mark.parametrize('fmt', ['zip', 'tar'])
+    def test_archive_roundtrip_and_resume(self, files, fmt):
+        """测试归档可以被标准库读取，任意偏移续传拼接后与完整归档一致"""
+        import io
+        import tarfile
+        import zipfile
+        from app.modules.files import export
+        from app.modules.files.export import ArchiveStream
+
+        stream = ArchiveStream(files, fmt)
+        data = b''.join(stream.iter_range(chunk_size=4096))
+        assert len(data) == stream.size
+
+        if fmt == 'zip':
+            archive = zipfile.ZipFile(io.BytesIO(data))
+            assert archive.testzip() is None
+            contents = {name: archive.read(name) for name in archive.namelist()}
+        else:
+            archive = tarfile.open(fileobj=io.BytesIO(data))
+            contents = {name: archive.extractfile(name).read() for name in archive.getnames()}
+        assert contents == {path.name: path.read_bytes() for path in files}
+
+        for cut in (10, 1500, 40000, stream.size - 30):
+            export._crc_cache.clear()  # 续传时需要补算跳过部分的 CRC
+            assert b''.join(stream.iter_range(0, cut - 1)) + b''.join(stream.iter_range(cut)) == data
+
+    def test_send_archive_range(self, files):
+        """测试归档响应的 Content-Length、Range 与 If-Range"""
+        from flask import Flask
+        from app.modules.files.export import ArchiveStream, send_archive
+
+        stream = ArchiveStream(files, 'zip')
+        full = b''.join(stream.iter_range())
+        app = Flask(__name__)
+
+        with app.test_request_context(headers={'Range': 'bytes=500-', 'If-Range': f'"{stream.etag}"'}):
+            response = send_archive(stream, 'export.zip')
+            assert response.status_code == 206
+            assert response.headers['Content-Range'] == f'bytes 500-{stream.size - 1}/{stream.size}'
+            assert b''.join(response.response) == full[500:]
+
+        with app.test_request_context(headers={'Range': 'bytes=500-', 'If-Range': '"changed"'}):
+            response = send_archive(stream, 'export.zip')
+            assert response.status_code == 200
+            assert response.headers['Content-Length'] == str(stream.size)
+            response.close()
+
+        files[0].write_bytes(b'changed')
+        with pytest.raises(RuntimeError):
+            b''.join(stream.iter_range())
+
+
+class TestDedup:
+    """重复文件合并测试"""
+
+    @pytest.fixture
+    def db(self, tmp_path):
+        from app.core.database import Database
+        database = Database(str(tmp_path / 'test.db'), pool_size=2)
+        yield database
+        database.close()
+
+    def test_duplicates_share_data(self, tmp_path, db, monkeypatch):
+        """测试内容相同的文件合并为共享数据，部分哈希相同但内容不同的文件保留"""
+        from app.modules.files.dedup import DedupService
+
+        monkeypatch.setattr(DedupService, '_downloads_active', staticmethod(lambda: False))
+        library = tmp_path / 'downloads'
+        library.mkdir()
+        content = os.urandom(2 * 1024 * 1024)
+        # 中间字节不同：大小与首尾采样相同，只有完整哈希能区分
+        similar = content[:1024 * 1024] + b'\0' + content[1024 * 1024 + 1:]
+        for name, data, mtime in (('video.mp4', content, 1000), ('video (2).mp4', content, 2000),
+                                  ('other.mp4', similar, 3000)):
+            (library / name).write_bytes(data)
+            os.utime(library / name, (mtime, mtime))
+
+        service = DedupService()
+        index = LibraryIndex(library)
+        result = service.run_once(db=db, index=index)
+
+        assert result['hashed'] == 3 and result['full_hashed'] == 3
+        assert result['linked'] == 1 and result['reclaimed_bytes'] == len(content)
+        assert (library / 'video (2).mp4').read_bytes() == content
+        assert (library / 'other.mp4').read_bytes() == similar
+        assert os.path.samefile(library / 'video.mp4', library / 'video (2).mp4') or \
+            db.get_file_hashes()['video.mp4']['linked_to'] == 'video (2).mp4'
+        # 合并后没有文件的修改时间变早（最新的文件为数据源）
+        assert os.stat(library / 'video (2).mp4').st_mtime == 2000
+        assert os.stat(library / 'video.mp4').st_mtime >= 1000
+        assert not os.path.samefile(library / 'video.mp4', library / 'other.mp4')
+        assert db.state_get('file_dedup', 'stats') == {'linked_files': 1, 'reclaimed_bytes': len(content)}
+
+        # 再次执行：文件未变化，不重新读取
+        result = service.run_once(db=db, index=index)
+        assert result['hashed'] == 0 and result['full_hashed'] == 0 and result['linked'] == 0
+
+        (library / 'other.mp4').unlink()
+        service.run_once(db=db, index=index)
+        assert set(db.get_file_hashes()) == {'video.mp4', 'video (2).mp4'}
+
+    def test_partial_hash_pauses_during_downloads(self, tmp_path, db, monkeypatch):
+        """测试有下载进行时部分哈希也暂停，暂停期间停止则中断且不读取文件"""
+        from app.modules.files.dedup import DedupService
+
+        service = DedupService()
+        reads = []
+        # 暂停等待期间收到停止信号
+        monkeypatch.setattr(service, '_downloads_active', lambda: service.stop_event.set() or True)
+        monkeypatch.setattr('app.modules.files.thumbnails.content_key',
+                            lambda path, stat=None: reads.append(path) or 'key')
+        library = tmp_path / 'downloads'
+        library.mkdir()
+        _touch(library / 'video.mp4', size=2 * 1024 * 1024, mtime=1000)
+
+        result = service.run_once(db=db, index=LibraryIndex(library))
+        assert result['interrupted'] and result['hashed'] == 0
+        assert reads == [] and db.get_file_hashes() == {}
+
+    def test_hardlink_keeps_newest_mtime(self, tmp_path, db, monkeypatch):
+        """测试硬链接合并后刚下载的副本不会继承旧副本的修改时间"""
+        from app.core import config as config_module
+        from app.modules.files.dedup import DedupService
+
+        options = {'files.dedup.mode': 'hardlink', 'files.dedup.settle_seconds': 0}
+        monkeypatch.setattr(config_module, 'get_config', lambda key, default=None: options.get(key, default))
+        monkeypatch.setattr(DedupService, '_downloads_active', staticmethod(lambda: False))
+        library = tmp_path / 'downloads'
+        library.mkdir()
+        content = os.urandom(2 * 1024 * 1024)
+        (library / 'old.mp4').write_bytes(content)
+        os.utime(library / 'old.mp4', (1000, 1000))
+        (library / 'new.mp4').write_bytes(content)
+
+        service = DedupService()
+        index = LibraryIndex(library)
+        newest = os.stat(library / 'new.mp4').st_mtime_ns
+        assert service.run_once(db=db, index=index)['linked'] == 1
+        assert os.path.samefile(library / 'old.mp4', library / 'new.mp4')
+        assert os.stat(library / 'new.mp4').st_mtime_ns == newest
+
+        # 之后又下载了一份：已合并的两个文件都改为共享最新副本的数据
+        (library / 'newer.mp4').write_bytes(content)
+        index.refresh(library / 'newer.mp4')
+        newest = os.stat(library / 'newer.mp4').st_mtime_ns
+        assert service.run_once(db=db, index=index)['linked'] == 2
+        for name in ('old.mp4', 'new.mp4'):
+            assert os.path.samefile(library / name, library / 'newer.mp4')
+        assert os.stat(library / 'newer.mp4').st_mtime_ns == newest
+
+
+class TestMediaCatalog:
+    """媒体信息目录测试"""
+
+    @pytest.fixture
+    def db(self, tmp_path, monkeypatch):
+        from app.core.database import Database
+        database = Database(str(tmp_path / 'test.db'), pool_size=2)
+        monkeypatch.setattr('app.core.database.get_database', lambda: database)
+        yield database
+        database.close()
+
+    def test_playback(self, tmp_path):
+        """测试按实际容器与编码判断 MIME 类型和播放方式"""
+        from app.modules.files.catalog import _mimetype, get_playback
+
+        assert _mimetype(tmp_path / 'a.mkv', 'matroska,webm', True) == 'video/x-matroska'
+        assert _mimetype(tmp_path / 'a.webm', 'matroska,webm', False) == 'audio/webm'
+        assert _mimetype(tmp_path / 'a.mkv', 'mov,mp4,m4a,3gp,3g2,mj2', True) == 'video/mp4'
+
+        assert get_playback(None) is None
+        assert get_playback({'mimetype': 'video/mp4', 'video_codec': 'h264'}) == 'direct'
+        assert get_playback({'mimetype': 'audio/mpeg', 'video_codec': None}) == 'direct'
+        assert get_playback({'mimetype': 'video/x-matroska', 'video_codec': 'h264'}) == 'hls'
+        assert get_playback({'mimetype': 'video/mp4', 'video_codec': 'hevc'}) == 'hls'
+        assert get_playback({'mimetype': 'video/x-msvideo', 'video_codec': 'mpeg4'}) is None
+
+    def test_probe_once(self, tmp_path, db, monkeypatch):
+        """测试每个文件只探测一次，文件变化后重新探测，并保留下载信息"""
+        from app.modules.files.catalog import MediaCatalog
+
+        probes = []
+
+        def fake_probe(self, path):
+            probes.append(path.name)
+            stat = path.stat()
+            return {'name': path.name, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                    'mimetype': 'video/x-matroska', 'container': 'matroska,webm', 'duration': None,
+                    'width': 1920, 'height': 1080, 'video_codec': 'h264', 'audio_codec': 'opus',
+                    'bit_rate': None, 'info': {}}
+
+        monkeypatch.setattr(MediaCatalog, 'probe', fake_probe)
+        library = tmp_path / 'downloads'
+        library.mkdir()
+        _touch(library / 'video.mkv', size=10, mtime=1000)
+
+        catalog = MediaCatalog()
+        entry = catalog.record(library / 'video.mkv', {'title': '标题', 'duration': 12.5, 'formats': []})
+        assert entry['duration'] == 12.5 and entry['info'] == {'title': '标题', 'duration': 12.5}
+
+        # 新实例（模拟其他进程）从数据库读取，不再探测
+        index = LibraryIndex(library)
+        found = MediaCatalog().lookup_many(index.list_files(), root=library, db=db)
+        assert found['video.mkv']['video_codec'] == 'h264'
+        assert found['video.mkv']['info']['title'] == '标题'
+        assert MediaCatalog().get(library / 'video.mkv')['width'] == 1920
+        assert probes == ['video.mkv']
+
+        # 文件变化后记录失效；未运行的目录只读取不探测
+        _touch(library / 'video.mkv', size=20, mtime=2000)
+        assert MediaCatalog().lookup(library / 'video.mkv') is None
+        assert probes == ['video.mkv']
+        entry = catalog.get(library / 'video.mkv')
+        assert entry['size'] == 20 and entry['info']['title'] == '标题'
+        assert probes == ['video.mkv', 'video.mkv']
+
+        db.prune_media_entries([])
+        assert db.get_media_entries(['video.mkv']) == {}
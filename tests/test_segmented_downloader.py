@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+分段下载器测试 - 使用本地HTTP服务器
+"""
+
+import os
+import re
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.modules.downloader.segmented import SegmentedDownloader, SegmentError
+
+
+class _RangeHandler(BaseHTTPRequestHandler):
+    """支持Range请求的测试处理器"""
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self._respond(head=True)
+
+    def do_GET(self):
+        self._respond(head=False)
+
+    def _respond(self, head):
+        server = self.server
+        content = server.content
+        range_header = self.headers.get('Range')
+
+        if not server.ranges or not range_header:
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(content)))
+            if server.ranges:
+                self.send_header('Accept-Ranges', 'bytes')
+            self.end_headers()
+            if not head:
+                self.wfile.write(content)
+            return
+
+        match = re.match(r'bytes=(\d+)-(\d*)', range_header)
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else len(content) - 1
+
+        with server.lock:
+            server.requests.append((start, end))
+            fail = server.fail_once.pop(start, False)
+            status = server.fail_status.get(start)
+
+        if status:
+            self.send_response(status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body = content[start:end + 1]
+        self.send_response(206)
+        self.send_header('Content-Range', f'bytes {start}-{end}/{len(content)}')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+
+        if head:
+            return
+        if fail:
+            # 模拟连接中途断开：只发送一半数据
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            self.connection.shutdown(2)
+            return
+        if server.delay:
+            # 慢速发送：每 64KB 暂停一次
+            try:
+                for offset in range(0, len(body), 64 * 1024):
+                    self.wfile.write(body[offset:offset + 64 * 1024])
+                    self.wfile.flush()
+                    time.sleep(server.delay)
+            except OSError:
+                pass
+            return
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def range_server():
+    """启动本地Range测试服务器"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _RangeHandler)
+    server.content = os.urandom(3 * 1024 * 1024 + 123)
+    server.ranges = True
+    server.fail_once = {}
+    server.fail_status = {}
+    server.delay = 0
+    server.requests = []
+    server.lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _url(server):
+    return f'http://127.0.0.1:{server.server_address[1]}/video.mp4'
+
+
+class TestSegmentedDownloader:
+    """分段下载器测试"""
+
+    def test_probe_detects_ranges(self, range_server):
+        """测试探测Range支持"""
+        info = SegmentedDownloader().probe(_url(range_server))
+        assert info['accept_ranges'] is True
+        assert info['size'] == len(range_server.content)
+
+    def test_probe_without_ranges(self, range_server):
+        """测试服务器不支持Range"""
+        range_server.ranges = False
+        info = SegmentedDownloader().probe(_url(range_server))
+        assert info['accept_ranges'] is False
+
+    def test_parallel_download(self, range_server, tmp_path):
+        """测试并行下载内容完整"""
+        downloader = SegmentedDownloader(connections=4, min_segment_size=256 * 1024)
+        progress = []
+        dest = downloader.download(_url(range_server), str(tmp_path / 'out.mp4'),
+                                   progress_callback=lambda done, total: progress.append(done))
+
+        with open(dest, 'rb') as f:
+            assert f.read() == range_server.content
+        assert len(range_server.requests) == 4
+        assert progress[-1] == len(range_server.content)
+        assert not (tmp_path / 'out.mp4.part').exists()
+
+    def test_segment_retry_resumes(self, range_server, tmp_path):
+        """测试分段失败后从断点续传"""
+        downloader = SegmentedDownloader(connections=3, chunk_size=64 * 1024,
+                                         min_segment_size=256 * 1024, segment_retries=2)
+        segments = downloader.plan_segments(len(range_server.content))
+        range_server.fail_once[segments[1][0]] = True
+
+        dest = downloader.download(_url(range_server), str(tmp_path / 'out.mp4'))
+
+        with open(dest, 'rb') as f:
+            assert f.read() == range_server.content
+        resumed = [start for start, _ in range_server.requests if segments[1][0] < start <= segments[1][1]]
+        assert resumed, "失败的分段应从断点处续传"
+
+    def test_download_requires_ranges(self, range_server, tmp_path):
+        """测试不支持Range时拒绝分段下载"""
+        range_server.ranges = False
+        with pytest.raises(SegmentError):
+            SegmentedDownloader().download(_url(range_server), str(tmp_path / 'out.mp4'))
+
+    def test_failed_segment_stops_others(self, range_server, tmp_path):
+        """测试一个分段失败后其他分段立即停止，不等它们下载完"""
+        downloader = SegmentedDownloader(connections=4, chunk_size=64 * 1024,
+                                         min_segment_size=256 * 1024, segment_retries=0)
+        segments = downloader.plan_segments(len(range_server.content))
+        range_server.fail_status[segments[0][0]] = 500
+        range_server.delay = 0.2  # 其余分段完整下载约需 2.5 秒
+
+        started = time.monotonic()
+        with pytest.raises(SegmentError):
+            downloader.download(_url(range_server), str(tmp_path / 'out.mp4'),
+                                total_size=len(range_server.content))
+        assert time.monotonic() - started < 1.5
+        assert not (tmp_path / 'out.mp4.part').exists()
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+订阅与下载存档测试
+"""
+
+import pytest
+
+from app.core import database
+from app.modules.downloader import archive as archive_module
+from app.modules.downloader.archive import BloomFilter, get_download_archive
+from app.modules.subscriptions.manager import SubscriptionManager
+
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """使用临时数据库"""
+    db = database.Database(str(tmp_path / 'test.db'))
+    monkeypatch.setattr(database, '_db_instance', db)
+    monkeypatch.setattr(archive_module, '_download_archive', None)
+    return db
+
+
+class _FakeYoutubeDL:
+    """模拟扁平提取结果，记录被消费的条目数"""
+
+    consumed = 0
+    video_ids = []
+
+    def __init__(self, opts):
+        self.opts = opts
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def extract_info(self, url, download=False, process=True, ie_key=None):
+        def entries():
+            for video_id in self.video_ids:
+                _FakeYoutubeDL.consumed += 1
+                yield {'_type': 'url', 'ie_key': 'Youtube', 'id': video_id,
+                       'url': f'https://www.youtube.com/watch?v={video_id}'}
+
+        return {'_type': 'playlist', 'title': '测试频道', 'extractor_key': 'YoutubeTab',
+                'entries': entries()}
+
+
+def test_bloom_filter():
+    """测试Bloom过滤器"""
+    bloom = BloomFilter(capacity=1000)
+    bloom.add('youtube abc')
+    assert 'youtube abc' in bloom
+    assert 'youtube xyz' not in bloom
+
+
+def test_archive_roundtrip(temp_db):
+    """测试存档写入与查询"""
+    archive = get_download_archive()
+    assert not archive.contains('Youtube', 'abc')
+    assert archive.add('Youtube', 'abc')
+    assert archive.contains('youtube', 'abc')
+    assert temp_db.archive_contains('youtube abc')
+
+
+def test_fetch_stops_at_first_seen(temp_db, monkeypatch):
+    """测试遇到已存档视频时停止翻页"""
+    import yt_dlp
+    monkeypatch.setattr(yt_dlp, 'YoutubeDL', _FakeYoutubeDL)
+    _FakeYoutubeDL.video_ids = ['new2', 'new1', 'old1', 'old0', 'older']
+    _FakeYoutubeDL.consumed = 0
+
+    get_download_archive().add('Youtube', 'old1')
+
+    title, entries, scanned = SubscriptionManager()._fetch_new_entries('https://www.youtube.com/@test/videos', 50)
+
+    assert title == '测试频道'
+    assert [video_id for _, video_id, _ in entries] == ['new2', 'new1']
+    assert scanned == 3
+    assert _FakeYoutubeDL.consumed == 3
+
+
+def test_first_check_only_seeds_archive(temp_db, monkeypatch):
+    """测试首次检查只记录现有视频而不下载"""
+    import yt_dlp
+    monkeypatch.setattr(yt_dlp, 'YoutubeDL', _FakeYoutubeDL)
+    _FakeYoutubeDL.video_ids = ['a', 'b']
+
+    manager = SubscriptionManager()
+    enqueued = []
+    monkeypatch.setattr(manager, '_enqueue', lambda url, options, sid: enqueued.append(url) or True)
+
+    subscription_id = temp_db.add_subscription('https://www.youtube.com/@test/videos')
+    result = manager.check_subscription(temp_db.get_subscription(subscription_id))
+
+    assert result['success'] and result['enqueued'] == 0
+    assert get_download_archive().contains('Youtube', 'a')
+
+    _FakeYoutubeDL.video_ids = ['c', 'a', 'b']
+    result = manager.check_subscription(temp_db.get_subscription(subscription_id))
+    assert result['enqueued'] == 1
+    assert enqueued == ['https://www.youtube.com/watch?v=c']
+
+
+def test_failed_first_check_still_seeds(temp_db, monkeypatch):
+    """测试首次检查失败后，下一次检查仍只记录现有视频"""
+    import yt_dlp
+    monkeypatch.setattr(yt_dlp, 'YoutubeDL', _FakeYoutubeDL)
+
+    manager = SubscriptionManager()
+    enqueued = []
+    monkeypatch.setattr(manager, '_enqueue', lambda url, options, sid: enqueued.append(url) or True)
+    subscription_id = temp_db.add_subscription('https://www.youtube.com/@test/videos')
+
+    def broken(*args, **kwargs):
+        raise Exception('网络错误')
+    fetch = manager._fetch_new_entries
+    monkeypatch.setattr(manager, '_fetch_new_entries', broken)
+    assert not manager.check_subscription(temp_db.get_subscription(subscription_id))['success']
+    assert temp_db.get_subscription(subscription_id)['seeded_at'] is None
+
+    monkeypatch.setattr(manager, '_fetch_new_entries', fetch)
+    _FakeYoutubeDL.video_ids = ['a', 'b']
+    result = manager.check_subscription(temp_db.get_subscription(subscription_id))
+    assert result['success'] and result['enqueued'] == 0 and enqueued == []
+    assert temp_db.get_subscription(subscription_id)['seeded_at']
+
+
+def test_failed_download_retried_until_limit(temp_db, monkeypatch):
+    """测试入队时不写存档：排队中的视频不重复入队，失败的视频重试到上限为止"""
+    import yt_dlp
+    monkeypatch.setattr(yt_dlp, 'YoutubeDL', _FakeYoutubeDL)
+
+    manager = SubscriptionManager()
+    enqueued = []
+    monkeypatch.setattr(manager, '_enqueue', lambda url, options, sid: enqueued.append(url) or True)
+    subscription_id = temp_db.add_subscription('https://www.youtube.com/@test/videos')
+    _FakeYoutubeDL.video_ids = ['a']
+    manager.check_subscription(temp_db.get_subscription(subscription_id))
+
+    url = 'https://www.youtube.com/watch?v=c'
+    _FakeYoutubeDL.video_ids = ['c', 'a']
+    assert manager.check_subscription(temp_db.get_subscription(subscription_id))['enqueued'] == 1
+    assert not get_download_archive().contains('Youtube', 'c')
+
+    temp_db.save_download_record('d1', url, wait=True)
+    assert manager.check_subscription(temp_db.get_subscription(subscription_id))['enqueued'] == 0
+
+    temp_db.update_download_status('d1', 'failed', wait=True)
+    assert manager.check_subscription(temp_db.get_subscription(subscription_id))['enqueued'] == 1
+
+    for i in (2, 3):
+        temp_db.save_download_record(f'd{i}', url, wait=True)
+        temp_db.update_download_status(f'd{i}', 'failed', wait=True)
+    assert manager.check_subscription(temp_db.get_subscription(subscription_id))['enqueued'] == 0
+    assert enqueued == [url, url]
+
+
+def test_routes_validate_backfill_and_check_in_background(client, temp_db, monkeypatch):
+    """测试 backfill 非整数返回 400，立即检查在后台提交且不在请求线程中执行"""
+    from app.core.auth import auth_manager
+    from app.modules.subscriptions.manager import get_subscription_manager
+
+    headers = {'Authorization': f"Bearer {auth_manager.generate_token({'id': 1, 'username': 'admin'})}"}
+    response = client.post('/subscriptions/add', headers=headers,
+                           json={'url': 'https://www.youtube.com/@test', 'backfill': 'many'})
+    assert response.status_code == 400
+
+    submitted = []
+    monkeypatch.setattr(get_subscription_manager(), '_submit_check', submitted.append)
+    subscription_id = temp_db.add_subscription('https://www.youtube.com/@route/videos')
+    response = client.post(f'/subscriptions/check/{subscription_id}', headers=headers)
+    assert response.status_code == 202
+    assert [s['id'] for s in submitted] == [subscription_id]
+    assert client.post('/subscriptions/check/999999', headers=headers).status_code == 404